@@ -0,0 +1,283 @@
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+import scipy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mammothMaster as mm
+from mammothMaster import mammothCache, mammothGrind
+
+# Benchmark suite:
+# times the building blocks of the analysis (recipe construction, the phases of a Grind solve, stat sweeps) and stores
+# the results as a JSON baseline, against which later runs can be compared; a benchmark has regressed when its best
+# time grows past its threshold (a ratio to the baseline's best time, 1.3 unless the baseline says otherwise): the
+# best of several rounds is much less sensitive to whatever else the machine is doing than the median.
+# Everything runs offline and single-threaded, e.g.:
+#   python benchmarks/mammothBench.py --save benchmarks/baseline.json
+#   python benchmarks/mammothBench.py --compare benchmarks/baseline.json
+# which exits with status 1 if anything regressed.
+# The imports suite times importing the package in a fresh interpreter, which is most of what short-lived processes
+# (the batch CLI, spawned workers) spend; besides the comparison with the baseline it has a budget of its own, checked
+# on every run of the suite: importing the package and building every recipe must not import any of HEAVY_MODULES,
+# and getting hold of ALL_STEPS must take at most IMPORT_BUDGET times as long as importing numpy alone. The tests
+# (python -m pytest benchmarks) check the same budget.
+
+THRESHOLD = 1.3
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('scipy.stats', 'scipy.optimize', 'scipy.sparse')
+IMPORT_BUDGET = 1.5
+
+SCORES = dict(Persuasive=300, Watchful=300, Shadowy=300, Dangerous=300, Mith=10, SArts=10, AotRS=10, aPoC=10,
+              MAnatomy=10, Katatox=10)
+
+HELICON = ['Basic Helicon Round', 'Tentacle Helicon Round 2', 'Ungodly Mammoth']
+GRINDS = {'ranching': ['Mammoth from Hell', 'Duplicate Ox Skull'],
+          'ranching_zee': ['Mammoth of the Zee', 'Sell to Theologian', 'Duplicate Seal Skull'],
+          'ranching_all': ['Mammoth from Hell', 'Duplicate Ox Skull', 'Sell HRelic for BFragments',
+                           'Sell HRelic for IBiscuits', 'Mammoth of the Zee', 'Sell to Theologian',
+                           'Duplicate Seal Skull', 'One-winged Mammoth', 'Tentacle Helicon Round 1']}
+
+
+def measure(function, repeat, min_time=0.02):
+    # median and best time of a single call, over repeat rounds; every round makes as many calls as needed to last
+    # at least min_time seconds (as timeit does), since single calls of the smaller steps are too short to time
+
+    function()     # warm-up, so that first-call costs (imports, caches of numpy/scipy) aren't measured
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - start >= min_time:
+            break
+        number *= 2
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start)/number)
+
+    return {'median': float(np.median(times)), 'min': float(np.min(times)), 'repeat': repeat, 'number': number}
+
+
+def bench_recipes(repeat):
+    # build time of every step in ALL_STEPS, with the recipe cache out of the way
+
+    results = {}
+    for name, function in mm.ALL_STEPS.items():
+        results['recipe/' + name] = measure(lambda: function(SCORES), repeat)
+
+    return results
+
+
+def grind_steps(extra):
+
+    return ['Get Mammoth', 'Get 7Necks', 'Generator Skeleton', 'Sell to Entrepreneur', 'Sell to Palaeontologist',
+            'Sell to Zailor', 'Sell to Naive', 'Medium Larceny', 'Painting', 'Upconvert MoDS', *extra, *HELICON]
+
+
+def bench_grinds(repeat):
+    # Grind.__init__ as a whole and split into its phases: building the resource matrix, decomposing it and
+    # optimizing the cycle (with both backends)
+
+    results = {}
+    for label, extra in GRINDS.items():
+
+        steps = grind_steps(extra)
+        results['grind/%s/total' % label] = measure(lambda: mm.Grind(SCORES, steps, overflow_list=[]), repeat)
+        results['grind/%s/total_svd' % label] = measure(
+            lambda: mm.Grind(SCORES, steps, overflow_list=[], solver='svd'), repeat)
+
+        def build():
+            # recipes plus the assembly and masking of the resource matrix, as done by Grind.__init__
+            matrix = np.array([mammothGrind.make_step(step, SCORES).dense() for step in steps]).transpose()
+            return matrix[~(matrix == 0).all(1)]
+        results['grind/%s/build' % label] = measure(build, repeat)
+
+        grind = mm.Grind(SCORES, steps, overflow_list=[])
+        matrix = grind.matrix
+        results['grind/%s/svd' % label] = measure(lambda: np.linalg.svd(matrix[3:]), repeat)
+        results['grind/%s/lp' % label] = measure(lambda: mammothGrind.lp_cycle(matrix, grind.gain), repeat)
+
+        l, v, r = np.linalg.svd(matrix[3:])
+        rank = len(v) - np.isclose(v, 0, atol=5e-16).sum()
+        basis = r[rank:].transpose()
+        if basis.shape[1] > 1:
+            results['grind/%s/optimize' % label] = measure(
+                lambda: mammothGrind.optimize_kernel(basis, grind.gain, matrix[0]), repeat)
+
+    return results
+
+
+def bench_sweeps(repeat):
+    # stat sweeps over a grid of the skill stats and one of the main stats
+
+    steps = grind_steps(GRINDS['ranching'])
+    stats = dict(SCORES)
+    stats['MAnatomy'] = np.arange(4, 16)[:, None, None]
+    stats['Mith'] = np.arange(4, 16)[None, :, None]
+    stats['Shadowy'] = np.arange(100, 400, 25)[None, None, :]
+
+    results = {'sweep/ranching_12x12x12': measure(lambda: mm.Sweep(stats, steps, overflow_list=[]), repeat),
+               'sweep/ranching_12x12x12_compiled': measure(
+                   lambda: mm.Sweep(stats, steps, overflow_list=[], compiled=True), repeat)}
+
+    def loop():
+        for point in np.ndindex(12, 12):
+            mm.Grind(dict(SCORES, MAnatomy=4 + point[0], Mith=4 + point[1]), steps, overflow_list=[])
+    results['sweep/grind_loop_12x12'] = measure(loop, repeat)
+
+    return results
+
+
+def python(code):
+    # runs code in a fresh interpreter (with the package importable) and gives back what it printed
+
+    environ = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    return subprocess.run([sys.executable, '-W', 'ignore', '-c', code], env=environ, check=True,
+                          capture_output=True, text=True).stdout
+
+
+IMPORTS = {'numpy': 'import numpy', 'package': 'import mammothMaster',
+           'recipes': 'from mammothMaster import ALL_STEPS', 'cli': 'import mammothMaster.mammothBatch'}
+
+
+def bench_imports(repeat):
+    # import time in a fresh interpreter (which includes starting python itself, hence numpy's as a reference)
+
+    return {'import/' + label: measure(lambda: python(code), repeat, min_time=0) for label, code in IMPORTS.items()}
+
+
+def check_imports(results):
+    """
+    Checks the import budget (see the top of the module).
+
+    :param results: results of bench_imports
+    :return: list of the ways the budget is exceeded
+    """
+    problems = []
+    loaded = json.loads(python('import sys, json, mammothMaster as mm\n'
+                               'stats = %r\n'
+                               'for function in mm.ALL_STEPS.values():\n'
+                               '    function(stats)\n'
+                               'print(json.dumps([name for name in %r if name in sys.modules]))'
+                               % (SCORES, HEAVY_MODULES)))
+    if loaded:
+        problems.append('importing the package and building the recipes imports %s' % ', '.join(loaded))
+
+    ratio = results['import/recipes']['min']/results['import/numpy']['min']
+    if ratio > IMPORT_BUDGET:
+        problems.append('importing ALL_STEPS takes %.2fx as long as numpy (budget %gx)' % (ratio, IMPORT_BUDGET))
+
+    return problems
+
+
+SUITES = {'recipes': bench_recipes, 'grinds': bench_grinds, 'sweeps': bench_sweeps, 'imports': bench_imports}
+
+
+def run(suites, repeat):
+
+    # the caches would only measure dictionary lookups
+    recipe_cache = mammothCache.recipe_cache
+    grind_store = mammothCache.grind_store
+    mammothCache.recipe_cache = None
+    mammothCache.grind_store = None
+
+    results = {}
+    try:
+        with redirect_stdout(io.StringIO()):   # Grind prints its warnings
+            for name in suites:
+                results.update(SUITES[name](repeat))
+    finally:
+        mammothCache.recipe_cache = recipe_cache
+        mammothCache.grind_store = grind_store
+
+    return results
+
+
+def environment():
+
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'machine': platform.machine(), 'system': platform.system(), 'processor': platform.processor()}
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Compares a run with a baseline.
+
+    :return: list of (name, baseline time, time, ratio, regressed) tuples, one per benchmark in both
+    """
+    thresholds = baseline.get('thresholds', {})
+    rows = []
+    for name, entry in results.items():
+
+        if name not in baseline['results']:
+            continue
+        reference = baseline['results'][name]['min']
+        ratio = entry['min']/reference if reference > 0 else np.inf
+        rows.append((name, reference, entry['min'], ratio, ratio > thresholds.get(name, threshold)))
+
+    return rows
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='mammothMaster benchmark suite')
+    parser.add_argument('suites', nargs='*', help='suites to run, among %s (default: all of them)' % ', '.join(SUITES))
+    parser.add_argument('--repeat', type=int, default=7, help='rounds per benchmark (default: 7)')
+    parser.add_argument('--save', metavar='FILE', help='store the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='largest allowed ratio to the baseline time (default: %s)' % THRESHOLD)
+    args = parser.parse_args(argv)
+    for name in args.suites:
+        if name not in SUITES:
+            parser.error('unknown suite: %s' % name)
+
+    results = run(args.suites or list(SUITES), args.repeat)
+    problems = check_imports(results) if 'import/recipes' in results else []
+    for problem in problems:
+        print('IMPORT BUDGET: %s' % problem)
+
+    if args.save:
+        baseline = {'environment': environment(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'thresholds': {}, 'results': results}
+        if os.path.exists(args.save):
+            # keeps any hand-tuned thresholds of the previous baseline
+            with open(args.save) as file:
+                baseline['thresholds'] = json.load(file).get('thresholds', {})
+        with open(args.save, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+
+    if not args.compare:
+        for name, entry in results.items():
+            print('%-60s %10.3f ms (best %.3f ms)' % (name, 1e3*entry['median'], 1e3*entry['min']))
+        return 1 if problems else 0
+
+    with open(args.compare) as file:
+        baseline = json.load(file)
+    if baseline.get('environment') != environment():
+        print('warning: baseline recorded on a different environment: %s' % baseline.get('environment'))
+
+    regressions = 0
+    for name, reference, best, ratio, regressed in compare(results, baseline, args.threshold):
+        regressions += regressed
+        print('%-60s %10.3f ms %10.3f ms %6.2fx%s' % (name, 1e3*reference, 1e3*best, ratio,
+                                                       '  REGRESSION' if regressed else ''))
+
+    return 1 if regressions or problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
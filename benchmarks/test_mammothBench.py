@@ -0,0 +1,239 @@
+import asyncio
+import csv
+import http.client
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+import numpy as np
+import pytest
+
+from mammothBench import GRINDS, HELICON, SCORES, bench_imports, check_imports, grind_steps, mm
+from mammothMaster import mammothBatch
+from mammothMaster.mammothService import GrindService, post
+
+# Checks run by pytest (python -m pytest benchmarks):
+# things the benchmarks rely on but don't look at themselves, such as the sparse and dense resource matrices giving
+# the same answers, plus the import budget of the imports suite (see check_imports), so that it's checked on every run
+# of the tests rather than only when the suite is run by hand.
+
+
+def quiet(function, *args, **kwargs):
+    # Grind prints its warnings
+
+    with redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+@pytest.mark.parametrize('label', list(GRINDS))
+def test_sensitivities_sparse_dense(label):
+
+    steps = grind_steps(GRINDS[label])
+    dense = quiet(mm.Grind, SCORES, steps, overflow_list=[], sparse=False).sensitivities()
+    sparse = quiet(mm.Grind, SCORES, steps, overflow_list=[], sparse=True).sensitivities()
+
+    assert np.ndim(sparse['EPS']) == 0
+    assert np.isclose(sparse['EPS'], dense['EPS'], rtol=1e-9, atol=1e-12)
+    for key in ('stats', 'PRICES'):
+        assert sparse[key].keys() == dense[key].keys()
+        for name in dense[key]:
+            assert np.isclose(sparse[key][name], dense[key][name], rtol=1e-6, atol=1e-9), (key, name)
+
+
+def test_samplers_average_out():
+
+    errors = mm.verify_samplers(SCORES, runs=10**5, seed=1)
+    assert max(errors.values()) < 5, errors
+
+
+@pytest.mark.parametrize('name', ['zee', 'easy', 'winged', 'holy', 'ungodly', 'hell', 'theologian'])
+def test_tracked_builds_add_up(name):
+
+    stats = dict(SCORES, MAnatomy=7, Mith=6, Katatox=3)
+    build = getattr(mm.mammothRecipe, name + '_build')
+    plain, tracked = build(stats), build(stats, kind=mm.TrackedBuild)
+
+    assert set(tracked.tracked) == set(plain.resources)
+    for quality in ('Implausibility', 'Antiquity'):
+        values, chances = plain.outcomes(quality)
+        assert np.array_equal(tracked.outcomes(quality)[0], values)
+        assert np.allclose(tracked.outcomes(quality)[1], chances, rtol=1e-12, atol=1e-15)
+    for resource, value in plain.resources.items():
+        assert np.isclose(tracked.expectation(lambda q: q[resource]), value, rtol=1e-12, atol=1e-12), resource
+    assert np.isclose(tracked.expectation(mm.antiquity_menace), plain.expectation(mm.antiquity_menace))
+
+    runs = tracked.draw(10**5, np.random.default_rng(1))
+    assert set(runs) == set(tracked.qualities)
+    assert abs(runs['Implausibility'].mean() - plain.expectation(lambda q: q['Implausibility'])) < \
+        5*runs['Implausibility'].std()/np.sqrt(10**5) + 1e-12
+
+
+def test_simulated_steps_do_not_depend_on_seed():
+
+    grind = quiet(mm.ranching, GRINDS['ranching'] + HELICON, stats=dict(SCORES, Shadowy=370, Mith=16),
+                  overflow_list=[])
+    steps = [sorted(mm.simulate(grind, cycles=10**4, seed=seed).contributions) for seed in range(4)]
+    assert all(names == steps[0] for names in steps)
+    assert 'Sell to Entrepreneur' in steps[0]
+
+
+def test_import_budget():
+
+    problems = check_imports(bench_imports(3))
+    assert not problems, problems
+
+
+def test_balmoral_tables_past_apoc_10(tmp_path):
+
+    tables = mm.use_simulated_tables(['Mammoth'], apoc=range(4, 16), path=str(tmp_path))
+    try:
+        wander, dark, scores = tables['Mammoth', 'patient']
+        instance = mm.GetMammoth(dict(SCORES, aPoC=12), 'patient')
+        assert np.isclose(instance.dense()[0], 6 + wander[8] + dark[8])
+        stats = dict(SCORES, aPoC=np.arange(4, 20))
+        for strategy in ('patient', 'hasty', 'best'):
+            errors = mm.verify_kernels(stats, ['Get Mammoth', 'Get 7Necks'], {'Get Mammoth': [strategy]})
+            assert max(errors.values()) < 1e-9, errors
+        with pytest.raises(ValueError):
+            mm.GetMammoth(dict(SCORES, aPoC=3), 'patient')
+    finally:
+        mm.use_simulated_tables(False)
+
+
+def test_editing_a_grind_leaves_the_next_ones_alone():
+
+    steps = grind_steps(GRINDS['ranching'])
+    before = quiet(mm.Grind, SCORES, steps)
+    defaults = [list(default) if isinstance(default, list) else default for default in mm.Grind.__init__.__defaults__]
+
+    overflow_list = []
+    edited = quiet(mm.Grind, SCORES, steps, overflow_list)
+    quiet(edited.add_overflow, 'WAmber')
+    quiet(edited.remove_step, 'Painting')
+    quiet(edited.add_step, 'Mammoth of the Zee')
+    assert overflow_list == []
+    assert [list(default) if isinstance(default, list) else default
+            for default in mm.Grind.__init__.__defaults__] == defaults
+
+    after = quiet(mm.Grind, SCORES, steps)
+    assert after.steps == before.steps
+    assert 'WAmber Overflow' not in after.steps
+    assert after.epaTotal == before.epaTotal
+
+
+def test_apoc_sensitivity_at_the_cap():
+
+    def grind(apoc):
+        return quiet(mm.ranching, GRINDS['ranching'] + HELICON, stats=dict(SCORES, aPoC=apoc), overflow_list=[])
+
+    # nothing changes past the cap, whether aPoC is at it or above it
+    assert grind(10).epaTotal == grind(11).epaTotal
+    assert grind(10).sensitivities()['stats']['aPoC'] == 0
+    assert grind(12).sensitivities()['stats']['aPoC'] == 0
+    # and below it the differences have the sign of the actual change
+    below = grind(9).sensitivities()['stats']['aPoC']
+    assert below > 0
+    assert np.isclose(below, (grind(10).epaTotal - grind(8).epaTotal)/2, rtol=0.2)
+
+
+def test_cached_recipes_are_not_shared():
+
+    steps = grind_steps(GRINDS['ranching'])
+    before = quiet(mm.Grind, SCORES, steps, overflow_list=[])
+
+    changed = mm.make_step('Painting', SCORES)
+    echoes = changed.get_resource('Echoes')
+    changed.add_resource('Echoes', 5)
+    changed.OFresources.append('Moonlit')
+    again = mm.make_step('Painting', SCORES)
+    assert again.get_resource('Echoes') == echoes
+    assert again.OFresources == []
+
+    after = quiet(mm.Grind, SCORES, steps, overflow_list=[])
+    assert after.epaTotal == before.epaTotal
+
+
+def test_service_on_localhost():
+
+    def send(body, port):
+        # post, but with the status and a body that doesn't have to be JSON
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        try:
+            connection.request('POST', '/grind', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    async def session():
+        with ThreadPoolExecutor() as executor:
+            service = GrindService(executor=executor, batch_window=0.05)
+            server = await service.start('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                request = {'stats': SCORES, 'ranching': GRINDS['ranching'] + HELICON}
+                other = {'stats': dict(SCORES, Mith=11), 'ranching': GRINDS['ranching'] + HELICON}
+                unknown = {'stats': SCORES, 'steps': ['No Such Step']}
+                results = await asyncio.to_thread(post, [request, request, other, unknown], port=port, timeout=60)
+                status = await asyncio.to_thread(post, None, port=port, endpoint='/status', timeout=60)
+                again = await asyncio.to_thread(post, request, port=port, timeout=60)
+                malformed = await asyncio.to_thread(send, b'{"stats": ', port)
+                single = await asyncio.to_thread(send, json.dumps(unknown), port)
+                final = await asyncio.to_thread(post, None, port=port, endpoint='/status', timeout=60)
+            finally:
+                await service.close()
+        return results, status, again, malformed, single, final
+
+    results, status, again, malformed, single, final = asyncio.run(session())
+
+    assert len(results) == 4
+    assert results[0] == results[1] == again
+    assert 'error' not in results[0] and 'error' not in results[2]
+    assert results[2]['epaTotal'] != results[0]['epaTotal']
+    assert 'error' in results[3]
+    # the duplicate is answered by the first one, which shares its batch with the other request of the same grind
+    assert status['requests'] == 4
+    assert status['deduplicated'] == 1
+    assert status['evaluated'] == 3
+    assert status['batches'] == 2
+    assert status['errors'] == 1
+    assert status['inflight'] == 0
+    # the repeated request comes out of the cache, while failed ones are tried again
+    assert final['cached'] == 1
+    assert final['evaluated'] == 4
+    assert malformed[0] == 400 and 'error' in malformed[1]
+    assert single[0] == 400 and 'error' in single[1]
+
+
+def test_batch_cli(tmp_path):
+
+    rows = [('a', SCORES), ('b', dict(SCORES, Mith=11)), ('c', SCORES)]
+    table = tmp_path / 'profiles.csv'
+    with open(table, 'w', newline='') as file:
+        writer = csv.DictWriter(file, ['id', *SCORES])
+        writer.writeheader()
+        for ident, stats in rows:
+            writer.writerow(dict(stats, id=ident))
+        writer.writerow(dict(SCORES, id='broken', Mith='lots'))
+    lines = tmp_path / 'profiles.jsonl'
+    lines.write_text(''.join(json.dumps({'id': ident, 'stats': stats}) + '\n' for ident, stats in rows) +
+                     json.dumps({'id': 'unknown', 'stats': SCORES, 'steps': ['No Such Step']}) + '\n')
+
+    outputs = {}
+    for source in (table, lines):
+        output = tmp_path / (source.name + '.out')
+        argv = [str(source), '-o', str(output), '--processes', '1', '--ordered', '--ranching',
+                *GRINDS['ranching'], *HELICON]
+        assert mammothBatch.main(argv) == 0
+        outputs[source.suffix] = [json.loads(line) for line in output.read_text().splitlines()]
+
+    for results in outputs.values():
+        assert [result['id'] for result in results[:3]] == ['a', 'b', 'c']
+        assert all(np.isfinite(result['epaTotal']) for result in results[:3])
+        assert results[0]['epaTotal'] == results[2]['epaTotal'] != results[1]['epaTotal']
+        assert 'error' in results[3] and 'epaTotal' not in results[3]
+    assert [result['epaTotal'] for result in outputs['.csv'][:3]] == \
+        [result['epaTotal'] for result in outputs['.jsonl'][:3]]
+    grind = quiet(mm.ranching, GRINDS['ranching'] + HELICON, stats=SCORES, overflow_list=[])
+    assert np.isclose(outputs['.csv'][0]['epaTotal'], grind.epaTotal)
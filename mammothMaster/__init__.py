@@ -1,2 +1,44 @@
-from .mammothRecipe import *
-from .mammothGrind import *
\ No newline at end of file
+import importlib
+import sys
+
+# Lazy loading:
+# the package gives access to everything its modules define (mm.Grind, mm.ALL_STEPS, mm.simulate...), but a module is
+# only imported the first time one of its names is asked for, so that short-lived processes (the batch CLI, the
+# service workers, scripts that only build recipes) don't pay for the ones they never use. No two modules define
+# different things under the same name, so a name is looked for in the modules already imported first and then in the
+# others, in the order below. from mammothMaster import * still imports everything.
+# SciPy is lazy too: its submodules (sparse, optimize) are only imported by the first grind that needs them.
+
+_MODULES = ('mammothRecipe', 'mammothBuild', 'mammothGrind', 'mammothSweep', 'mammothSearch', 'mammothCache',
+            'mammothBalmoral', 'mammothProfile', 'mammothFiles', 'mammothKernels', 'mammothParametric',
+            'mammothPareto', 'mammothSimulation', 'mammothPlanner', 'mammothSchedule')
+
+
+def _public(module):
+
+    return [name for name in vars(module) if not name.startswith('_')]
+
+
+def __getattr__(name):
+
+    if name in _MODULES:
+        return importlib.import_module('.' + name, __name__)
+
+    if name == '__all__':
+        return sorted({name for module in _MODULES for name in _public(importlib.import_module('.' + module, __name__))})
+    if name.startswith('__'):
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+    loaded = [module for module in _MODULES if __name__ + '.' + module in sys.modules]
+    for module in loaded + [module for module in _MODULES if module not in loaded]:
+        namespace = vars(importlib.import_module('.' + module, __name__))
+        if name in namespace and not name.startswith('_'):
+            globals()[name] = namespace[name]
+            return namespace[name]
+
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+
+    return sorted(set(globals()) | set(__getattr__('__all__')))
\ No newline at end of file
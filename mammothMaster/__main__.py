@@ -0,0 +1,7 @@
+import sys
+from .mammothBatch import main
+
+# python -m mammothMaster: batch evaluation of stat profiles, see mammothBatch
+
+if __name__ == '__main__':
+    sys.exit(main())
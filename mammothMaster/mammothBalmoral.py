@@ -0,0 +1,286 @@
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import mammothRecipe
+
+# Balmoral woods simulator:
+# sourcing bones in the Balmoral woods means wandering around until the bones are found, where every wander is a check
+# that succeeds with probability p (depending on aPoC); the woods may be darkened (at the cost of Tempestuous Scraps,
+# one action and, with the right strategy, only when it becomes necessary) which changes the way the search goes on.
+# The average number of wanders and the chance of having to darken are what the recipes need, and they're modelled
+# here as a small Markov chain:
+#  - in the light woods each wander is either a success or a failure; the bones are found as soon as light_successes
+#    successes have been collected, while the woods must be darkened once light_failures failures have been collected;
+#  - every light wander also takes the search light_depth[0] (success) or light_depth[1] (failure) steps deeper;
+#  - in the dark woods every wander takes the search dark_steps[0] (success) or dark_steps[1] (failure) steps deeper,
+#    and the bones are found once the search is dark_target steps deep.
+# The 'hasty' strategy darkens right away, the 'patient' one only when it becomes necessary.
+# The chain can be solved exactly (Woods.exact) or simulated (Woods.simulate, vectorized over all the rounds and spread
+# over a process pool by simulate_tables); either way the tables are kept in a versioned on-disk cache and may be
+# handed over to GetMammoth and Get7Necks through use_simulated_tables.
+
+BALMORAL_VERSION = 1
+
+
+class Woods:
+
+    def __init__(self, name, light_successes, light_failures, dark_target, light_depth=(1, 1), dark_steps=(1, 1)):
+        """
+
+        :param name: (string) name of the bones being sourced, as used in mammothRecipe.woods_table
+        :param light_successes: (int) successes in the light woods needed to find the bones
+        :param light_failures: (int) failures in the light woods that make darkening them necessary
+        :param dark_target: (int) depth at which the bones are found in the dark woods
+        :param light_depth: (tuple) depth gained by a successful and by a failed wander in the light woods
+        :param dark_steps: (tuple) depth gained by a successful and by a failed wander in the dark woods
+        """
+        self.name = name
+        self.light_successes = light_successes
+        self.light_failures = light_failures
+        self.dark_target = dark_target
+        self.light_depth = tuple(light_depth)
+        self.dark_steps = tuple(dark_steps)
+
+    def params(self):
+
+        return (self.name, self.light_successes, self.light_failures, self.dark_target, self.light_depth,
+                self.dark_steps)
+
+    def __repr__(self):
+
+        return 'Woods%r' % (self.params(),)
+
+    def exact(self, p, strategy='patient'):
+        """
+        Solves the Markov chain of the search for every success chance at once.
+
+        :param p: success chance of a wander, number or array
+        :param strategy: 'patient' (darken only when necessary) or 'hasty' (darken right away)
+        :return: average number of wanders and probability of darkening the woods, with the same shape as p
+        """
+        p = np.asarray(p, dtype=float)
+        q = 1 - p
+        success, failure = self.dark_steps
+
+        # dark woods: expected wanders from every depth, working backwards from the target
+        # (a step of 0 means the wander may have to be repeated, which is solved for in closed form)
+        dark = [np.zeros_like(p) for _ in range(self.dark_target + 1)]
+        for depth in reversed(range(self.dark_target)):
+            up = dark[min(depth + success, self.dark_target)] if success else 0
+            down = dark[min(depth + failure, self.dark_target)] if failure else 0
+            stay = (p if not success else 0) + (q if not failure else 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dark[depth] = (1 + (p*up if success else 0) + (q*down if failure else 0))/(1 - stay)
+
+        if strategy == 'hasty':
+            return dark[0], np.ones_like(p)
+
+        # light woods: expected wanders and chance of darkening from every (successes, failures) state
+        wander = {}
+        darken = {}
+        for k in reversed(range(self.light_successes + 1)):
+            for f in reversed(range(self.light_failures + 1)):
+
+                if k == self.light_successes:
+                    wander[k, f], darken[k, f] = np.zeros_like(p), np.zeros_like(p)
+                elif f == self.light_failures:
+                    depth = k*self.light_depth[0] + f*self.light_depth[1]
+                    wander[k, f], darken[k, f] = dark[min(depth, self.dark_target)], np.ones_like(p)
+                else:
+                    wander[k, f] = 1 + p*wander[k + 1, f] + q*wander[k, f + 1]
+                    darken[k, f] = p*darken[k + 1, f] + q*darken[k, f + 1]
+
+        return wander[0, 0], darken[0, 0]
+
+    def simulate(self, p, rounds=10**6, strategy='patient', seed=None, max_wanders=10**4):
+        """
+        Monte Carlo simulation of the search, running all the rounds for every success chance side by side.
+
+        :param p: success chance of a wander, number or array
+        :param rounds: number of searches simulated for every success chance
+        :param strategy: 'patient' (darken only when necessary) or 'hasty' (darken right away)
+        :param seed: seed (or numpy SeedSequence) of the random number generator
+        :param max_wanders: safety cap on the length of a single search
+        :return: average number of wanders and fraction of searches that darkened the woods, with the same shape as p
+        """
+        p = np.asarray(p, dtype=float)
+        rng = np.random.default_rng(seed)
+        chance = np.repeat(p.reshape(-1, 1), rounds, 1)
+
+        successes = np.zeros(chance.shape, dtype=int)
+        failures = np.zeros(chance.shape, dtype=int)
+        depth = np.zeros(chance.shape, dtype=int)
+        dark = np.full(chance.shape, strategy == 'hasty')
+        done = (dark & (self.dark_target <= 0)) | (~dark & (self.light_successes <= 0))
+        wanders = np.zeros(chance.shape, dtype=int)
+
+        for _ in range(max_wanders):
+
+            active = ~done
+            if not active.any():
+                break
+
+            hit = rng.random(chance.shape) < chance
+            wanders += active
+
+            light = active & ~dark
+            successes += light & hit
+            failures += light & ~hit
+            depth += np.where(hit, *self.light_depth)*light
+
+            deep = active & dark
+            depth += np.where(hit, *self.dark_steps)*deep
+
+            done |= light & (successes >= self.light_successes)
+            darkened = light & ~done & (failures >= self.light_failures)
+            dark |= darkened
+            done |= dark & (depth >= self.dark_target)
+
+        return wanders.mean(1).reshape(p.shape), dark.mean(1).reshape(p.shape)
+
+
+# WOODS: dictionary of the known searches, indexed by name;
+# the Mammoth one reproduces the mam_avg table (and the 1 - p**8 darkening chance) used by GetMammoth
+WOODS = {'Mammoth': Woods('Mammoth', 8, 1, 6, light_depth=(2, 1), dark_steps=(2, 1))}
+
+
+def apoc_chance(apoc):
+    # success chance of a wander at each aPoC score, as assumed by the tables in mammothRecipe
+
+    return np.clip(np.asarray(apoc, dtype=float)/10, 0, 1)
+
+
+def _simulate_chunk(woods, p, rounds, strategy, seed):
+
+    return woods.simulate(p, rounds, strategy, seed)
+
+
+def simulate_tables(woods, apoc=range(11), strategy='patient', method='exact', rounds=10**7, processes=None,
+                    seed=0, chunk=10**5):
+    """
+    Works out the (wander, dark) tables of a search for a range of aPoC scores.
+
+    :param woods: Woods instance, or the name of one in the WOODS dictionary
+    :param apoc: aPoC scores to tabulate
+    :param strategy: 'patient' (darken only when necessary) or 'hasty' (darken right away)
+    :param method: 'exact' (Markov chain) or 'montecarlo' (simulation of the given number of rounds)
+    :param rounds: number of simulated searches for every aPoC score
+    :param processes: number of worker processes for the simulation, defaults to the number of cores
+    :param seed: seed of the simulation; every chunk of rounds gets its own independent stream
+    :param chunk: number of rounds simulated at once by a single worker
+    :return: average number of wanders and chance of darkening, one entry per aPoC score
+    """
+    woods = WOODS[woods] if isinstance(woods, str) else woods
+    p = apoc_chance(list(apoc))
+
+    if method == 'exact':
+        return woods.exact(p, strategy)
+
+    sizes = [min(chunk, rounds - start) for start in range(0, rounds, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    processes = processes or os.cpu_count()
+
+    if processes == 1:
+        results = [_simulate_chunk(woods, p, size, strategy, s) for size, s in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(_simulate_chunk, *zip(*[(woods, p, size, strategy, s)
+                                                                 for size, s in zip(sizes, seeds)])))
+
+    weights = np.array(sizes)/rounds
+    wander = sum(weight*result[0] for weight, result in zip(weights, results))
+    dark = sum(weight*result[1] for weight, result in zip(weights, results))
+    return wander, dark
+
+
+class TableStore:
+
+    def __init__(self, path=None):
+        """
+
+        :param path: directory where the tables are stored; defaults to the balmoral subdirectory of the MAMMOTH_CACHE
+            environment variable or of ~/.cache/mammothMaster
+        """
+        if path is None:
+            path = os.path.join(os.environ.get('MAMMOTH_CACHE', os.path.join(os.path.expanduser('~'), '.cache',
+                                                                              'mammothMaster')), 'balmoral')
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def filename(self, woods, apoc, strategy, method, rounds, seed):
+
+        # the exact tables don't depend on the simulation settings
+        settings = (method,) if method == 'exact' else (method, rounds, seed)
+        key = repr((BALMORAL_VERSION, woods.params(), tuple(apoc), strategy, settings))
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest() + '.npz')
+
+    def tables(self, woods, apoc=range(11), strategy='patient', method='exact', rounds=10**7, processes=None, seed=0):
+        """
+        Returns the stored (wander, dark) tables, working them out (and storing them) if needed;
+        takes the same arguments as simulate_tables.
+        """
+        woods = WOODS[woods] if isinstance(woods, str) else woods
+        apoc = [float(score) for score in apoc]
+        filename = self.filename(woods, apoc, strategy, method, rounds, seed)
+        try:
+            with np.load(filename) as data:
+                return data['wander'], data['dark']
+        except (OSError, KeyError, ValueError):
+            pass
+
+        wander, dark = simulate_tables(woods, apoc, strategy, method, rounds, processes, seed)
+        handle, temp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            np.savez(file, wander=wander, dark=dark, apoc=apoc, version=BALMORAL_VERSION)
+        os.replace(temp, filename)
+        return wander, dark
+
+    def clear(self):
+
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz'):
+                os.remove(entry.path)
+
+
+def use_simulated_tables(names=None, apoc=range(11), path=None, method='exact', rounds=10**7, processes=None, seed=0):
+    """
+    Makes GetMammoth and Get7Necks read their Balmoral tables (both strategies) from the on-disk cache, working out any
+    missing ones; or goes back to the tables hard-coded in mammothRecipe, if names is False.
+
+    :param names: names of the searches to load, as stored in the WOODS dictionary; defaults to all of them
+    :param apoc: aPoC scores to tabulate, in increasing order; the recipes then only take the scores among them
+        (or any score past the last one, if it's at least mammothRecipe.APOC_CAP)
+    :param path: directory of the cache, as in TableStore
+    """
+    if names is False:
+        mammothRecipe.balmoral_tables = None
+        return None
+
+    scores = np.array(list(apoc))
+    if len(scores) == 0 or (np.diff(scores) <= 0).any():
+        raise ValueError('the aPoC scores must be increasing')
+
+    store = TableStore(path)
+    tables = {}
+    for name in (WOODS if names is None else names):
+        for strategy in ('patient', 'hasty'):
+            tables[name, strategy] = store.tables(name, scores, strategy, method, rounds, processes, seed) + (scores,)
+
+    mammothRecipe.balmoral_tables = tables
+    return tables
+
+
+def compare_tables(name, method='exact', rounds=10**7, processes=None, seed=0):
+    """
+    Compares the tables worked out for a search with the ones hard-coded in mammothRecipe.
+
+    :return: dictionary of the largest absolute difference of every table, indexed by table name
+    """
+    wander, dark = simulate_tables(name, range(11), 'patient', method, rounds, processes, seed)
+    reference_wander, reference_dark = mammothRecipe.WOODS_TABLES[name]
+    if reference_dark is None:
+        reference_dark = 1 - apoc_chance(range(11))**WOODS[name].light_successes
+
+    return {'wander': np.abs(wander - reference_wander).max(), 'dark': np.abs(dark - reference_dark).max()}
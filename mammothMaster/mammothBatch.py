@@ -0,0 +1,235 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .mammothService import normalize, evaluate_batch
+
+# Batch evaluation:
+# the command-line side of the package (python -m mammothMaster), scoring any number of stat profiles in one go.
+# Profiles are read from CSV (one column per stat, plus optional "id" and "steps" columns, the steps separated by
+# semicolons) or JSON Lines (either requests as taken by mammothService, or plain {"statname": score} objects plus an
+# optional "id"), from a file or from stdin; rows without steps of their own get the grind given on the command line.
+# The rows are evaluated in chunks by a pool of worker processes and the results (epaTotal, epa, spa, grind_dim, the
+# step ratios and any warnings, tagged with the row number and id) are written out as soon as each chunk is done, as
+# JSON Lines or CSV. Only a few chunks per worker are ever read ahead, so memory stays bounded however long the input.
+#   python -m mammothMaster profiles.csv --ranching "Mammoth from Hell" "Duplicate Ox Skull" -o results.jsonl
+
+FIELDS = ('row', 'id', 'epaTotal', 'epa', 'spa', 'grind_dim', 'ratios', 'warnings', 'error')
+
+
+def number(text):
+    # CSV cells are numbers, integer whenever they can be (aPoC is used as an index)
+
+    value = float(text)
+    return int(value) if value.is_integer() and '.' not in text and 'e' not in text.lower() else value
+
+
+def read_rows(file, format='jsonl'):
+    """
+    Reads the profiles of a CSV or JSON Lines file one at a time.
+
+    :param file: open text file
+    :param format: 'csv' or 'jsonl'
+    :return: generator of (id, row) pairs, where row is either a request or a stats dictionary; rows that can't be
+        parsed are given as (id, exception)
+    """
+    if format == 'csv':
+        for i, line in enumerate(csv.DictReader(file)):
+            try:
+                row = {name: number(value) for name, value in line.items() if name not in ('id', 'steps') and value}
+                if line.get('steps'):
+                    row = {'stats': row, 'steps': [step.strip() for step in line['steps'].split(';') if step.strip()]}
+                yield line.get('id', i), row
+            except ValueError as error:
+                yield line.get('id', i), error
+        return
+
+    for i, line in enumerate(file):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError('every line must be a JSON object')
+            yield row.pop('id', i), row
+        except ValueError as error:
+            yield i, error
+
+
+def prepare(row, default):
+    # turns a row into a normalized request, taking everything it doesn't say from the default request
+
+    if 'stats' not in row:
+        row = dict(default, stats=row)
+    elif 'steps' not in row and 'ranching' not in row:
+        row = dict({name: value for name, value in default.items() if name != 'stats'}, **row)
+
+    return normalize(row)
+
+
+def evaluate_rows(rows, default, processes=None, chunk=256, ordered=False):
+    """
+    Evaluates a stream of rows in parallel chunks.
+
+    :param rows: iterable of (id, row) pairs, as given by read_rows
+    :param default: request whose steps and settings are used by the rows that only give their stats
+    :param processes: number of worker processes, defaults to the number of cores; 1 evaluates in this process
+    :param chunk: number of rows sent to a worker at once
+    :param ordered: whether to give the results back in input order, rather than as soon as they're ready
+    :return: generator of result dictionaries, one per row
+    """
+    def chunks():
+        numbered = enumerate(rows)
+        while True:
+            batch = list(itertools.islice(numbered, chunk))
+            if not batch:
+                return
+            requests, failed = [], []
+            for n, (ident, row) in batch:
+                try:
+                    if isinstance(row, Exception):
+                        raise row
+                    requests.append((n, ident, prepare(row, default)))
+                except (ValueError, TypeError) as error:
+                    failed.append({'row': n, 'id': ident, 'error': '%s: %s' % (type(error).__name__, error)})
+            yield requests, failed
+
+    def tag(requests, results):
+        return [dict(result, row=n, id=ident) for (n, ident, request), result in zip(requests, results)]
+
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        for requests, failed in chunks():
+            yield from sorted(failed + tag(requests, evaluate_batch([item[2] for item in requests])),
+                              key=lambda result: result['row'])
+        return
+
+    with ProcessPoolExecutor(processes) as executor:
+
+        # at most two chunks per worker are read ahead, which bounds the memory used
+        # (and, if ordered, the chunks done ahead of a slow one, at most two per worker as well)
+        pending = {}    # chunks being evaluated, indexed by future
+        done = {}       # chunks evaluated but not yet given back
+        order = []      # futures of both, in input order
+        for requests, failed in chunks():
+
+            future = executor.submit(evaluate_batch, [item[2] for item in requests])
+            pending[future] = (requests, failed)
+            order.append(future)
+            while len(pending) >= 2*processes or len(order) >= 4*processes:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for item in finished:
+                    done[item] = pending.pop(item)
+                yield from _flush(order, done, tag, ordered)
+
+        while order:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for item in finished:
+                done[item] = pending.pop(item)
+            yield from _flush(order, done, tag, ordered)
+
+
+def _flush(order, done, tag, ordered):
+    # gives back the results of the finished chunks (only the ones at the head of the queue, if ordered)
+
+    if ordered:
+        ready = list(itertools.takewhile(done.__contains__, order))
+    else:
+        ready = [future for future in order if future in done]
+
+    for future in ready:
+        order.remove(future)
+        requests, failed = done.pop(future)
+        try:
+            results = tag(requests, future.result())
+        except Exception as error:
+            results = [{'row': n, 'id': ident, 'error': '%s: %s' % (type(error).__name__, error)}
+                       for n, ident, request in requests]
+        yield from sorted(failed + results, key=lambda result: result['row'])
+
+
+def write_results(results, file, format='jsonl'):
+    """
+    Writes the results out one at a time, flushing the file after every one of them.
+
+    :return: number of results written
+    """
+    count = 0
+    writer = csv.DictWriter(file, FIELDS) if format == 'csv' else None
+    if writer is not None:
+        writer.writeheader()
+
+    for result in results:
+
+        if writer is not None:
+            row = dict(result)
+            row['ratios'] = json.dumps(row['ratios']) if 'ratios' in row else ''
+            row['warnings'] = '; '.join(row.get('warnings', []))
+            writer.writerow(row)
+        else:
+            file.write(json.dumps({name: result[name] for name in FIELDS if name in result}) + '\n')
+        file.flush()
+        count += 1
+
+    return count
+
+
+def guess_format(filename, first_line):
+
+    if filename and filename.endswith('.csv'):
+        return 'csv'
+    if filename and filename.endswith(('.jsonl', '.json', '.ndjson')):
+        return 'jsonl'
+    return 'jsonl' if first_line.lstrip().startswith('{') else 'csv'
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m mammothMaster',
+                                     description='evaluates the grinds of many stat profiles, read as CSV or JSON Lines')
+    parser.add_argument('input', nargs='?', default='-', help='input file (default: stdin)')
+    parser.add_argument('-o', '--output', default='-', help='output file (default: stdout)')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='input format (default: guessed)')
+    parser.add_argument('--output-format', choices=('csv', 'jsonl'), default='jsonl',
+                        help='output format (default: jsonl)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--steps', nargs='+', metavar='STEP', help='steps of the grind of every row')
+    group.add_argument('--ranching', nargs='*', metavar='STEP',
+                       help='steps added to the ranching grind for every row (the default grind)')
+    parser.add_argument('--overflow', nargs='*', default=[], metavar='RESOURCE', help='overflow list of the grind')
+    parser.add_argument('--blacklist', nargs='*', metavar='RESOURCE', help='resources to ignore')
+    parser.add_argument('--solver', default='lp', help='backend of the grinds (default: lp)')
+    parser.add_argument('--processes', type=int, help='number of worker processes (default: one per core)')
+    parser.add_argument('--chunk', type=int, default=256, help='rows per chunk (default: 256)')
+    parser.add_argument('--ordered', action='store_true', help='write the results in input order')
+    args = parser.parse_args(argv)
+
+    default = {'overflow_list': args.overflow, 'blacklist': args.blacklist, 'solver': args.solver}
+    if args.steps:
+        default['steps'] = args.steps
+    else:
+        default['ranching'] = args.ranching or []
+
+    source = sys.stdin if args.input == '-' else open(args.input, newline='')
+    target = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        first = source.readline()
+        format = args.format or guess_format(None if args.input == '-' else args.input, first)
+        lines = itertools.chain([first], source)
+        rows = read_rows(lines, format)
+        results = evaluate_rows(rows, default, args.processes, args.chunk, args.ordered)
+        write_results(results, target, args.output_format)
+    except BrokenPipeError:
+        # (e.g. piped into head)
+        sys.stderr.close()
+        return 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+    return 0
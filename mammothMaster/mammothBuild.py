@@ -0,0 +1,218 @@
+import math
+from collections import defaultdict
+from operator import add
+import numpy as np
+
+# Skeleton builds:
+# putting a skeleton together is a sequence of checks (attaching the skull, every limb, the tail, carving...) whose
+# outcomes change its qualities, and what it sells for and how hard it is to sell only depend on the qualities it ends
+# up with. A SkeletonBuild follows the chance of every combination of qualities (by default Antiquity, Menace and
+# Implausibility, plus any other counter the build needs to tell its branches apart) through the checks, merging the
+# branches that end up the same, so the outcomes come out exactly however many checks there are; along the way it
+# adds up the expected resources the branches use or make.
+# Chances may be numbers or arrays (one element per stat profile, broadcast together), so builds work for many stat
+# profiles at once. A recipe describes its skeleton as
+#   build = SkeletonBuild(Antiquity=7)
+#   build.check(skull, success={'Menace': 2}, failure={'Menace': 1})
+#   for _ in range(4):
+#       build.check(limb, success={'Antiquity': 1})
+#   build.check(tail, success={'Antiquity': -1}, failure={'Antiquity': -1, 'Implausibility': 2},
+#               when=lambda q: q['Antiquity'] == 11)
+# and then reads build.expectation(...), build.outcomes('Implausibility') (for recipe.sell_penalty) and
+# build.resources. Changes name either a quality of the build or a resource; conditions are functions of the
+# dictionary of qualities of a branch.
+# A TrackedBuild follows the same description branch by branch, resources included, which is what the simulation
+# (see mammothSimulation) draws its runs of the skeleton steps from; recipes take the build class to use for that.
+
+QUALITIES = ('Antiquity', 'Menace', 'Implausibility')
+
+
+def binomial(k, n, chance):
+    """
+    Chance of k successes out of n checks of the given chance, like scipy.stats.binom.pmf (without the second or so
+    it takes to import scipy.stats).
+
+    :param k: number or array of numbers of successes
+    :param n: number of checks
+    :param chance: success chance of every check (number or array, broadcast with k)
+    """
+    k = np.asarray(k)
+    ways = np.array([math.comb(n, i) for i in k.ravel().tolist()], dtype=float).reshape(k.shape)
+    return ways*chance**k*(1 - chance)**(n - k)
+
+
+def retries(chance, tol=1e-12):
+    """
+    Chances of needing 0, 1, 2... failed attempts before succeeding at a check retried until it succeeds.
+
+    :param chance: success chance of every attempt (number or array)
+    :param tol: the tries stop once the chance of needing more is below tol (for every element of chance)
+    :return: array of the chances, along the last axis
+    """
+    chance = np.asarray(chance, dtype=float)
+    worst = 1 - chance.min()
+    count = 1 if worst <= 0 else max(1, int(np.ceil(np.log(tol)/np.log(worst))))
+    return chance[..., np.newaxis]*(1 - chance[..., np.newaxis])**np.arange(count)
+
+
+class SkeletonBuild:
+
+    def __init__(self, **qualities):
+        """
+
+        :param qualities: starting value of the qualities of the skeleton; Antiquity, Menace and Implausibility
+            start from 0 unless given, and any other keyword adds a quality of that name
+        """
+        self.qualities = list(QUALITIES) + [name for name in qualities if name not in QUALITIES]
+        self.states = {tuple(qualities.get(name, 0) for name in self.qualities): 1.}
+        self.resources = defaultdict(float)     # expected resource changes, indexed by resource name
+
+    def _matches(self, key, when):
+
+        return when is None or when(dict(zip(self.qualities, key)))
+
+    def _branch(self, states, key, weight, changes, times=1):
+        # adds the branch of chance weight taking the changes (times times) to states
+
+        key = list(key)
+        for name, value in changes.items():
+            if name in self.qualities:
+                key[self.qualities.index(name)] += times*value
+            else:
+                self.resources[name] = self.resources[name] + times*weight*value
+        key = tuple(key)
+        states[key] = states[key] + weight if key in states else weight
+
+    def check(self, chance, success={}, failure={}, when=None):
+        """
+        Makes a check on every branch meeting the condition.
+
+        :param chance: chance of success (number or array)
+        :param success: changes of the branches that succeed, as {quality or resource: amount}
+        :param failure: changes of the branches that fail
+        :param when: condition on the qualities of the branches making the check, by default all of them
+        """
+        states = {}
+        for key, weight in self.states.items():
+            if self._matches(key, when):
+                self._branch(states, key, weight*chance, success)
+                self._branch(states, key, weight*(1 - chance), failure)
+            else:
+                self._branch(states, key, weight, {})
+        self.states = states
+
+    def apply(self, changes, when=None):
+        """
+        Makes the same changes to every branch meeting the condition.
+        """
+        states = {}
+        for key, weight in self.states.items():
+            self._branch(states, key, weight, changes if self._matches(key, when) else {})
+        self.states = states
+
+    def retry(self, chance, failure={}, when=None, tol=1e-12):
+        """
+        Makes a check on every branch meeting the condition until it succeeds, every failure making the changes
+        again; the tries stop once the chance of more failures is below tol.
+        """
+        tries = retries(chance, tol)
+        times = np.arange(tries.shape[-1])
+        offsets = np.outer(times, [failure.get(name, 0) for name in self.qualities]).tolist()
+        resources = {name: value for name, value in failure.items() if name not in self.qualities}
+
+        # (there may be hundreds of tries, so they're spread out all at once rather than one check at a time)
+        states = {}
+        for key, weight in self.states.items():
+            if not self._matches(key, when):
+                self._branch(states, key, weight, {})
+                continue
+            chances = np.asarray(weight)[..., np.newaxis]*tries
+            for name, value in resources.items():
+                self.resources[name] = self.resources[name] + value*(chances*times).sum(-1)
+            # (numbers rather than 0-d arrays when there's a single profile)
+            for offset, chance in zip(offsets, chances.tolist() if chances.ndim == 1 else np.moveaxis(chances, -1, 0)):
+                target = tuple(map(add, key, offset))
+                states[target] = states[target] + chance if target in states else chance
+        self.states = states
+
+    def expectation(self, function):
+        """
+        :param function: function of the dictionary of qualities of a branch
+        :return: expected value of the function over the finished skeletons
+        """
+        return sum(weight*function(dict(zip(self.qualities, key))) for key, weight in self.states.items())
+
+    def outcomes(self, quality):
+        """
+        :return: array of the values the quality may end up with, in increasing order, and array of their chances
+            along the last axis (as taken by recipe.sell_penalty)
+        """
+        chances = defaultdict(float)
+        index = self.qualities.index(quality)
+        for key, weight in self.states.items():
+            chances[key[index]] = chances[key[index]] + weight
+
+        values = sorted(chances)
+        column = [chances[value] for value in values]
+        if not any(isinstance(chance, np.ndarray) for chance in column):
+            return np.array(values), np.array(column, dtype=float)
+        return np.array(values), np.stack(np.broadcast_arrays(*column), -1)
+
+    def add_resources(self, instance):
+        """
+        Adds the expected resources of the build to a recipe instance.
+        """
+        for name, value in self.resources.items():
+            instance.add_resource(name, value)
+
+
+class TrackedBuild(SkeletonBuild):
+    # a SkeletonBuild keeping apart the branches that use or make different resources, every resource being followed
+    # as one more quality of the skeleton, so that whole runs (qualities and resources) can be drawn from its branches;
+    # the chances have to be numbers (a single stat profile)
+
+    def __init__(self, **qualities):
+
+        super().__init__(**qualities)
+        self.tracked = []       # resources followed as qualities, in order of appearance
+
+    def _track(self, *changes):
+
+        names = [name for change in changes for name in change if name not in self.qualities]
+        names = list(dict.fromkeys(names))
+        if names:
+            self.qualities += names
+            self.tracked += names
+            self.states = {key + (0,)*len(names): weight for key, weight in self.states.items()}
+
+    def check(self, chance, success={}, failure={}, when=None):
+
+        self._track(success, failure)
+        super().check(chance, success, failure, when)
+
+    def apply(self, changes, when=None):
+
+        self._track(changes)
+        super().apply(changes, when)
+
+    def retry(self, chance, failure={}, when=None, tol=1e-12):
+
+        self._track(failure)
+        super().retry(chance, failure, when, tol)
+
+    def add_resources(self, instance):
+
+        for name in self.tracked:
+            instance.add_resource(name, self.expectation(lambda q: q[name]))
+
+    def draw(self, n, rng):
+        """
+        Draws n finished skeletons at random.
+
+        :param rng: numpy Generator
+        :return: dictionary of the arrays of the qualities (and tracked resources) of every skeleton
+        """
+        keys = list(self.states)
+        weights = np.array([self.states[key] for key in keys], dtype=float)
+        table = np.array(keys, dtype=float)[rng.choice(len(keys), n, p=weights/weights.sum())]
+        return dict(zip(self.qualities, table.T))
@@ -0,0 +1,233 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import scipy
+from . import mammothRecipe
+
+# Caching:
+# building a recipe and solving a grind are both deterministic, so their results can be reused whenever the same
+# inputs come back. There are two levels of cache:
+#  - recipe_cache, an in-process LRU of the recipe instances built by make_step, keyed by the step name, its additional
+#    parameters and the values of the stats the recipe actually read while being built (most recipes only read two or
+#    three stats, so profiles differing in any other stat share the same entry);
+#  - grind_store, an optional on-disk store of solved grinds keyed by a hash of the resource matrix, shared by every
+#    session pointed at the same directory; it's off until use_disk_cache is called.
+# Both are invalidated whenever one of the module-level toggles in mammothRecipe (or EPS/PRICES, or the Balmoral tables)
+# changes.
+
+CACHE_VERSION = 1
+
+
+def toggles():
+    # snapshot of all the module-level settings the recipes and the solvers depend on
+
+    tables = mammothRecipe.balmoral_tables
+    if tables is not None:
+        tables = tuple(sorted((key, tuple(np.ravel(table[0])), None if table[1] is None else tuple(np.ravel(table[1])),
+                               tuple(np.ravel(table[2]))) for key, table in tables.items()))
+
+    return (mammothRecipe.social_heals, mammothRecipe.scrimshander_knife, mammothRecipe.use_HRelic_on_HellM,
+            mammothRecipe.debonair_palaeontologist, mammothRecipe.EPS,
+            tuple(sorted((key, tuple(value)) for key, value in mammothRecipe.PRICES.items())), tables)
+
+
+class StatsRecorder(dict):
+    # dictionary that keeps track of which entries have been read, so that we can tell which stats a recipe depends on
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read = set()
+
+    def __getitem__(self, key):
+        self.read.add(key)
+        return super().__getitem__(key)
+
+
+class RecipeCache:
+
+    def __init__(self, maxsize=4096):
+        """
+
+        :param maxsize: maximum number of recipes kept; the least recently used ones are evicted first
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.keysets = {}   # for each step, every distinct set of stats it was found to read
+        self.toggles = toggles()
+        self.local = threading.local()     # depth of the building() blocks every thread is in
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+
+        self.entries.clear()
+        self.keysets.clear()
+        self.toggles = toggles()
+
+    def validate(self):
+        # empties the cache if any of the toggles changed since it was filled
+
+        if toggles() != self.toggles:
+            self.clear()
+
+    @contextmanager
+    def building(self):
+        # checks the toggles once for all the recipes built inside the block (a whole Grind or Sweep), rather than
+        # once per recipe
+
+        depth = getattr(self.local, 'depth', 0)
+        if not depth:
+            self.validate()
+        self.local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+
+    def get(self, stp_name, stats, params, build):
+        """
+        Returns the recipe for this step and stats, building (and storing) it if needed; the recipes are always
+        copies of the stored ones, so that changing them doesn't change what the next callers get.
+
+        :param stp_name: name of the step, as stored in the ALL_STEPS dictionary
+        :param stats: dictionary containing all the player stats
+        :param params: tuple of the additional parameters passed to the step (empty if there are none)
+        :param build: function taking the stats dictionary and returning the recipe instance
+        """
+        if not getattr(self.local, 'depth', 0):
+            self.validate()
+
+        params = repr(params)
+        for keyset in self.keysets.get(stp_name, ()):
+
+            # a recipe reads the same stats whenever the stats it has already read have the same values,
+            # so a match on one of the known keysets is always safe
+            try:
+                key = (stp_name, params, keyset, tuple(stats[name] for name in keyset))
+            except KeyError:
+                continue
+
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return _copy(self.entries[key])
+
+        self.misses += 1
+        recorder = StatsRecorder(stats)
+        instance = build(recorder)
+        keyset = tuple(sorted(recorder.read))
+        if isinstance(stats, StatsRecorder):
+            stats.read.update(keyset)
+
+        if keyset not in self.keysets.setdefault(stp_name, []):
+            self.keysets[stp_name].append(keyset)
+        self.entries[(stp_name, params, keyset, tuple(stats[name] for name in keyset))] = _copy(instance)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        return instance
+
+
+def _copy(instance):
+    # (unavailable steps are cached as the 0 their recipe function returns)
+
+    return instance.copy() if instance else instance
+
+
+class GrindStore:
+
+    def __init__(self, path=None, max_entries=10000):
+        """
+
+        :param path: directory where the solved grinds are stored; defaults to the MAMMOTH_CACHE environment
+            variable or ~/.cache/mammothMaster
+        :param max_entries: maximum number of grinds kept on disk; the least recently used ones are evicted first
+        """
+        if path is None:
+            path = os.environ.get('MAMMOTH_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'mammothMaster'))
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, matrix, solver):
+
+        digest = hashlib.sha256()
+        if scipy.sparse.issparse(matrix):
+            matrix = scipy.sparse.csr_array(matrix)
+            matrix.sum_duplicates()
+            digest.update(repr((CACHE_VERSION, solver, toggles(), matrix.shape, 'csr')).encode())
+            for array in (matrix.indptr, matrix.indices, matrix.data):
+                digest.update(np.ascontiguousarray(array).tobytes())
+        else:
+            digest.update(repr((CACHE_VERSION, solver, toggles(), matrix.shape)).encode())
+            digest.update(np.ascontiguousarray(matrix, dtype=float).tobytes())
+        return digest.hexdigest()
+
+    def load(self, matrix, solver):
+        """
+        :return: the stored (solution, grind_dim) of this resource matrix, or None if it hasn't been solved yet
+        """
+        filename = os.path.join(self.path, self.key(matrix, solver) + '.npz')
+        try:
+            with np.load(filename) as data:
+                grind_dim = int(data['grind_dim'])
+                entry = data['solution'], (grind_dim if grind_dim >= 0 else None)
+            os.utime(filename)  # marks the entry as recently used
+        except (OSError, KeyError, ValueError):
+            return None
+
+        return entry
+
+    def save(self, matrix, solver, solution, grind_dim):
+
+        filename = os.path.join(self.path, self.key(matrix, solver) + '.npz')
+        # writes to a temporary file first, so that other sessions never read a half-written entry
+        handle, temp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            # grind_dim is None for sparse matrices, stored as -1
+            np.savez(file, solution=solution, grind_dim=-1 if grind_dim is None else grind_dim)
+        os.replace(temp, filename)
+        self.evict()
+
+    def evict(self):
+
+        entries = [entry for entry in os.scandir(self.path) if entry.name.endswith('.npz')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def clear(self):
+
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz'):
+                os.remove(entry.path)
+
+
+recipe_cache = RecipeCache()
+grind_store = None
+
+
+def building():
+    """
+    Block inside which the recipe cache checks the toggles only once (see RecipeCache.building).
+    """
+    return recipe_cache.building() if recipe_cache is not None else nullcontext()
+
+
+def use_disk_cache(path=None, max_entries=10000):
+    """
+    Turns on the on-disk store of solved grinds (or turns it off, if path is False).
+    """
+    global grind_store
+    grind_store = None if path is False else GrindStore(path, max_entries)
+
+    return grind_store
@@ -0,0 +1,252 @@
+import json
+import os
+import struct
+import tempfile
+import zipfile
+import numpy as np
+import scipy
+from . import mammothCache
+from .mammothGrind import Grind
+from .mammothSweep import Sweep
+
+# Grind and sweep files:
+# solved grinds and sweeps can be saved to disk and loaded back without building a single recipe or solving anything.
+# A file is an uncompressed .npz archive: a small JSON header (header.json) holding the names, references and settings,
+# plus one .npy member per array. Since the members aren't compressed they're laid out in the file as plain .npy data,
+# so loading memory-maps them in place rather than reading them: every process loading the same sweep shares the same
+# pages of the operating system's file cache, with no copies. The arrays of a loaded grind or sweep are read-only, but
+# add_step, remove_step and the like never modify arrays in place, so loaded grinds may still be edited (and will
+# build the recipes they need under the current settings).
+
+FILE_VERSION = 1
+
+
+def _json_default(value):
+    # numpy scalars and arrays sneak into the stats and add_parameters dictionaries
+
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def write_archive(filename, header, arrays):
+    """
+    Writes a header dictionary and a dictionary of arrays to an uncompressed .npz archive.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    # writes to a temporary file first, so that other processes never read a half-written file
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as file, zipfile.ZipFile(file, 'w', zipfile.ZIP_STORED) as archive:
+            archive.writestr('header.json', json.dumps(header, default=_json_default))
+            for name, array in arrays.items():
+                with archive.open(name + '.npy', 'w', force_zip64=True) as member:
+                    np.lib.format.write_array(member, np.asanyarray(array), allow_pickle=False)
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def read_archive(filename, mmap=True):
+    """
+    Reads an archive written by write_archive.
+
+    :param mmap: whether to memory-map the arrays (read-only) rather than read them into memory
+    :return: the header dictionary and the dictionary of arrays
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive:
+        header = json.loads(archive.read('header.json'))
+        members = [info for info in archive.infolist() if info.filename.endswith('.npy')]
+
+        if not mmap:
+            for info in members:
+                with archive.open(info) as member:
+                    arrays[info.filename[:-4]] = np.lib.format.read_array(member, allow_pickle=False)
+            return header, arrays
+
+    with open(filename, 'rb') as file:
+        for info in members:
+
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('%s: compressed members cannot be memory-mapped' % filename)
+
+            # the member's data starts right after its local header, whose name and extra fields have variable length
+            file.seek(info.header_offset)
+            local = file.read(30)
+            name_length, extra_length = struct.unpack('<HH', local[26:30])
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+
+            if np.lib.format.read_magic(file) == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(file)
+            if dtype.hasobject:
+                raise ValueError('%s: object arrays are not supported' % filename)
+            if not np.prod(shape, dtype=int):
+                arrays[info.filename[:-4]] = np.empty(shape, dtype, order='F' if fortran else 'C')
+                continue
+            arrays[info.filename[:-4]] = np.memmap(filename, dtype, 'r', file.tell(), shape,
+                                                   'F' if fortran else 'C')
+
+    return header, arrays
+
+
+def _check_header(header, kind, filename):
+
+    if header.get('kind') != kind:
+        raise ValueError('%s is not a %s file' % (filename, kind))
+    if header.get('version') != FILE_VERSION:
+        raise ValueError('%s: unsupported file version %s' % (filename, header.get('version')))
+    if header.get('toggles') != repr(mammothCache.toggles()):
+        print('warning: %s was saved with different settings (toggles, EPS, PRICES or Balmoral tables)' % filename)
+
+
+def _matrix_arrays(matrix):
+
+    if scipy.sparse.issparse(matrix):
+        matrix = scipy.sparse.csr_array(matrix)
+        return {'matrix_data': matrix.data, 'matrix_indices': matrix.indices, 'matrix_indptr': matrix.indptr,
+                'matrix_shape': np.array(matrix.shape)}
+
+    return {'matrix': matrix}
+
+
+def _matrix(arrays):
+
+    if 'matrix' in arrays:
+        return arrays['matrix']
+
+    return scipy.sparse.csr_array((arrays['matrix_data'], arrays['matrix_indices'], arrays['matrix_indptr']),
+                                  shape=tuple(arrays['matrix_shape']))
+
+
+def save_grind(grind, filename):
+    """
+    Saves a solved Grind (resource matrix, references, decomposition and solution) to a file.
+
+    :param grind: Grind instance
+    :param filename: name of the file, conventionally ending in .npz
+    """
+    header = {'kind': 'grind', 'version': FILE_VERSION, 'toggles': repr(mammothCache.toggles()),
+              'stats': grind.stats, 'steps': grind.steps, 'overflow_list': grind.overflow_list,
+              'blacklist': grind.blacklist, 'add_parameters': grind.add_parameters, 'solver': grind.solver,
+              'sparse': grind.sparse, 'grind_dim': None if grind.grind_dim is None else int(grind.grind_dim),
+              'updates': grind.updates, 'epaTotal': float(grind.epaTotal), 'epa': float(grind.epa),
+              'spa': float(grind.spa)}
+
+    arrays = dict(_matrix_arrays(grind.matrix), reses=np.asarray(grind.reses, dtype=str), gain=grind.gain,
+                  solution=grind.solution, shadow_prices=grind.shadow_prices)
+    if grind.kernel is not None:
+        arrays['kernel'] = grind.kernel
+    if grind.svd is not None:
+        arrays.update(svd_l=grind.svd[0], svd_v=grind.svd[1], svd_r=grind.svd[2])
+    if grind.warm_start is not None:
+        arrays['warm_start'] = grind.warm_start
+
+    write_archive(filename, header, arrays)
+
+
+def load_grind(filename, mmap=True):
+    """
+    Loads a Grind saved by save_grind, without building any recipe or solving anything.
+
+    :param mmap: whether to memory-map the arrays rather than read them into memory
+    :return: the Grind instance
+    """
+    header, arrays = read_archive(filename, mmap)
+    _check_header(header, 'grind', filename)
+
+    grind = Grind.__new__(Grind)
+    grind.stats = header['stats']
+    grind.steps = header['steps']
+    grind.overflow_list = header['overflow_list']
+    grind.blacklist = header['blacklist']
+    grind.add_parameters = header['add_parameters']
+    grind.solver = header['solver']
+    grind.sparse = header['sparse']
+    grind.grind_dim = header['grind_dim']
+    grind.updates = header['updates']
+    grind.epaTotal = header['epaTotal']
+    grind.epa = header['epa']
+    grind.spa = header['spa']
+    grind.profile = None
+    grind.lp_result = None
+
+    grind.matrix = _matrix(arrays)
+    grind.reses = arrays['reses']
+    grind.gain = arrays['gain']
+    grind.solution = arrays['solution']
+    grind.shadow_prices = arrays['shadow_prices']
+    grind.kernel = arrays.get('kernel')
+    grind.svd = (arrays['svd_l'], arrays['svd_v'], arrays['svd_r']) if 'svd_v' in arrays else None
+    grind.warm_start = arrays.get('warm_start')
+
+    grind.dim0 = len(grind.reses)
+    grind.dim1 = len(grind.steps)
+    grind.ref = {grind.reses[i]: i for i in range(grind.dim0)}
+    grind.step_ref = {grind.steps[i]: i for i in range(grind.dim1)}
+
+    return grind
+
+
+# the arrays making up a solved Sweep, besides its stats and the per-step tables
+SWEEP_ARRAYS = ('mask', 'reses', 'index', 'unique', 'inverse', 'unique_solution', 'solution', 'epaTotal', 'epa',
+                'spa', 'practicable', 'grind_dim')
+
+
+def save_sweep(sweep, filename):
+    """
+    Saves a solved Sweep (stats, per-step tables and all the result arrays) to a file.
+
+    :param sweep: Sweep instance
+    :param filename: name of the file, conventionally ending in .npz
+    """
+    header = {'kind': 'sweep', 'version': FILE_VERSION, 'toggles': repr(mammothCache.toggles()),
+              'stat_names': sweep.stat_names, 'shape': list(sweep.shape), 'steps': sweep.steps,
+              'overflow_list': sweep.overflow_list, 'batch_size': sweep.batch_size, 'solver': sweep.solver,
+              'compiled': sweep.compiled}
+
+    arrays = {name: getattr(sweep, name) for name in SWEEP_ARRAYS}
+    arrays['reses'] = np.asarray(sweep.reses, dtype=str)
+    arrays.update(('stat_%d' % i, sweep.stats[name]) for i, name in enumerate(sweep.stat_names))
+    arrays.update(('table_%d' % j, table) for j, table in enumerate(sweep.tables))
+
+    write_archive(filename, header, arrays)
+
+
+def load_sweep(filename, mmap=True):
+    """
+    Loads a Sweep saved by save_sweep, without building any recipe or solving anything.
+
+    :param mmap: whether to memory-map the arrays rather than read them into memory, so that every process
+        loading the same file shares the same copy of the results
+    :return: the Sweep instance
+    """
+    header, arrays = read_archive(filename, mmap)
+    _check_header(header, 'sweep', filename)
+
+    sweep = Sweep.__new__(Sweep)
+    sweep.stat_names = header['stat_names']
+    sweep.shape = tuple(header['shape'])
+    sweep.size = int(np.prod(sweep.shape, dtype=int))
+    sweep.steps = header['steps']
+    sweep.overflow_list = header['overflow_list']
+    sweep.batch_size = header['batch_size']
+    sweep.solver = header['solver']
+    sweep.compiled = header['compiled']
+
+    for name in SWEEP_ARRAYS:
+        setattr(sweep, name, arrays[name])
+    sweep.stats = {name: arrays['stat_%d' % i] for i, name in enumerate(sweep.stat_names)}
+    sweep.tables = [arrays['table_%d' % j] for j in range(len(sweep.steps))]
+
+    sweep.dim0 = len(sweep.reses)
+    sweep.dim1 = len(sweep.steps)
+    sweep.ref = {sweep.reses[i]: i for i in range(sweep.dim0)}
+    sweep.step_ref = {sweep.steps[i]: i for i in range(sweep.dim1)}
+
+    return sweep
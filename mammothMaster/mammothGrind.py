@@ -1,13 +1,16 @@
 import numpy as np
-from scipy.optimize import minimize, LinearConstraint
-from .mammothRecipe import ALL_STEPS, RES, REFR, LENGTH, EPS, Overflow
+import scipy
+from .mammothRecipe import ALL_STEPS, RES, REFR, LENGTH, EPS, PRICES, SPARSE_THRESHOLD, APOC_CAP, Overflow
+from . import mammothCache, mammothProfile
+from .mammothProfile import timer
 
 # The grind class:
 # the class storing the meat of the mathematical machinery needed to solve the grind
 
 class Grind:
     
-    def __init__(self, stats, steps, overflow_list=[], blacklist=None, add_parameters={'NO':0}):
+    def __init__(self, stats, steps, overflow_list=[], blacklist=None, add_parameters={'NO':0}, solver='lp',
+                 sparse=None, profile=False):
         """
 
         :param stats: dictionary containing all the player stats as entries of the form {'statname': score}.
@@ -18,12 +21,24 @@ class Grind:
         :param blacklist: list of resources that should always be ignored when evaluating the cycle.
         :param add_parameters: additional arguments to be passed along to certain steps that accept additional inputs
             (example: strategies for balmoral runs), of the form dict('step name': [list of parameters])
+        :param solver: name of the backend used to find the optimal cycle, as stored in the SOLVERS dictionary:
+            'lp' (exact linear program, the default) or 'svd' (nullspace decomposition plus local optimization).
+        :param sparse: whether to store the resource matrix as a scipy.sparse CSR array; by default it's used
+            whenever the resource catalog is larger than SPARSE_THRESHOLD.
+        :param profile: whether to record the time spent in every phase of the solve in self.profile, a SolveProfile
+            (see mammothProfile); grinds built inside a mammothProfile.profiling() block are always recorded.
         """
         self.dim1 = len(steps)
+        self.solver = solver
+        self.sparse = LENGTH > SPARSE_THRESHOLD if sparse is None else sparse
             
         self.ref = {} #dictionary reference of the resources involved in the cycle
         self.steps = [] #internal list of steps to take
-        self.overflow_list = overflow_list
+        self.overflow_list = list(overflow_list) # (a copy, as add_step and add_overflow change it)
+        self.blacklist = [] if blacklist is None else blacklist
+        self.add_parameters = add_parameters
+        profiler = mammothProfile.profiler
+        self.profile = mammothProfile.SolveProfile(stats, steps, solver) if profile or profiler is not None else None
         
         temp_matrix = [] #temporary list-of-arrays in which to store the resource arrays
         self.stats = stats
@@ -37,41 +52,60 @@ class Grind:
 
         i = 0
         #collates the resource matrix
-        for stp_name in steps:
+        with mammothCache.building():
+            for stp_name in steps:
 
-            if stp_name in add_parameters: #check if kwargs include additional inputs for this step
-                temp = ALL_STEPS[stp_name](stats, add_parameters[stp_name])
-                
-            else:
-                temp = ALL_STEPS[stp_name](stats)
-            # some recipe initialization functions may return 0 rather than an instance, such as when trying
-            # to add Holy Mammoths to the cycle with scrimshander_knife == 0; the if branch avoids it being added
+                with timer(self.profile, stp_name, 'step_times'):
+                    temp = make_step(stp_name, stats, add_parameters)
+                # some recipe initialization functions may return 0 rather than an instance, such as when trying
+                # to add Holy Mammoths to the cycle with scrimshander_knife == 0; the if branch avoids it being added
             
-            if temp:        
-                temp_matrix.append(temp.resources)
-                self.step_ref[stp_name] = i
-                self.steps.append(stp_name)
-                i += 1
-                if temp.OFresources:
-                    # if the recipe involves resources that can both be sold or used in further steps, add them to
-                    # the overflow list
-                    for item in temp.OFresources:
-                        if item not in overflow_list:
-                            self.overflow_list.append(item)
-
-        if overflow_list:
+                if temp:        
+                    temp_matrix.append(temp.entries() if self.sparse else temp.dense())
+                    self.step_ref[stp_name] = i
+                    self.steps.append(stp_name)
+                    i += 1
+                    if temp.OFresources:
+                        # if the recipe involves resources that can both be sold or used in further steps, add them to
+                        # the overflow list
+                        for item in temp.OFresources:
+                            if item not in self.overflow_list:
+                                self.overflow_list.append(item)
+
+        if self.overflow_list:
             
-            for item in overflow_list:
+            for item in self.overflow_list:
                 
                 temp = Overflow(item)
-                temp_matrix.append(temp.resources)
+                temp_matrix.append(temp.entries() if self.sparse else temp.dense())
                 self.step_ref[item + ' Overflow'] = i
                 self.steps.append(item + ' Overflow')
                 i += 1
+
+        if self.profile is not None:
+            self.profile.lap('recipes')
         
-        a = np.asarray(temp_matrix).transpose()         #puts it in the correct shape (resources-rows, steps-columns)
-        inv_mask = np.logical_or(inv_mask, (a==0).all(1))#adds unused items to list of resources to ignore
-        self.matrix = a[~inv_mask]          #removes all unused resources
+        if self.sparse:
+
+            # temp_matrix holds the (indices, values) pairs of every column: stack them as COO triplets,
+            # drop the unused and blacklisted resources and compress the rest into a CSR array
+            rows = np.concatenate([index for index, values in temp_matrix]).astype(int)
+            cols = np.repeat(np.arange(len(temp_matrix)), [len(index) for index, values in temp_matrix])
+            vals = np.concatenate([values for index, values in temp_matrix])
+            used = np.zeros(LENGTH, dtype=bool)
+            used[rows] = True
+            inv_mask = np.logical_or(inv_mask, ~used)
+            remap = np.cumsum(~inv_mask) - 1            #new row index of every resource that's kept
+            keep = ~inv_mask[rows]
+            self.matrix = scipy.sparse.csr_array((vals[keep], (remap[rows[keep]], cols[keep])),
+                                                 shape=((~inv_mask).sum(), len(temp_matrix)))
+
+        else:
+
+            a = np.asarray(temp_matrix).transpose()         #puts it in the correct shape (resources-rows, steps-columns)
+            inv_mask = np.logical_or(inv_mask, (a==0).all(1))#adds unused items to list of resources to ignore
+            self.matrix = a[~inv_mask]          #removes all unused resources
+
         self.reses = RES[~inv_mask]         #creates view of the RES array involving only relevant resources
         self.dim0 = len(self.reses)
         self.dim1 = len(self.steps)
@@ -82,11 +116,66 @@ class Grind:
         for i in range(self.dim0):          
             self.ref[self.reses[i]] = i
 
+        if self.profile is not None:
+            self.profile.lap('assembly')
+
+        # the decomposition of the resource matrix and the starting point of the optimization are only kept
+        # to be updated by add_step and remove_step
+        self.svd = None
+        self.kernel = None
+        self.warm_start = None
+        self.updates = 0
+        self.lp_result = None   # only set by the lp backend
+
         #find the epa and solution vector
         self.solve()
+        if profiler is not None:
+            profiler.add(self.profile)
         
         
     def solve(self):
+
+        # Actions, echoes and scrip rows as dense arrays
+        head = self.matrix[:3].toarray() if self.sparse else self.matrix[:3]
+
+        # Calculates the total echo gain of each step, converting scrip to echoes through hambitrage.
+        self.gain = head[1] + EPS*head[2]
+
+        # solved grinds may be reused from the on-disk store, if it's turned on (see mammothCache)
+        store = mammothCache.grind_store
+        cached = store.load(self.matrix, self.solver) if store is not None else None
+
+        if cached is not None:
+
+            self.solution, self.grind_dim = cached
+            self.lp_result = None
+            if self.profile is not None:
+                self.profile.cached = True
+
+        else:
+
+            SOLVERS[self.solver](self)
+            if store is not None:
+                store.save(self.matrix, self.solver, self.solution, self.grind_dim)
+
+        actions = np.dot(self.solution, head[0])
+        echoes = np.dot(self.solution, head[1])
+        scrip = np.dot(self.solution, head[2])
+        echoesTotal = np.dot(self.solution, self.gain)
+        # scrip = np.dot(self.sol, self.matrix[2])
+        self.epaTotal = echoesTotal / actions
+        self.epa = echoes / actions
+        self.spa = scrip / actions
+
+        # worth of one more unit of every resource in the grind, in echoes (see self.duals); an action is worth
+        # -epaTotal, as actions are recorded as positive costs
+        if np.isfinite(self.epaTotal):
+            pi, rho = self.duals()
+            self.shadow_prices = np.concatenate([[-rho, 1, EPS], -pi])
+        else:
+            self.shadow_prices = np.full(self.dim0, np.nan)
+
+    def solve_svd(self):
         
         # Singular value decomposition: decomposes the resource matrix as l*V*r^-1, where
         # v is a list of the resource matrix's principal values (some of which may be 0),
@@ -94,24 +183,18 @@ class Grind:
         # is of no use to us.
         # We are interested in the rows of r that are null'd by multiplication with the resource matrix,
         # which in this decomposition correspond to the last d rows of r, where d is the difference
-        # between the number of steps and the number of non-zero singular values
-        
-        l,v,r = np.linalg.svd(self.matrix[3:])
-        
-        # Calculate dimension of the kernel, based on number of vectors corresponding to null columns
-        # plus number of vectors corresponding to null singular values.
-        # np.isclose(v, 0, atol=5e-16) is a boolean array indicating whether each singular value is close enough
-        # to zero so that the .sum() may count the number of Trues.
-        self.grind_dim = self.dim1 - len(v) + np.isclose(v, 0, atol=5e-16).sum()
-        
-        # Calculates the total echo gain of each step, converting scrip to echoes through hambitrage.
-        self.gain = self.matrix[1] + EPS*self.matrix[2]
+        # between the number of steps and the number of non-zero singular values (see self.decompose).
+        # The decomposition needs a dense matrix, so sparse resource matrices are expanded first.
+
+        matrix = self.matrix.toarray() if self.sparse else self.matrix
+        self.decompose()
+        self.solution = np.full(self.dim1, np.nan) # left as is if no valid cycle is found
         
         # If self.grind_dim == 1 that means there is only one possible solution,
         # stored as the last row of the r array.
         if self.grind_dim == 1:
 
-            self.solution = r[-1]
+            self.solution = self.kernel[:, -1]
             
         # If grind_dim == 0 that means that there is no way to chain all or some of these steps into a
         # self-sufficient cycle.
@@ -127,7 +210,7 @@ class Grind:
         
         else:
             
-            self.basis = r[-self.grind_dim:].transpose() #basis for the resource matrix's nullspace
+            self.basis = self.kernel #basis for the resource matrix's nullspace
             # We need to find the linear combination of our basis vectors that maximizes epa, with the constraint
             # that it has to have all non-negative entries.
 
@@ -139,26 +222,30 @@ class Grind:
             # such that it is as close as possible to the all-positive np.ones(number of steps) vector, thus
             # improving the chances of it respecting our constraint; because self.basis is orthonormal this
             # can be easily implemented by summing over its rows using ndarray.sum(0).
+            # After add_step/remove_step we start from the previous optimum instead, projected onto the new nullspace.
 
             self.X = np.matmul(self.gain, self.basis)
-            self.Y = np.matmul(self.matrix[0], self.basis)
-            x_0 = self.basis.sum(0)
-            reality_constr = LinearConstraint(self.basis, 0, +np.inf)
-            result = minimize(self.calc_invepa, x_0, method='SLSQP', constraints=reality_constr)
+            self.Y = np.matmul(matrix[0], self.basis)
+            x_0 = None
+            if self.warm_start is not None and np.all(np.isfinite(self.warm_start)):
+                # (the previous solution may come with either sign, as the svd ones do)
+                x_0 = np.matmul(self.warm_start, self.basis)*np.sign(np.dot(self.warm_start, matrix[0]))
+            with timer(self.profile, 'optimizer'):
+                result = optimize_kernel(self.basis, self.gain, matrix[0], x_0)
+            if self.profile is not None:
+                self.profile.optimizer(result)
+            cycle = np.matmul(self.basis, result.x)
+            if x_0 is not None and not (result.success and np.all(cycle >= -1e-9*np.abs(cycle).max())):
+                # the warm start didn't pan out: start over from a fresh decomposition and the usual starting guess,
+                # just like a newly built Grind would
+                self.svd = None
+                self.warm_start = None
+                return self.solve_svd()
 
             if result.success:
                 
                 print('optimization successful')
-                self.solution = np.matmul(self.basis, result.x)
-
-        actions = np.dot(self.solution, self.matrix[0])
-        echoes = np.dot(self.solution, self.matrix[1])
-        scrip = np.dot(self.solution, self.matrix[2])
-        echoesTotal = np.dot(self.solution, self.gain)
-        # scrip = np.dot(self.sol, self.matrix[2])
-        self.epaTotal = echoesTotal / actions
-        self.epa = echoes / actions
-        self.spa = scrip / actions
+                self.solution = cycle
 
         # Check that the solution found is a valid one and actually respects our reality constraint:
         # all entries need to either be zero (which is signalled, as it means that one step is superfluous) or
@@ -177,6 +264,354 @@ class Grind:
             if check1 != check2:        # if check1 != check2 then some nonzero entries have different signs
                 print('erorr: grind not practicable')
                 
+    def solve_lp(self):
+
+        # The max-epa cycle is a linear-fractional program: maximize (gain . x)/(actions . x) over all the cycles x
+        # that balance every resource and only run steps a non-negative number of times.
+        # Because the cycle is only defined up to a scale factor we can fix it so that it takes exactly one action
+        # (Charnes-Cooper transformation), which turns the ratio into a plain linear objective:
+        # maximize gain . y  subject to  resources * y = 0,  actions . y = 1,  y >= 0
+        # whose global optimum is found exactly by the HiGHS simplex solver, with no sign check needed afterwards.
+
+        # The nullspace dimension is still computed, both for consistency with the svd backend and because
+        # when there's only one possible cycle and it's all of one sign it is already the optimum,
+        # which saves us from calling the (comparatively slow) linprog machinery altogether.
+        # Sparse resource matrices skip the decomposition (and leave grind_dim as None) since it would need
+        # the whole dense matrix; HiGHS works on the sparse matrix directly.
+        if self.sparse:
+
+            self.grind_dim = None
+
+        else:
+
+            self.decompose()
+
+        if self.grind_dim == 1:
+
+            cycle = self.kernel[:, -1]
+            signs = np.sign(cycle)
+            if np.abs(signs.sum()) == np.abs(signs).sum():
+
+                self.lp_result = None
+                self.solution = cycle/np.dot(cycle, self.matrix[0])
+                return
+
+        # (scipy doesn't expose a way to warm-start HiGHS, so this is always solved from scratch)
+        with timer(self.profile, 'optimizer'):
+            self.lp_result = lp_cycle(self.matrix, self.gain)
+        if self.profile is not None:
+            self.profile.optimizer(self.lp_result)
+
+        if self.lp_result.status == 0:
+
+            self.solution = self.lp_result.x
+
+        else:
+
+            print('warning: grind not practicable (no solutions)')
+            self.solution = np.full(self.dim1, np.nan)
+
+    def decompose(self):
+
+        # Singular value decomposition of the resource matrix (minus the actions/echoes/scrip rows), kept in its thin
+        # form self.svd = (l, v, r) holding only the non-zero singular values, along with self.kernel, whose columns
+        # are an orthonormal basis for the nullspace; add_step and remove_step update both incrementally.
+        if self.svd is None:
+
+            matrix = self.matrix.toarray() if self.sparse else self.matrix
+            with timer(self.profile, 'svd'):
+                l,v,r = np.linalg.svd(matrix[3:])
+
+            # Calculate dimension of the kernel, based on number of vectors corresponding to null columns
+            # plus number of vectors corresponding to null singular values.
+            # np.isclose(v, 0, atol=5e-16) is a boolean array indicating whether each singular value is close enough
+            # to zero so that the .sum() may count the number of Trues.
+            rank = len(v) - np.isclose(v, 0, atol=5e-16).sum()
+            self.svd = (l[:, :rank], v[:rank], r[:rank])
+            self.kernel = r[rank:].transpose()
+
+        self.grind_dim = self.dim1 - len(self.svd[1])
+
+    def add_step(self, stp_name):
+        """
+        Adds a step to the grind and re-solves it, updating the resource matrix, its decomposition and all the
+        internal references in place rather than rebuilding the whole grind.
+
+        :param stp_name: name of the step, as stored in the ALL_STEPS dictionary
+        """
+        if stp_name in self.step_ref:
+            return
+
+        with timer(self.profile, stp_name, 'step_times'), mammothCache.building():
+            temp = make_step(stp_name, self.stats, self.add_parameters)
+        if not temp:
+            print('warning: %s not available' % stp_name)
+            return
+
+        self.insert_column(stp_name, temp.dense())
+        for item in temp.OFresources:
+            if item not in self.overflow_list:
+                self.overflow_list.append(item)
+                self.insert_column(item + ' Overflow', Overflow(item).dense())
+
+        self.solve()
+
+    def add_overflow(self, item):
+        """
+        Adds an overflow step for a resource to the grind and re-solves it.
+        """
+        if item + ' Overflow' in self.step_ref:
+            return
+
+        self.overflow_list.append(item)
+        self.insert_column(item + ' Overflow', Overflow(item).dense())
+        self.solve()
+
+    def remove_step(self, stp_name):
+        """
+        Removes a step (or an overflow step, named 'resource Overflow') from the grind and re-solves it,
+        updating everything in place like add_step.
+        """
+        j = self.step_ref[stp_name]
+        dense = not self.sparse
+
+        column = self.matrix[:, j] if dense else self.matrix[:, [j]].toarray()[:, 0]
+        if self.svd is not None:
+            # removing a column is the same as zeroing it (a rank-one update) and then dropping it
+            e = np.zeros(self.dim1)
+            e[j] = 1
+            with timer(self.profile, 'svd'):
+                l, v, r = svd_update(*self.svd, -column[3:], e)
+            self.svd = (l, v, np.delete(r, j, 1))
+
+        self.warm_start = None if self.solution is None else np.delete(self.solution, j)
+        if dense:
+            self.matrix = np.delete(self.matrix, j, 1)
+        else:
+            self.matrix = self.matrix[:, np.delete(np.arange(self.dim1), j)]
+        self.steps.remove(stp_name)
+        if stp_name.endswith(' Overflow') and stp_name[:-9] in self.overflow_list:
+            self.overflow_list.remove(stp_name[:-9])
+
+        # resources nobody uses anymore are dropped, just like in __init__
+        # (the actions, echoes and scrip rows always stay in place)
+        used = (self.matrix != 0).any(1) if dense else np.diff(self.matrix.tocsr().indptr) > 0
+        unused = [i for i in np.flatnonzero(~used) if i >= 3]
+        if unused:
+            keep = np.delete(np.arange(self.dim0), unused)
+            self.matrix = self.matrix[keep]
+            self.reses = self.reses[keep]
+            if self.svd is not None:
+                l, v, r = self.svd
+                self.svd = (np.delete(l, [i - 3 for i in unused], 0), v, r)
+
+        self.update_refs()
+        self.solve()
+
+    def insert_column(self, name, column):
+        # appends a resource column (of length LENGTH) to the resource matrix, adding rows for any new resources
+
+        dense = not self.sparse
+        new = [RES[i] for i in np.flatnonzero(column) if RES[i] not in self.ref and RES[i] not in self.blacklist]
+        if new:
+            if dense:
+                self.matrix = np.vstack([self.matrix, np.zeros((len(new), self.dim1))])
+            else:
+                self.matrix = scipy.sparse.vstack([self.matrix, scipy.sparse.csr_array((len(new), self.dim1))],
+                                                  format='csr')
+            self.reses = np.append(self.reses, new)
+            if self.svd is not None:
+                l, v, r = self.svd
+                self.svd = (np.vstack([l, np.zeros((len(new), len(v)))]), v, r)
+
+        values = column[[REFR[item] for item in self.reses]]
+        if dense:
+            self.matrix = np.hstack([self.matrix, values[:, np.newaxis]])
+        else:
+            self.matrix = scipy.sparse.hstack([self.matrix, scipy.sparse.csr_array(values[:, np.newaxis])],
+                                              format='csr')
+
+        if self.svd is not None:
+            # appending a column is the same as appending a zero one (which leaves the decomposition unchanged
+            # apart from a zero entry in each row of r) and then adding the column as a rank-one update
+            l, v, r = self.svd
+            r = np.hstack([r, np.zeros((len(v), 1))])
+            e = np.zeros(self.dim1 + 1)
+            e[-1] = 1
+            with timer(self.profile, 'svd'):
+                self.svd = svd_update(l, v, r, values[3:], e)
+
+        self.warm_start = None if self.solution is None else np.append(self.solution, 0)
+        self.steps.append(name)
+        self.update_refs()
+
+    def update_refs(self):
+        # rebuilds the step and resource references after the resource matrix changes shape, and the nullspace
+        # basis out of the updated decomposition
+
+        self.dim0 = len(self.reses)
+        self.dim1 = len(self.steps)
+        self.ref = {self.reses[i]: i for i in range(self.dim0)}
+        self.step_ref = {self.steps[i]: i for i in range(self.dim1)}
+
+        if self.svd is None:
+            return
+
+        # errors pile up with every update, so the decomposition is redone from scratch every now and then
+        self.updates += 1
+        if self.updates % 32 == 0:
+            self.svd = None
+            return
+
+        # the nullspace is the orthogonal complement of the rows of r
+        r = self.svd[2]
+        q, _ = np.linalg.qr(r.transpose(), mode='complete')
+        self.kernel = q[:, len(r):]
+
+    def duals(self, tol=1e-9):
+        """
+        Dual values of the optimal cycle: how much epaTotal would change if each balance constraint were loosened.
+
+        The cycle scaled to one action, y, maximizes gain . y subject to resources * y = 0 and actions . y = 1; the
+        duals are the multipliers (pi, rho) of those constraints, such that every step has gain - pi*resources -
+        rho*actions <= 0, with equality for the steps in use (and rho == epaTotal). They're taken from the linear
+        program when there is one, and otherwise recovered from the equality on the steps in use by least squares.
+
+        :param tol: frequency below which a step is considered unused
+        :return: pi (one entry per row of the resource matrix past the first three) and rho
+        """
+        actions = self.matrix[[0]].toarray()[0] if self.sparse else self.matrix[0]
+        y = self.solution/np.dot(self.solution, actions)
+
+        if self.lp_result is not None and self.lp_result.status == 0:
+
+            # HiGHS minimizes -gain . y, so its marginals are the opposite of ours
+            marginals = -self.lp_result.eqlin.marginals
+            return marginals[:-1], marginals[-1]
+
+        used = y > tol
+        a_eq = self.matrix[3:][:, used]
+        a_eq = a_eq.toarray() if self.sparse else a_eq
+        a_eq = np.vstack([a_eq, actions[used]])
+        duals = np.linalg.lstsq(a_eq.transpose(), self.gain[used], rcond=None)[0]
+        return duals[:-1], duals[-1]
+
+    def step_value(self, step):
+        """
+        Reduced cost of a step at the current shadow prices: the echoes gained by each run of it once all the resources
+        it uses or makes (including the actions it takes) are valued at their shadow price. Since the shadow prices
+        make every step of the optimal cycle break even, a step that isn't already part of the grind can only raise
+        epaTotal if its value is positive; no new grind has to be built or solved to find out.
+
+        :param step: name of the step (as stored in the ALL_STEPS dictionary) or recipe instance
+        :return: the value of the step, or nan if it involves resources that aren't part of the grind and can't be
+            sold (whose worth can't be told from this solution)
+        """
+        if isinstance(step, str):
+            step = make_step(step, self.stats, self.add_parameters)
+            if not step:
+                return np.nan
+
+        index, values = step.entries()
+        worth = 0.
+        for i, value in zip(index, values):
+            if RES[i] in self.blacklist:
+                continue
+            if RES[i] in self.ref:
+                worth += value*self.shadow_prices[self.ref[RES[i]]]
+            elif value > 0 and RES[i] in PRICES and PRICES[RES[i]][0] in self.ref:
+                # new resources that can be sold are worth their price (adding the step adds their overflow)
+                currency, price = PRICES[RES[i]]
+                worth += value*price*self.shadow_prices[self.ref[currency]]
+            else:
+                return np.nan
+
+        return worth
+
+    def summary(self):
+        """
+        The results of the grind as plain python values (e.g. to be sent as JSON): epaTotal, epa, spa, grind_dim and
+        the number of times every step is taken per action; the values of a grind with no practicable cycle are None.
+        """
+        def number(value):
+            return float(value) if np.isfinite(value) else None
+
+        actions = self.matrix[[0]].toarray()[0] if self.sparse else self.matrix[0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratios = self.solution/np.dot(self.solution, actions)
+
+        return {'epaTotal': number(self.epaTotal), 'epa': number(self.epa), 'spa': number(self.spa),
+                'grind_dim': None if self.grind_dim is None else int(self.grind_dim),
+                'ratios': {step: number(ratio) for step, ratio in zip(self.steps, ratios)}}
+
+    def print_prices(self):
+
+        # Prints the shadow price of each resource in the grind, in echoes per unit.
+        for i in range(self.dim0):
+            print(self.reses[i] + ': %.6f' % self.shadow_prices[i])
+
+    def sensitivities(self, h=1):
+        """
+        Gradient of epaTotal with respect to every stat, to EPS and to every price in PRICES, from a single solve.
+
+        By the envelope theorem the optimal cycle y doesn't change to first order, so the derivative of epaTotal with
+        respect to anything that changes the resource matrix by dM is y . (dgain - pi*dM - rho*dactions), with
+        (pi, rho) from self.duals(); the recipes are rebuilt (but the grind isn't re-solved) with every stat they read
+        moved by +-h, which gives the central differences of their coefficients (one-sided at a score of 0 and at
+        the aPoC cap, which they never go past; from the cap on raising aPoC changes nothing, so its derivative is 0).
+        Resources that don't show up in the grind at all are ignored, even if the change of a stat would make them.
+
+        :param h: step of the differences; stats are integers (aPoC is even used as an index), hence the default of 1
+        :return: dictionary of the form {'stats': {'statname': derivative}, 'EPS': derivative,
+            'PRICES': {'resource': derivative}}
+        """
+        pi, rho = self.duals()
+        actions = self.matrix[[0]].toarray()[0] if self.sparse else self.matrix[0]
+        y = self.solution/np.dot(self.solution, actions)
+        rows = [REFR[item] for item in self.reses]
+
+        def derivative(j, dcol):
+            # first-order change of epaTotal when the j-th column changes by dcol (of length LENGTH)
+
+            dcol = dcol[rows]
+            return y[j]*(dcol[1] + EPS*dcol[2] - np.dot(pi, dcol[3:]) - rho*dcol[0])
+
+        stats = {name: 0. for name in self.stats}
+        with mammothCache.building():
+            for stp_name in self.steps:
+
+                if stp_name not in ALL_STEPS:    # overflow steps
+                    continue
+                j = self.step_ref[stp_name]
+                probe = mammothCache.StatsRecorder(self.stats)
+                make_step(stp_name, probe, self.add_parameters)
+
+                for name in probe.read:
+
+                    if name == 'aPoC' and self.stats[name] >= APOC_CAP:
+                        continue
+                    lower = dict(self.stats, **{name: max(self.stats[name] - h, 0)})
+                    upper = dict(self.stats, **{name: self.stats[name] + h})
+                    if name == 'aPoC':
+                        upper[name] = min(upper[name], APOC_CAP)
+                    down = make_step(stp_name, lower, self.add_parameters)
+                    up = make_step(stp_name, upper, self.add_parameters)
+                    if not down or not up:
+                        continue
+                    stats[name] += derivative(j, (up.dense() - down.dense())/(upper[name] - lower[name]))
+
+        prices = {}
+        for item, (currency, price) in PRICES.items():
+
+            dcol = np.zeros(LENGTH)
+            dcol[REFR[currency]] = 1
+            prices[item] = derivative(self.step_ref[item + ' Overflow'], dcol) \
+                if item + ' Overflow' in self.step_ref else 0.
+
+        # gain = echoes + EPS*scrip, so the derivative with respect to EPS is simply the scrip per action
+        return {'stats': stats, 'EPS': np.dot(y, self.matrix[[2]].toarray()[0] if self.sparse else self.matrix[2]),
+                'PRICES': prices}
+
     def calc_invepa(self, v):
         
         echoes = np.matmul(self.X, v)
@@ -196,19 +631,248 @@ class Grind:
             ratio = self.solution[i]/self.solution[0]
             print(self.steps[i] + ': %.15f' % ratio)
 
+    def integer_cycle(self, max_actions=None, tol=None, loss=0.01, time_limit=None):
+        """
+        A cycle that can actually be played: a whole number of runs of every step, after which no resource is short
+        and, if tol is given, none is left over by more than tol of the amount of it the cycle makes and uses (the
+        overflow steps sell whatever they're given, so their resources are always balanced). The recipes give
+        fractional amounts, so such a cycle is an integer point close to the optimal cycle, which is found by HiGHS
+        (milp_cycle) rather than by scaling the ratios up until they happen to round well.
+
+        Without max_actions it's the cycle taking the fewest actions whose epaTotal is within loss (relative) of the
+        optimal one (leftovers, which are wasted, count against it); with max_actions it's the cycle with the best
+        epaTotal among the ones taking at most that many actions, found by Dinkelbach's method: maximizing
+        gain - ratio*actions over the integer cycles and moving ratio to the epaTotal of the cycle found, until no
+        cycle does better (a handful of solves).
+
+        :param max_actions: cap on the actions of the cycle
+        :param tol: largest surplus of any resource over a cycle, relative to the amount of it made and used (by
+            default any, some resources coming by the thousand from a single step)
+        :param loss: largest relative loss of epaTotal of the smallest cycle (ignored with max_actions)
+        :param time_limit: seconds after which HiGHS gives back the best cycle found so far (per solve)
+        :return: dictionary of the number of runs of every step used ('counts'), the actions, epaTotal, epa and spa of
+            the cycle and the surplus of every resource that doesn't balance exactly; None if there's no such cycle
+        """
+        if not np.isfinite(self.epaTotal):
+            print('warning: grind not practicable (no solutions)')
+            return None
+
+        head = self.matrix[:3].toarray() if self.sparse else self.matrix[:3]
+        integrality = np.array([0 if step.endswith(' Overflow') else 1 for step in self.steps])
+
+        if max_actions is None:
+
+            # fewest actions, with gain >= (1 - loss)*epaTotal*actions; HiGHS gets nowhere near as far without a
+            # cap on the actions, so the cap is doubled until there's a cycle under it (proving there's none is quick)
+            cap = 1000.
+            while True:
+                result = milp_cycle(self.matrix, -head[0], integrality, tol, cap,
+                                    [(1 - loss)*self.epaTotal*head[0] - self.gain], [0], time_limit)
+                if result.status != 2 or cap > 1e8:
+                    break
+                cap *= 2
+            x = result.x
+
+        else:
+
+            x, ratio = None, 0.
+            for _ in range(100):
+                result = milp_cycle(self.matrix, self.gain - ratio*head[0], integrality, tol, max_actions,
+                                    time_limit=time_limit)
+                if result.x is None or (x is not None and np.dot(result.x, self.gain) <= ratio*np.dot(
+                        result.x, head[0])*(1 + 1e-12)):
+                    break
+                x = result.x
+                ratio = np.dot(x, self.gain)/np.dot(x, head[0])
+
+        if x is None:
+            print('warning: no integer cycle (%s)' % result.message)
+            return None
+
+        x = np.where(integrality == 1, np.round(x), x)
+        actions, echoes, scrip = head @ x
+        surplus = self.matrix[3:] @ x
+        return {'counts': {step: int(count) if integer else float(count)
+                           for step, count, integer in zip(self.steps, x, integrality) if count > 1e-9},
+                'actions': float(actions), 'epaTotal': float((echoes + EPS*scrip)/actions),
+                'epa': float(echoes/actions), 'spa': float(scrip/actions),
+                'surplus': {name: float(value) for name, value in zip(self.reses[3:], surplus) if abs(value) > 1e-9}}
+
+    def print_cycle(self, max_actions=None, tol=None, loss=0.01):
+
+        # Prints the integer cycle (see integer_cycle) as the number of runs of each step.
+        cycle = self.integer_cycle(max_actions, tol, loss)
+        if cycle is None:
+            return
+        print('%g actions, epaTotal %.6f (%.6f)' % (cycle['actions'], cycle['epaTotal'], self.epaTotal))
+        for step, count in cycle['counts'].items():
+            print('%8g %s' % (count, step))
+
     def matrix(self, name='Actions'):
         if name in self.reses:
             return self.matrix[self.ref[name]]
         if name in self.steps:
             return self.matrix[:self.step_ref[name]]
 
-def ranching(*args, stats, overflow_list=[], blacklist=None, add_parameters={'NO':0}):
+def make_step(stp_name, stats, add_parameters={'NO':0}):
+    """
+    Builds the recipe instance of a single step.
+
+    :param stp_name: name of the step, as stored in the ALL_STEPS dictionary.
+    :param stats: dictionary containing all the player stats as entries of the form {'statname': score}.
+    :param add_parameters: additional arguments to be passed along to certain steps, of the form
+        dict('step name': [list of parameters])
+    :return: the recipe instance, or 0 if the step isn't available with the current settings
+    """
+    params = ()
+    if stp_name in add_parameters: #check if kwargs include additional inputs for this step
+        params = (add_parameters[stp_name],)
+
+    def build(stats):
+        return ALL_STEPS[stp_name](stats, *params)
+
+    # recipes are reused from the in-process cache whenever possible (see mammothCache)
+    if mammothCache.recipe_cache is None:
+        return build(stats)
+
+    return mammothCache.recipe_cache.get(stp_name, stats, params, build)
+
+def optimize_kernel(basis, gain, actions, x_0=None):
+    """
+    Finds the linear combination of the nullspace basis vectors that maximizes epa while keeping all entries
+    of the resulting cycle non-negative; see Grind.solve for the details.
+
+    :param basis: (steps x grind_dim) array whose columns are an orthonormal basis for the resource matrix's nullspace
+    :param gain: total echo gain of each step
+    :param actions: action cost of each step
+    :param x_0: starting guess for the coefficients; defaults to the one closest to the all-ones cycle
+    :return: the scipy.optimize.OptimizeResult, whose x entry holds the coefficients of the linear combination
+    """
+    X = np.matmul(gain, basis)
+    Y = np.matmul(actions, basis)
+
+    def calc_invepa(v):
+
+        return np.matmul(Y, v)/np.matmul(X, v)
+
+    # the objective doesn't depend on the scale of the cycle, but the optimizer's tolerances do:
+    # a starting guess given by the caller is rescaled to the same norm as the default one
+    default = basis.sum(0)
+    if x_0 is None or not np.any(x_0):
+        x_0 = default
+    else:
+        x_0 = x_0*np.linalg.norm(default)/np.linalg.norm(x_0)
+    reality_constr = scipy.optimize.LinearConstraint(basis, 0, +np.inf)
+
+    return scipy.optimize.minimize(calc_invepa, x_0, method='SLSQP', constraints=reality_constr)
+
+def svd_update(l, v, r, a, b, atol=5e-16):
+    """
+    Rank-one update of a thin singular value decomposition (Brand, 2006): given l*diag(v)*r = M, returns the thin
+    decomposition of M + a*b^T, dropping the singular values that are zero up to rounding errors (or below atol).
+
+    :param l: (rows x rank) left singular vectors
+    :param v: (rank) singular values
+    :param r: (rank x columns) right singular vectors
+    :param a: (rows) left update vector
+    :param b: (columns) right update vector
+    """
+    # split a and b in their components inside and outside the current left and right singular subspaces
+    # (projecting twice keeps them orthogonal to working precision)
+    m = np.matmul(l.transpose(), a)
+    p = a - np.matmul(l, m)
+    p -= np.matmul(l, np.matmul(l.transpose(), p))
+    ra = np.linalg.norm(p)
+    n = np.matmul(r, b)
+    q = b - np.matmul(r.transpose(), n)
+    q -= np.matmul(r.transpose(), np.matmul(r, q))
+    rb = np.linalg.norm(q)
+
+    p = p/ra if ra > atol else np.zeros_like(p)
+    q = q/rb if rb > atol else np.zeros_like(q)
+
+    # the update only mixes the old singular vectors with p and q, through a small (rank+1)x(rank+1) matrix
+    k = np.zeros((len(v) + 1, len(v) + 1))
+    k[:len(v), :len(v)] = np.diag(v)
+    k += np.outer(np.append(m, ra), np.append(n, rb))
+    lk, vk, rk = np.linalg.svd(k)
+
+    # the singular values that should vanish are only zero up to rounding errors, which scale with the largest one
+    keep = vk > max(atol, vk.max(initial=0)*max(len(a), len(b))*np.finfo(float).eps)
+    l = np.matmul(np.hstack([l, p[:, np.newaxis]]), lk[:, keep])
+    r = np.matmul(rk[keep], np.vstack([r, q[np.newaxis]]))
+
+    return l, vk[keep], r
+
+def lp_cycle(matrix, gain, a_ub=None, b_ub=None):
+    """
+    Solves the Charnes-Cooper linear program of a resource matrix; see Grind.solve_lp for the details.
+
+    :param matrix: resource matrix (resources-rows, steps-columns), with Actions/Echoes/Scrip as its first three rows;
+        either a dense array or a scipy.sparse array
+    :param gain: total echo gain of each step
+    :param a_ub: optional (constraints x steps) array of further limits a_ub * y <= b_ub on the cycle y scaled to
+        one action, i.e. on per-action quantities
+    :param b_ub: right-hand side of those limits
+    :return: the scipy.optimize.OptimizeResult of linprog; its x entry is the optimal cycle scaled to one action,
+        so that -result.fun is the optimal epa
+    """
+    if scipy.sparse.issparse(matrix):
+        a_eq = scipy.sparse.vstack([matrix[3:], matrix[[0]]], format='csr')
+    else:
+        a_eq = np.vstack([matrix[3:], matrix[0]])
+    b_eq = np.zeros(a_eq.shape[0])
+    b_eq[-1] = 1
+
+    return scipy.optimize.linprog(-gain, A_ub=a_ub, b_ub=b_ub, A_eq=a_eq, b_eq=b_eq, bounds=(0, None), method='highs')
+
+def milp_cycle(matrix, objective, integrality, tol, max_actions=np.inf, a_ub=None, b_ub=None, time_limit=None):
+    """
+    Solves the mixed-integer program of the cycles of a resource matrix that take whole numbers of runs of (some of)
+    the steps: maximize objective * x subject to 0 <= resources * x <= tol * |resources| * x (the surplus of every
+    resource at most tol of the amount of it made and used by those steps), 1 <= actions * x <= max_actions and x >= 0;
+    see Grind.integer_cycle.
+
+    :param matrix: resource matrix (resources-rows, steps-columns), with Actions/Echoes/Scrip as its first three rows;
+        either a dense array or a scipy.sparse array
+    :param objective: value of each run of every step
+    :param integrality: array holding 1 for the steps only run a whole number of times, 0 for the others
+    :param tol: largest relative surplus of every resource, or None
+    :param max_actions: cap on the actions of the cycle
+    :param a_ub: optional (constraints x steps) array of further limits a_ub * x <= b_ub
+    :param b_ub: right-hand side of those limits
+    :return: the scipy.optimize.OptimizeResult of milp; its x entry is None if no cycle was found
+    """
+    matrix = scipy.sparse.csr_array(matrix)
+    resources = matrix[3:]
+    constraints = [scipy.optimize.LinearConstraint(resources, 0, np.inf),
+                   scipy.optimize.LinearConstraint(matrix[[0]], 1, max_actions)]
+    if tol is not None:
+        flows = abs(resources).multiply(integrality)
+        constraints.append(scipy.optimize.LinearConstraint(resources - tol*flows, -np.inf, 0))
+    if a_ub is not None:
+        constraints.append(scipy.optimize.LinearConstraint(a_ub, -np.inf, b_ub))
+    options = {} if time_limit is None else {'time_limit': time_limit}
+
+    return scipy.optimize.milp(-np.asarray(objective), constraints=constraints, integrality=integrality,
+                               bounds=scipy.optimize.Bounds(0, np.inf), options=options)
+
+# SOLVERS: dictionary containing all the backends Grind.solve can use, indexed by name;
+# each one takes the Grind instance and must set its solution and grind_dim attributes
+
+SOLVERS = {'lp': Grind.solve_lp, 'svd': Grind.solve_svd}
+
+# RANCHING_STEPS: the steps every ranching grind is built on, to which ranching() adds its arguments
+
+RANCHING_STEPS = ['Get Mammoth', 'Get 7Necks', 'Generator Skeleton', 'Sell to Entrepreneur',
+                  'Sell to Palaeontologist', 'Sell to Zailor', 'Sell to Naive', 'Medium Larceny',
+                  'Painting', 'Upconvert MoDS']
+
+def ranching(*args, stats, overflow_list=[], blacklist=None, add_parameters={'NO':0}, solver='lp'):
 
-    default = ['Get Mammoth', 'Get 7Necks', 'Generator Skeleton', 'Sell to Entrepreneur',
-               'Sell to Palaeontologist', 'Sell to Zailor', 'Sell to Naive', 'Medium Larceny',
-               'Painting', 'Upconvert MoDS']
+    default = list(RANCHING_STEPS)
 
     for lists in args:
         default = [*default, *lists]
 
-    return Grind(stats, default, overflow_list, blacklist, add_parameters)
+    return Grind(stats, default, overflow_list, blacklist, add_parameters, solver)
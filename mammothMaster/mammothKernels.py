@@ -0,0 +1,587 @@
+import ast
+import builtins
+import numpy as np
+from . import mammothRecipe
+from .mammothRecipe import ALL_STEPS, REFR, LENGTH, broad, narrow, woods_table, woods_index
+from .mammothBuild import binomial, retries
+
+# Declarative recipes:
+# the recipes of ALL_STEPS written down as data rather than code, so that they can be compiled into kernels working
+# out the resource arrays of a step for many stat profiles at once. Every entry of RECIPE_SPECS describes one step:
+#  - name, resources, overflow: as passed to the recipe class (the resource changes that don't depend on the stats);
+#  - params: (name, default) pairs of the additional parameters the step accepts, in order;
+#  - available: condition under which the step exists at all (the recipe functions return 0 otherwise);
+#  - checks: {variable: (mode, difficulty, score)} success chances of the checks involved;
+#  - effects: everything else, in the same order as the recipe functions do it, as a list of
+#      ('let', variable, value)                                    defines a variable (or several, 'a, b')
+#      ('check', variable, mode, difficulty, score)                defines the success chance of a check
+#      (resource, amount)                                          adds to a resource
+#      ('action', difficulty, score, mode)                         as recipe.action_penalty
+#      ('menace', difficulty, score, menace, mode)                 as recipe.menace_penalty
+#      ('sell', multiplier, score, menace, implausibility, chance) as recipe.sell_penalty
+#      ('if', condition, effects, otherwise)                       runs either list of effects
+# Any value may be a number, a list or a string holding a numpy expression, which may refer to the stats by name,
+# to the variables, to the parameters and to the module-level toggles of mammothRecipe. Every stat and variable is a
+# column with one row per stat profile, so outcome distributions run along the last axis: binom(k, n, p) gives the
+# binomial chances of k successes for every profile, retries(p) the chances of 0, 1, 2... failures of a check retried
+# until it succeeds (see mammothBuild), dot(a, b) and total(a) sum them up and cat(...) lines up chances of different
+# outcomes side by side (as the implausibility arrays of the sell penalties expect).
+# compile_recipe turns a spec into a RecipeKernel, kernel(stp_name) gives the (cached) one of a step and
+# verify_kernels checks them against the recipe functions.
+
+TOGGLES = ('social_heals', 'scrimshander_knife', 'use_HRelic_on_HellM', 'debonair_palaeontologist')
+
+RECIPE_SPECS = {
+
+    'Get Mammoth': {
+        'name': 'Get Ribcage', 'params': [('strat', 'best')],
+        'resources': {'Actions': 6, 'MRibcage': 1, 'HRelics': 2, 'VCResearch': -8},
+        'effects': [('let', 'apoc', 'aPoC'),
+                    ('check', 'wander_succ', 'narrow', 6, 'apoc'),
+                    ('let', 'strategy', "where(apoc < 9, 'hasty', 'patient') if strat == 'best' else strat"),
+                    ('let', 'wander, dark',
+                     "woods('Mammoth', strategy, apoc, 6/(1 + wander_succ), 1 - wander_succ**8)"),
+                    ('TBScraps', '-5*dark'), ('Moonlit', 'wander + dark'), ('Actions', 'wander + dark')]},
+
+    'Get 7Necks': {
+        'name': 'Get Ribcage', 'params': [('strat', 'best')],
+        'resources': {'Actions': 7, 'Sw7Necks': 1, 'VCResearch': -8},
+        'effects': [('let', 'apoc', 'aPoC'),
+                    ('let', 'strategy', "where(apoc < 3, 'hasty', 'patient') if strat == 'best' else strat"),
+                    ('let', 'wander, dark', "woods('7Necks', strategy, apoc, 0)"),
+                    ('TBScraps', '-5*dark'), ('Moonlit', 'wander + dark'), ('Actions', 'wander + dark')]},
+
+    'Holy Mammoth': {
+        'name': 'Holy Mammoth', 'params': [('scrimshander_knife', 1)], 'available': 'scrimshander_knife != 0',
+        'resources': {'Actions': 10, 'HRelics': -4, 'MRibcage': -1, 'BFragments': -500, 'Peppercaps': -10,
+                      'Echoes': 137.5, 'URRumours': 22},
+        'overflow': ['URRumours'],
+        'checks': {'legs': ('narrow', 5, 'Mith'), 'carve': ('narrow', 6, 'Mith')},
+        'effects': [('action', 6, 'Mith', 'narrow'),
+                    ('URRumours', '-4*(1 - legs)'),
+                    ('menace', 6, 'AotRS', 2, 'narrow'),
+                    ('let', 'fails', 'binom(arange(5), 4, 1 - legs)'),
+                    ('sell', 50, 'Shadowy', 2, [0, 2, 4, 6, 8], 'fails*carve'),
+                    ('sell', 50, 'Shadowy', 2, [2, 4, 6, 8, 10], 'fails*(1 - carve)')]},
+
+    'Ungodly Mammoth': {
+        'name': 'Ungodly Mammoth',
+        'resources': {'Actions': 9, 'HRelics': -3, 'MRibcage': -1, 'BFragments': -500, 'Peppercaps': -10,
+                      'WTentacles': -2, 'Echoes': 130, 'URRumours': 17},
+        'overflow': ['URRumours'],
+        'checks': {'legs': ('narrow', 5, 'Mith'), 'tent': ('narrow', 1, 'MAnatomy'), 'tail': ('narrow', 5, 'MAnatomy')},
+        'effects': [('URRumours', '-3*(1 - legs)'),
+                    ('Echoes', '-2*(1 - tent)'),
+                    ('menace', 6, 'AotRS', 2, 'narrow'),
+                    ('let', 'fails', 'binom(arange(5), 4, 1 - legs)'),
+                    ('sell', 50, 'Shadowy', 2, [0, 2, 4, 6, 8], 'fails*tail*tent'),
+                    ('sell', 50, 'Shadowy', 2, [2, 4, 6, 8, 10], 'fails*(1 - tail)*tent'),
+                    ('sell', 50, 'Shadowy', 2, [1, 3, 5, 7, 9], 'fails*tail*(1 - tent)'),
+                    ('sell', 50, 'Shadowy', 2, [3, 5, 7, 9, 11], 'fails*(1 - tail)*(1 - tent)')]},
+
+    'Mammoth from Hell': {
+        'name': 'Mammoth from Hell', 'params': [('scrimshander_knife', 1)],
+        'resources': {'Actions': 9, 'MRibcage': -1, 'HSkull': -1, 'Scrip': 125 + 25 + 5*4},
+        'checks': {'limb': ('narrow', 11, 'MAnatomy'), 'skull': ('narrow', 6, 'MAnatomy'),
+                   'tail': ('narrow', 5, 'MAnatomy'), 'carve': ('narrow', 6, 'Mith'),
+                   'chimera': ('narrow', 11, 'Mith')},
+        'effects': [('let', 'needtail', 'skull*(3 + scrimshander_knife)*(1 - limb)*limb**3'),
+                    ('let', 'needcarve', 'skull*scrimshander_knife*limb**4'),
+                    ('let', 'needlimb', 'skull*(1 - scrimshander_knife)*limb**3'),
+                    ('let', 'chance', 'skull*binom(arange(3), 4, limb) + cat(0, 0, needtail + needcarve)'),
+                    ('Scrip', '10*dot(chance, arange(7, 10))'),
+                    ('Scrip', 'needlimb*(25*use_HRelic_on_HellM - 5 + 90)'),
+                    ('Scrip', '5*needtail'),
+                    ('WTentacles', '-needtail'),
+                    ('HRelics', '-needlimb*use_HRelic_on_HellM'),
+                    ('let', 'chance', '(1 - skull)*binom(arange(5), 4, limb)'),
+                    ('Scrip', '5*dot(chance, arange(7, 12))'),
+                    ('let', 'added', '1 - needtail*(1 - tail) - needcarve*(1 - carve)'),
+                    ('sell', 75, 'Shadowy', 5, [3, 6, 5, 8],
+                     'cat(chimera*added, (1 - chimera)*added, chimera*(1 - added), (1 - chimera)*(1 - added))')]},
+
+    'Generator Skeleton': {
+        'name': 'Generator Skeleton',
+        'resources': {'Actions': 19, 'Sw7Necks': -1, 'GenSkeleton': 1, 'Scrip': -975},
+        'checks': {'buy': ('broad', 200, 'Persuasive')},
+        'effects': [('Scrip', '5*buy')]},
+
+    'Sell to Entrepreneur': {
+        'name': 'Sell to Entrepreneuer',
+        'resources': {'GenSkeleton': -1, 'Scrip': 4, 'MoDS': 1115},
+        'checks': {'chimera': ('narrow', 11, 'Mith')},
+        'effects': [('sell', 75, 'Shadowy', 2, [3, 6], 'cat(chimera, 1 - chimera)')]},
+
+    'Sell to Palaeontologist': {
+        'name': 'Sell to Palaeontologist',
+        'resources': {'GenSkeleton': -1, 'Echoes': 5, 'BFragments': 55505},
+        'checks': {'chimera': ('narrow', 11, 'Mith')},
+        'effects': [('sell', 40, 'Shadowy', 2, [3, 6], 'cat(chimera, 1 - chimera)')]},
+
+    'Sell to Zailor': {
+        'name': 'Sell to Zailor',
+        'resources': {'GenSkeleton': -1, 'Scintillack': 18, 'WAmber': 5575},
+        'overflow': ['Scintillack'],
+        'checks': {'limb': ('narrow', 11, 'MAnatomy'), 'chimera': ('narrow', 11, 'Mith')},
+        'effects': [('Scintillack', '2*limb*(1 - limb) + 4*limb**2'),
+                    ('sell', 75, 'Shadowy', 2, [3, 6], 'cat(chimera, 1 - chimera)')]},
+
+    'Sell to Naive': {
+        'name': 'Sell to Naive',
+        'resources': {'GenSkeleton': -1, 'TBScraps': 222},
+        'checks': {'chimera': ('narrow', 11, 'Mith')},
+        'effects': [('sell', 25, 'Shadowy', 3.5, [3, 6], 'cat(chimera, 1 - chimera)')]},
+
+    'Basic Helicon Round': {
+        'name': 'Basic Helicon Round', 'params': [('companion', None)],
+        'resources': {'Actions': 6, 'Peppercaps': 25, 'Echoes': 0.5, 'Scrip': 3, 'CasingCP': 15},
+        'effects': [('if', "companion == 'casing'", [('CasingCP', 3)], [])]},
+
+    'Tentacle Helicon Round 1': {
+        'name': 'Tentacle Helicon Round 1', 'params': [('companion', None)],
+        'resources': {'Actions': 6, 'Peppercaps': 25, 'Echoes': 0.5, 'Scrip': 2},
+        'checks': {'draw': ('narrow', 4, 'SArts')},
+        'effects': [('Scrip', '3*draw'), ('WTentacles', '3*3*draw'), ('WAmber', '-3*5*draw'),
+                    ('if', 'companion is not None', [('CasingCP', 3)], [])]},
+
+    'Tentacle Helicon Round 2': {
+        'name': 'Tentacle Helicon Round 2', 'params': [('companion', None)],
+        'resources': {'Actions': 6, 'CasingCP': 6, 'Peppercaps': 25, 'Echoes': 0.5, 'Scrip': 2},
+        'checks': {'draw': ('narrow', 4, 'SArts')},
+        'effects': [('Scrip', '2*draw'), ('WTentacles', '2*3*draw'), ('WAmber', '-2*5*draw'),
+                    ('if', 'companion is not None', [('CasingCP', 3)], [])]},
+
+    'Medium Larceny': {
+        'name': 'Medium Claywayman Larceny',
+        'resources': {'Actions': 1, 'Echoes': 27.5, 'CasingCP': -36}},
+
+    'Painting': {
+        'name': 'Painting at Balmoral',
+        'resources': {'Actions': 11, 'Moonlit': -12, 'Echoes': 85},
+        'checks': {'paint': ('narrow', 200, 'Persuasive')},
+        'effects': [('Echoes', '20*total(binom(arange(3, 7), 6, paint))')]},
+
+    'Duplicate Ox Skull': {
+        'name': 'Duplicate Ox Skull',
+        'resources': {'Actions': 1, 'BFragments': -1000, 'WAmber': -5, 'HSkull': 1}},
+
+    'Upconvert MoDS': {
+        'name': 'Upconvert Memories',
+        'resources': {'Actions': 18, 'Echoes': -3, 'MoDS': -750, 'VCResearch': 150},
+        'effects': [('Echoes', '15*(5.7e-1 + 25*3e-2)')]},
+
+    'Duplicate Seal Skull': {
+        'name': 'Duplicate Seal Skull',
+        'resources': {'Actions': 1, 'BFragments': -1750, 'WAmber': -25, 'IBiscuits': -1, 'PSkull': 1}},
+
+    'Dig at SVIII': {
+        'name': 'Dig near Station VIII',
+        'resources': {'Actions': 3, 'Echoes': -3.5, 'BSurveys': -150, 'PDiscovery': 6, 'BFragments': 27}},
+
+    'Discover Mammoth': {
+        'name': 'Get a Mammoth Ribcage',
+        'resources': {'MRibcage': 1, 'PDiscovery': -5}},
+
+    'Discover HSkull': {
+        'name': 'Get a Horned Skull',
+        'resources': {'HSkull': 1, 'PDiscovery': -1}},
+
+    'Discover JThigh': {
+        'name': 'Get a Femur of a Jurassic Beast',
+        'resources': {'JThigh': 5, 'PDiscovery': -1}},
+
+    'Bone Newspaper': {
+        'name': 'Exposé on Palaeontology', 'params': [('PLrate', 0), ('debonair_palaeontologist', False)],
+        'resources': {'Actions': 22.5, 'BSurveys': 72, 'HRelics': 2, 'WTentacles': 4.5, 'JBStinger': 1.5,
+                      'PTBones': 1, 'Scrip': 2, 'Echoes': 5},
+        'effects': [('Actions', 'debonair_palaeontologist + PLrate'),
+                    ('BSurveys', '13*(debonair_palaeontologist + PLrate)'),
+                    ('Echoes', '2*debonair_palaeontologist')]},
+
+    'Easy Mammoth': {
+        'name': 'Easy Mammoth',
+        'resources': {'Actions': 9, 'MRibcage': -1, 'HSkull': -1, 'Scrip': 125 + 25 + 5*4},
+        'checks': {'skull': ('narrow', 6, 'MAnatomy'), 'tail': ('narrow', 5, 'MAnatomy'),
+                   'carve': ('narrow', 6, 'Mith'), 'chimera': ('narrow', 11, 'Mith'),
+                   'limb': ('narrow', 11, 'MAnatomy')},
+        'effects': [('let', 'chimera_prob', 'cat(chimera, 1 - chimera)'),
+                    # if the skull fails: Jurassic stinger and forelimbs
+                    ('let', 'chance', '(1 - skull)*limb'),
+                    ('Scrip', 'chance*(1 + 6 + 4 - 15)'),
+                    ('let', 'chance', 'chance*(1 - limb)'),
+                    ('Scrip', 'chance*(1 + 4 - 10)'),
+                    ('let', 'chance', '(1 - skull)*(1 - limb)**2'),
+                    ('Scrip', 'chance*(1 - 10 + 6 + 2)'),
+                    ('JThigh', '-chance'),
+                    ('Scrip', '(1 - skull)*90'),
+                    ('sell', 75, 'Shadowy', 5, [3, 6], '(1 - skull)*chimera_prob'),
+                    # if the skull succeeds
+                    ('if', 'scrimshander_knife == 0',
+                     [('let', 'chance', 'skull*limb**3'),
+                      ('Scrip', 'chance*(25*use_HRelic_on_HellM - 5 + 90)'),
+                      ('HRelics', '-chance*use_HRelic_on_HellM'),
+                      ('if', 'use_HRelic_on_HellM == 0',
+                       [('sell', 75, 'Shadowy', 5, [3, 6], 'chance*chimera_prob')],
+                       [('check', 'relic', 'narrow', 5, 'Mith'),
+                        ('sell', 75, 'Shadowy', 5, [3, 6, 5, 8],
+                         'cat(chimera_prob*chance*relic, chimera_prob*chance*(1 - relic))')])],
+                     [('let', 'chance', 'skull*limb**4'),
+                      ('Scrip', 'chance*90'),
+                      ('action', 6, 'Mith', 'narrow'),
+                      ('sell', 75, 'Shadowy', 5, [3, 6, 5, 8],
+                       'cat(chimera_prob*chance*carve, chimera_prob*chance*(1 - carve))')]),
+                    ('let', 'chance', '(3 if scrimshander_knife == 0 else 4)*skull*(1 - limb)*limb**3'),
+                    ('Scrip', 'chance*(90 + 5)'),
+                    ('WTentacles', '-chance'),
+                    ('sell', 75, 'Shadowy', 5, [3, 6, 5, 8],
+                     'cat(chimera_prob*chance*tail, chimera_prob*chance*(1 - tail))'),
+                    ('let', 'chance', 'skull*binom(arange(3), 4, limb)'),
+                    ('Scrip', '10*dot(chance, arange(7, 10))'),
+                    ('sell', 75, 'Shadowy', 5, [3, 6], 'total(chance)*chimera_prob')]},
+
+    'Discover BFragments': {
+        'name': 'Get Bone Fragments',
+        'resources': {'BFragments': 1250, 'PDiscovery': -1}},
+
+    'Steal Antique Mystery': {
+        'name': 'Steal Antique Mystery',
+        'resources': {'Actions': 1, 'AMystery': 1, 'CasingCP': -51},
+        'checks': {'theft': ('broad', 120, 'Shadowy')},
+        'effects': [('CasingCP', '19*theft')]},
+
+    'Sell HRelic for BFragments': {
+        'name': 'Sell HRelic for BFragments',
+        'resources': {'Actions': 1, 'HRelics': -1, 'BFragments': 1250}},
+
+    'Sell HRelic for IBiscuits': {
+        'name': 'Sell HRelic for IBiscuits',
+        'resources': {'Actions': 1, 'HRelics': -1, 'IBiscuits': 6}},
+
+    'Mammoth of the Zee': {
+        'name': 'Mammoth of the Zee',
+        'resources': {'Actions': 9, 'MRibcage': -1, 'PSkull': -1, 'Scrip': 125 + 50 + 5*4},
+        'checks': {'skull': ('narrow', 4, 'MAnatomy'), 'tail': ('narrow', 5, 'MAnatomy'),
+                   'chimera': ('narrow', 11, 'Mith'), 'limb': ('narrow', 11, 'MAnatomy')},
+        'effects': [('let', 'needtail', 'skull*limb**4'),
+                    ('let', 'chance', 'skull*binom(arange(4), 4, limb) + cat(0, 0, 0, needtail)'),
+                    ('Scrip', '10*dot(arange(6, 10), chance) + 5*needtail'),
+                    ('let', 'chance', '(1 - skull)*binom(arange(5), 4, limb)'),
+                    ('Scrip', '5*dot(arange(6, 11), chance)'),
+                    ('let', 'chimera_prob', 'cat(chimera, 1 - chimera)'),
+                    ('sell', 75, 'Shadowy', 5, [3, 6, 5, 8],
+                     'cat(chimera_prob*needtail*tail, chimera_prob*needtail*(1 - tail))')]},
+
+    'Research Larceny': {
+        'name': 'Research Claywayman Larceny',
+        'resources': {'Actions': 1, 'VCResearch': 3, 'CasingCP': -21}},
+
+    'One-winged Mammoth': {
+        'name': 'One-winged Mammoth',
+        'resources': {'Actions': 10.5, 'MRibcage': -1, 'Scrip': 125 + 5*4, 'BFragments': -50, 'WAmber': -12.5},
+        'checks': {'limb': ('narrow', 11, 'MAnatomy'), 'skull': ('narrow', 6, 'MAnatomy'),
+                   'tail': ('narrow', 5, 'MAnatomy'), 'chimera': ('narrow', 11, 'Mith'),
+                   'buy': ('broad', 200, 'Persuasive')},
+        'effects': [('Scrip', '5*buy'),
+                    # skull attached: one wing, three forelimbs and a tentacle tail if needed
+                    ('let', 'needtail', 'skull*limb**3'),
+                    ('let', 'chance', 'skull*binom(arange(3), 3, limb) + cat(0, 0, needtail)'),
+                    ('Scrip', '10*dot(arange(7, 10), chance) + 5*needtail'),
+                    # skull failed: two wings, two forelimbs
+                    ('Actions', '(1 - skull)*0.5'),
+                    ('WAmber', '-(1 - skull)*12.5'),
+                    ('BFragments', '-(1 - skull)*50'),
+                    ('Scrip', '(1 - skull)*(70 + 20*limb)'),
+                    ('let', 'chimera_prob', 'cat(chimera, 1 - chimera)'),
+                    ('sell', 75, 'Shadowy', 5, [3, 6, 5, 8],
+                     'cat(chimera_prob*needtail*tail, chimera_prob*needtail*(1 - tail))')]},
+
+    'Sell to Theologian': {
+        'name': 'Sell to Theologian',
+        'resources': {'GenSkeleton': -1, 'IBiscuits': 226, 'Actions': 1, 'Echoes': -0.5},
+        'checks': {'disguise': ('narrow', 6, 'Katatox'), 'chimera': ('narrow', 11, 'Mith')},
+        'effects': [('Actions', '1/disguise - 1'),
+                    ('Echoes', '-0.5*(1/disguise - 1)'),
+                    # disguised after 0, 1, 2... failed attempts, 2 more implausible every time
+                    ('let', 'tries', 'retries(disguise[:, 0])'),
+                    ('let', 'added', '2*arange(tries.shape[-1])'),
+                    ('sell', 25, 'Shadowy', 3.5, 'cat(3 + added, 6 + added)', 'cat(chimera*tries, (1 - chimera)*tries)')]},
+}
+
+
+## helpers available to the expressions
+
+def _dot(a, b):
+
+    return (np.asarray(a)*np.asarray(b)).sum(-1, keepdims=True)
+
+def _total(a):
+
+    return np.asarray(a).sum(-1, keepdims=True)
+
+def _cat(*arrays):
+    # lines up the outcomes along the last axis, broadcasting the profiles
+
+    arrays = [np.asarray(a, dtype=float) for a in arrays]
+    arrays = [a if a.ndim > 1 else a.reshape(1, -1) for a in arrays]
+    rows = np.broadcast_shapes(*[a.shape[:-1] for a in arrays])
+    return np.concatenate([np.broadcast_to(a, rows + a.shape[-1:]) for a in arrays], -1)
+
+def _woods(name, strategy, apoc, hasty_wander, patient_dark=None):
+    # (wander, dark) of a Balmoral search for every profile, as read by GetMammoth and Get7Necks: from the tables when
+    # there are any, otherwise hasty_wander wanders and a certain darkening (hasty) or patient_dark (patient)
+
+    apoc = np.asarray(apoc)
+    strategy = np.asarray(strategy)
+    wander = np.zeros(apoc.shape)
+    dark = np.zeros(apoc.shape)
+    for strat in ('hasty', 'patient'):
+
+        which = np.broadcast_to(strategy == strat, apoc.shape)
+        if not which.any():
+            continue
+        tables = woods_table(name, strat)
+        if tables is not None:
+            # (only the profiles following this strategy have to be in the range of its tables)
+            index = woods_index(tables[2], np.where(which, apoc, tables[2][-1]))
+            w = np.asarray(tables[0])[index]
+            d = np.asarray(tables[1])[index] if tables[1] is not None else patient_dark
+        else:
+            w, d = hasty_wander, 1
+        wander = np.where(which, w, wander)
+        dark = np.where(which, d, dark)
+
+    return wander, dark
+
+GLOBALS = {'np': np, 'arange': np.arange, 'array': np.array, 'where': np.where, 'minimum': np.minimum,
+           'maximum': np.maximum, 'binom': binomial, 'dot': _dot, 'total': _total, 'cat': _cat, 'woods': _woods,
+           'retries': retries, 'narrow': narrow, 'broad': broad}
+
+
+class RecipeKernel:
+
+    def __init__(self, stp_name, spec):
+        """
+
+        :param stp_name: name of the step, as stored in the ALL_STEPS dictionary
+        :param spec: the step's entry of RECIPE_SPECS
+        """
+        self.stp_name = stp_name
+        self.name = spec['name']
+        self.params = list(spec.get('params', []))
+        self.overflow = list(spec.get('overflow', []))
+        self.fixed = np.zeros(LENGTH)
+        for key, value in spec.get('resources', {}).items():
+            self.fixed[REFR[key]] += value
+
+        self.names = set()      # names read by the expressions
+        self.defined = set(TOGGLES) | {name for name, default in self.params}
+        self.available = self.expression(spec.get('available', True))
+        checks = [('check', name, *check) for name, check in spec.get('checks', {}).items()]
+        self.effects = self.compile(checks + list(spec.get('effects', [])))
+
+        # the stats read are whatever the expressions refer to that isn't defined anywhere else
+        self.reads = sorted(self.names - self.defined - set(GLOBALS) - set(dir(builtins)))
+
+    def expression(self, value, mode='eval'):
+        # compiles a value of the spec into a function of the namespace
+
+        if not isinstance(value, str):
+            constant = np.asarray(value) if isinstance(value, list) else value
+            return lambda namespace: constant
+
+        tree = ast.parse(value, mode=mode)
+        self.names |= {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+        code = compile(tree, '<%s>' % self.stp_name, mode)
+        if mode == 'exec':
+            return lambda namespace: exec(code, GLOBALS, namespace)
+        return lambda namespace: eval(code, GLOBALS, namespace)
+
+    def compile(self, effects):
+        # turns a list of effects into a list of functions taking (namespace, resources)
+
+        compiled = []
+        for effect in effects:
+
+            kind = effect[0]
+            if kind == 'let':
+                target = effect[1]
+                self.defined |= {name.strip() for name in target.split(',')}
+                assign = self.expression('%s = (%s)' % (target, effect[2]), 'exec')
+                compiled.append(lambda ns, out, assign=assign: assign(ns))
+
+            elif kind == 'check':
+                name, mode = effect[1], effect[2]
+                self.defined.add(name)
+                difficulty, score = self.expression(effect[3]), self.expression(effect[4])
+                compiled.append(lambda ns, out, name=name, mode=mode, difficulty=difficulty, score=score:
+                                _check(ns, name, mode, difficulty(ns), score(ns)))
+
+            elif kind == 'action':
+                difficulty, score, mode = self.expression(effect[1]), self.expression(effect[2]), effect[3]
+                compiled.append(lambda ns, out, difficulty=difficulty, score=score, mode=mode:
+                                _action_penalty(out, difficulty(ns), score(ns), 0, mode))
+
+            elif kind == 'menace':
+                difficulty, score, menace, mode = [self.expression(value) for value in effect[1:4]] + [effect[4]]
+                compiled.append(lambda ns, out, difficulty=difficulty, score=score, menace=menace, mode=mode:
+                                _action_penalty(out, difficulty(ns), score(ns), menace(ns), mode))
+
+            elif kind == 'sell':
+                multiplier, score, menace, implausibility, chance = [self.expression(value) for value in effect[1:]]
+                compiled.append(lambda ns, out, values=(multiplier, score, menace, implausibility, chance):
+                                _sell_penalty(out, *[value(ns) for value in values]))
+
+            elif kind == 'if':
+                condition = self.expression(effect[1])
+                then, otherwise = self.compile(effect[2]), self.compile(effect[3])
+                compiled.append(lambda ns, out, condition=condition, then=then, otherwise=otherwise:
+                                _run(then if condition(ns) else otherwise, ns, out))
+
+            else:
+                index, amount = REFR[kind], self.expression(effect[1])
+                compiled.append(lambda ns, out, index=index, amount=amount: _add(out, index, amount(ns)))
+
+        return compiled
+
+    def namespace(self, params):
+
+        # the parameters shadow the toggles of the same name, just like in the recipe functions
+        if len(params) > len(self.params):
+            raise TypeError('%s takes at most %d additional parameters' % (self.stp_name, len(self.params)))
+        namespace = {name: getattr(mammothRecipe, name) for name in TOGGLES}
+        for i, (name, default) in enumerate(self.params):
+            namespace[name] = params[i] if i < len(params) else default
+        return namespace
+
+    def exists(self, *params):
+        """
+        :return: whether the step is available with these parameters and the current toggles
+        """
+        return bool(self.available(self.namespace(params)))
+
+    def __call__(self, stats, *params):
+        """
+        Works out the resource arrays of the step for many stat profiles at once.
+
+        :param stats: dictionary of the player stats, where every score may be either a number or an array of
+            numbers; the stats the step reads are broadcast together and every element is a separate profile
+        :param params: additional parameters of the step, as passed to the recipe function
+        :return: (*profiles, LENGTH) array of resource changes, or None if the step isn't available
+        """
+        namespace = self.namespace(params)
+        if not self.available(namespace):
+            return None
+
+        values = np.broadcast_arrays(*[np.asarray(stats[name]) for name in self.reads])
+        shape = values[0].shape if values else ()
+        n = int(np.prod(shape, dtype=int))
+        for name, value in zip(self.reads, values):
+            namespace[name] = value.reshape(n, 1)
+
+        out = np.repeat(self.fixed[np.newaxis], n, 0)
+        _run(self.effects, namespace, out)
+
+        return out.reshape(*shape, LENGTH)
+
+    def recipe(self, stats, *params):
+        """
+        Same as the recipe function of the step, for a single stat profile: returns a recipe instance (or 0).
+        Kernels only work out the resources, so the menace the recipe has to heal isn't recorded.
+        """
+        resources = self(stats, *params)
+        if resources is None:
+            return 0
+        instance = mammothRecipe.recipe(self.name, {}, list(self.overflow))
+        for i in np.flatnonzero(resources):
+            instance.resources[i] += resources[i]
+        return instance
+
+
+def _run(effects, namespace, out):
+
+    for effect in effects:
+        effect(namespace, out)
+
+def _column(value, out):
+    # a value of the expressions as one entry per profile
+
+    return np.broadcast_to(value, (len(out), 1))[:, 0]
+
+def _add(out, index, amount):
+
+    out[:, index] += _column(amount, out)
+
+def _check(namespace, name, mode, difficulty, score):
+
+    namespace[name] = mammothRecipe.checks[mode](difficulty, score)
+
+def _action_penalty(out, difficulty, score, menace, mode):
+    # failed checks cost actions, and healing the menace they give costs more
+
+    fail = 1/mammothRecipe.checks[mode](difficulty, score) - 1
+    out[:, 0] += _column(fail, out)
+    if menace:
+        out[:, 0] += _column(fail*menace/3/(1 + mammothRecipe.social_heals), out)
+
+def _sell_penalty(out, multiplier, score, menace, implausibility, chance):
+    # failed sales cost actions, and healing the menace they give costs more
+
+    p = broad(multiplier*np.asarray(implausibility), score)
+    penalty = chance*(1/p - 1)*(1 + menace/3/(1 + mammothRecipe.social_heals))
+    out[:, 0] += _column(_total(penalty), out)
+
+
+def compile_recipe(stp_name, spec=None):
+    """
+    Compiles the spec of a step (by default its entry of RECIPE_SPECS) into a RecipeKernel.
+    """
+    return RecipeKernel(stp_name, RECIPE_SPECS[stp_name] if spec is None else spec)
+
+
+KERNELS = {}    # compiled kernels, indexed by step name
+
+def kernel(stp_name):
+    """
+    :return: the RecipeKernel of a step, compiling it the first time it's needed; None if the step has no spec
+    """
+    if stp_name not in KERNELS:
+        if stp_name not in RECIPE_SPECS:
+            return None
+        KERNELS[stp_name] = compile_recipe(stp_name)
+
+    return KERNELS[stp_name]
+
+
+def verify_kernels(stats, steps=None, params={}):
+    """
+    Checks the kernels against the recipe functions of ALL_STEPS, under the current toggles.
+
+    :param stats: dictionary of the player stats as taken by the kernels (numbers or arrays, broadcast together)
+    :param steps: names of the steps to check, defaults to all the ones with a spec
+    :param params: additional parameters to pass to some of the steps, of the form {'step name': [parameters]}
+    :return: dictionary of the largest absolute difference between kernel and function, indexed by step name
+        (0 where both agree that the step isn't available, inf where only one of them does)
+    """
+    names = list(stats)
+    values = np.broadcast_arrays(*[np.asarray(stats[name]) for name in names])
+    profiles = [{name: value.flat[i] for name, value in zip(names, values)} for i in range(values[0].size)]
+
+    errors = {}
+    for stp_name in (RECIPE_SPECS if steps is None else steps):
+
+        extra = params.get(stp_name, [])
+        resources = kernel(stp_name)(dict(zip(names, values)), *extra)
+        if resources is not None:
+            # (steps reading none of the stats give a single array)
+            resources = np.broadcast_to(resources, values[0].shape + (LENGTH,)).reshape(-1, LENGTH)
+
+        error = 0.
+        for i, profile in enumerate(profiles):
+            instance = ALL_STEPS[stp_name](profile, *extra)
+            if not instance or resources is None:
+                error = max(error, 0. if not instance and resources is None else np.inf)
+                continue
+            error = max(error, np.abs(instance.dense() - resources[i]).max())
+        errors[stp_name] = error
+
+    return errors
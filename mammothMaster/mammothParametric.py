@@ -0,0 +1,198 @@
+import numpy as np
+from .mammothRecipe import EPS, PRICES
+from .mammothGrind import lp_cycle
+
+# Parametric prices:
+# EPS and the PRICES of the overflow steps only ever show up in the gain of the steps (the echoes they make plus EPS
+# times the scrip), never in the resources a cycle has to balance. So while one of them moves along a range the set
+# of feasible cycles (scaled to one action) stays the same and only the objective of the linear program turns: every
+# optimal cycle stays optimal over a whole interval of values, and the best epaTotal is a convex, piecewise linear
+# function of the parameter, with a breakpoint wherever the optimal cycle changes.
+# price_curve() finds all of them with as few solves as possible (Eisner-Severance): it solves the program at both
+# ends of the range, and if the two cycles differ it solves it once more where their epaTotal lines cross; either the
+# crossing is a breakpoint (no cycle does better there) or a new cycle shows up and both halves are searched again.
+# That's two solves per piece of the curve, however many price points it's then read at:
+#   curve = price_curve(grind, 'EPS', 0.3, 0.7)
+#   curve.print_curve()
+#   curve([0.4, 0.45, 0.5])['epaTotal']
+
+
+class PriceCurve:
+
+    def __init__(self, parameter, steps, breakpoints, solutions, lines, solves):
+        """
+
+        :param parameter: 'EPS' or the resource whose price (in PRICES) moves
+        :param steps: list of the steps of the grind
+        :param breakpoints: array of the ends of the pieces, from the start to the end of the range
+        :param solutions: (pieces x steps) array of the optimal cycle (scaled to one action) of every piece
+        :param lines: dictionary of (pieces x 2) arrays holding the intercept and slope of epaTotal, epa and spa
+            along every piece
+        :param solves: number of linear programs solved to find the curve
+        """
+        self.parameter = parameter
+        self.steps = steps
+        self.breakpoints = breakpoints
+        self.solutions = solutions
+        self.lines = lines
+        self.solves = solves
+
+    def __len__(self):
+
+        return len(self.solutions)
+
+    def piece(self, values):
+        """
+        :return: index of the piece every value falls in (the values at a breakpoint go to the piece on its right,
+            the ones out of the range to the first or last one, whose cycle stays optimal past the ends only as far
+            as anyone knows)
+        """
+        return np.clip(np.searchsorted(self.breakpoints, values, side='right') - 1, 0, len(self) - 1)
+
+    def __call__(self, values):
+        """
+        Reads the curve at any number of values of the parameter, without solving anything.
+
+        :return: dictionary of arrays shaped like values: epaTotal, epa, spa and the piece they fall in
+        """
+        values = np.asarray(values, dtype=float)
+        piece = self.piece(values)
+        result = {name: line[piece, 0] + values*line[piece, 1] for name, line in self.lines.items()}
+        result['piece'] = piece
+
+        return result
+
+    def ratios(self, value):
+        """
+        :return: dictionary of the number of times every step is taken per action at the given value
+        """
+        return dict(zip(self.steps, self.solutions[self.piece(value)]))
+
+    def changes(self, i):
+        """
+        :return: dictionary of the steps whose frequency changes at the i-th inner breakpoint, with their
+            frequency (per action) before and after it
+        """
+        before, after = self.solutions[i], self.solutions[i + 1]
+        changed = ~np.isclose(before, after, rtol=1e-6, atol=1e-12)
+
+        return {self.steps[j]: (before[j], after[j]) for j in np.flatnonzero(changed)}
+
+    def print_curve(self):
+
+        print('%s: %d pieces, %d solves' % (self.parameter, len(self), self.solves))
+        for i in range(len(self)):
+            a, b = self.breakpoints[i], self.breakpoints[i + 1]
+            intercept, slope = self.lines['epaTotal'][i]
+            print('  %.6f - %.6f: epaTotal %.6f - %.6f' % (a, b, intercept + a*slope, intercept + b*slope))
+            if i + 1 < len(self):
+                # only the steps joining or leaving the cycle, the others just change frequency
+                for step, (old, new) in self.changes(i).items():
+                    if (old > 1e-12) != (new > 1e-12):
+                        print('    %s %s' % ('+' if new > 1e-12 else '-', step))
+
+
+def parameter_lines(grind, parameter):
+    """
+    Splits the echoes and scrip rows of a grind into their part that doesn't depend on the parameter and the one
+    that does, so that at a value t of it echoes = e0 + t*de, scrip = s0 + t*ds and the hambitrage rate is
+    eps0 + t*deps (at most one of ds and deps is non-zero, so the gain stays linear in t).
+
+    :return: e0, de, s0, ds, eps0, deps
+    """
+    head = grind.matrix[:3].toarray() if grind.sparse else np.asarray(grind.matrix[:3])
+    e0, s0 = head[1].astype(float), head[2].astype(float)
+    de, ds = np.zeros(grind.dim1), np.zeros(grind.dim1)
+
+    if parameter == 'EPS':
+        return e0, de, s0, ds, 0., 1.
+
+    if parameter not in PRICES:
+        raise ValueError("parameter must be 'EPS' or one of the resources in PRICES, not %r" % (parameter,))
+
+    step = parameter + ' Overflow'
+    if step not in grind.step_ref:
+        print('warning: %s is not part of the grind, its price makes no difference' % step)
+        return e0, de, s0, ds, EPS, 0.
+
+    j = grind.step_ref[step]
+    if PRICES[parameter][0] == 'Echoes':
+        e0[j], de[j] = 0, 1
+    else:
+        s0[j], ds[j] = 0, 1
+
+    return e0, de, s0, ds, EPS, 0.
+
+
+def price_curve(grind, parameter, start, stop, tol=1e-9):
+    """
+    Finds the best epaTotal of a grind as a function of EPS or of one of the PRICES, along with the optimal cycle,
+    over a whole range of values; the other one stays at its current value. The grind itself isn't changed.
+
+    :param grind: Grind instance (of any backend: the curve always comes from the linear program)
+    :param parameter: 'EPS' or the name of a resource in PRICES
+    :param start: start of the range
+    :param stop: end of the range
+    :param tol: relative tolerance under which two epaTotal values are considered the same
+    :return: PriceCurve instance
+    """
+    if not start < stop:
+        raise ValueError('the range must have start < stop')
+
+    e0, de, s0, ds, eps0, deps = parameter_lines(grind, parameter)
+    g0 = e0 + eps0*s0
+    dg = de + eps0*ds + deps*s0
+    solves = 0
+
+    def solve(t):
+        nonlocal solves
+        solves += 1
+        result = lp_cycle(grind.matrix, g0 + t*dg)
+        if result.status != 0:
+            raise ValueError('grind not practicable (%s)' % result.message)
+        return result.x
+
+    def value(y, t):
+        return np.dot(g0, y) + t*np.dot(dg, y)
+
+    def same(a, b):
+        return abs(a - b) <= tol*max(1., abs(a), abs(b))
+
+    pieces = []     # (start, cycle) of every piece, from left to right
+    stack = [(start, solve(start), stop, solve(stop))]
+    while stack:
+
+        a, ya, b, yb = stack.pop()
+        if same(value(ya, a), value(yb, a)):
+            # the cycle of the right end is already optimal at the left one, and so (by convexity) all the way across
+            pieces.append((a, yb))
+            continue
+        if same(value(ya, b), value(yb, b)):
+            pieces.append((a, ya))
+            continue
+
+        # the two lines cross strictly inside the interval: either nothing beats them there, and that's where the
+        # optimal cycle changes, or a third cycle does, and both sides have to be looked at again
+        t = (np.dot(g0, yb) - np.dot(g0, ya))/(np.dot(dg, ya) - np.dot(dg, yb))
+        y = solve(t)
+        if same(value(y, t), value(ya, t)) or min(t - a, b - t) <= tol*(stop - start):
+            pieces.append((a, ya))
+            pieces.append((t, yb))
+        else:
+            # (the left half is searched first, so that the pieces come out in order)
+            stack.append((t, y, b, yb))
+            stack.append((a, ya, t, y))
+
+    # neighbouring pieces may have ended up with the same cycle
+    merged = [pieces[0]]
+    for t, y in pieces[1:]:
+        if not np.allclose(y, merged[-1][1], rtol=1e-6, atol=1e-12):
+            merged.append((t, y))
+
+    solutions = np.array([y for t, y in merged])
+    breakpoints = np.array([t for t, y in merged] + [stop])
+    lines = {'epaTotal': np.column_stack([solutions @ g0, solutions @ dg]),
+             'epa': np.column_stack([solutions @ e0, solutions @ de]),
+             'spa': np.column_stack([solutions @ s0, solutions @ ds])}
+
+    return PriceCurve(parameter, list(grind.steps), breakpoints, solutions, lines, solves)
@@ -0,0 +1,239 @@
+import itertools
+import numpy as np
+from . import mammothRecipe
+from .mammothRecipe import ALL_STEPS
+from .mammothGrind import make_step, lp_cycle
+
+# Pareto frontiers:
+# Grind only ever looks for the cycle with the best epaTotal, but that's rarely the whole story: a grind may be worth a
+# little less echoes per action if it causes much less menace, makes more of its worth in scrip, or needs some
+# tedious step less often. Every such quantity is linear in the cycle once it's scaled to one action, just like
+# epaTotal, so trading them against each other is a multi-objective linear program, whose Pareto frontier (the cycles
+# that can't be improved in one objective without giving something up in another) is made of the optimal cycles of
+# weighted sums of the objectives.
+# The objectives are given by name, optionally along with 'max' or 'min':
+#   'epaTotal', 'epa', 'spa'  echoes (counting scrip through hambitrage), echoes, scrip per action (maximized)
+#   'menace'                  menace CP healed per action, from failed checks and implausible sales (minimized)
+#   'heal'                    fraction of the actions spent healing that menace (minimized)
+#   a step name               number of times the step is taken per action (minimized)
+# With two objectives the frontier is found exactly, by the same crossing-lines search as mammothParametric: starting
+# from the best cycle of each objective, every pair of neighbouring frontier cycles is probed with the weights
+# perpendicular to the line joining them, which either finds a new frontier cycle beyond it or proves that the line
+# is part of the frontier (every cycle on it being a mix of the two). That takes two solves per frontier cycle.
+# With more objectives the weights are taken on an even grid instead, and the distinct cycles found are kept.
+#   frontier = pareto_frontier(grind, ['epaTotal', 'menace'])
+#   frontier.print_frontier()
+#   frontier.at('menace', 0.5)     # best cycle healing at most 0.5 menace CP per action
+
+SENSES = {'epaTotal': 'max', 'epa': 'max', 'spa': 'max', 'menace': 'min', 'heal': 'min'}
+
+
+class ParetoFrontier:
+
+    def __init__(self, objectives, senses, steps, points, solutions, weights, solves, exact):
+        """
+
+        :param objectives: list of the names of the objectives
+        :param senses: list of 'max' or 'min', one per objective
+        :param steps: list of the steps of the grind
+        :param points: (cycles x objectives) array of the objective values of every frontier cycle
+        :param solutions: (cycles x steps) array of the frontier cycles, scaled to one action
+        :param weights: (cycles x objectives) array of the weights (summing up to one, on the objectives scaled to
+            comparable sizes) that each cycle was found with
+        :param solves: number of linear programs solved to find the frontier
+        :param exact: whether the frontier is exactly the line through the points, in order (two objectives), or
+            only a sample of its corners
+        """
+        self.objectives = objectives
+        self.senses = senses
+        self.steps = steps
+        self.points = points
+        self.solutions = solutions
+        self.weights = weights
+        self.solves = solves
+        self.exact = exact
+
+    def __len__(self):
+
+        return len(self.points)
+
+    def ratios(self, i):
+        """
+        :return: dictionary of the number of times every step is taken per action in the i-th frontier cycle
+        """
+        return dict(zip(self.steps, self.solutions[i]))
+
+    def at(self, name, value):
+        """
+        Reads the two-objective frontier where one of the objectives is at the given value, mixing the two frontier
+        cycles on either side: e.g. at('menace', 0.5) is the cycle with the best value of the other objective among
+        the ones causing 0.5 menace CP per action.
+
+        :return: dictionary of the values of both objectives, plus the cycle under 'ratios'
+        """
+        if not self.exact:
+            raise ValueError('only the frontiers of two objectives can be read between their points')
+
+        k = self.objectives.index(name)
+        column = self.points[:, k]
+        # the points go from the best of the first objective to the best of the second, so column is monotonic
+        order = np.argsort(column)
+        if not column[order[0]] <= value <= column[order[-1]]:
+            raise ValueError('%s = %g is out of the frontier (%g to %g)' % (name, value, column.min(), column.max()))
+
+        if len(self) == 1:
+            a = b = 0
+            t = 0.
+        else:
+            i = int(np.clip(np.searchsorted(column[order], value), 1, len(self) - 1))
+            a, b = order[i - 1], order[i]
+            t = (value - column[a])/(column[b] - column[a])
+
+        point = (1 - t)*self.points[a] + t*self.points[b]
+        result = dict(zip(self.objectives, point))
+        result['ratios'] = dict(zip(self.steps, (1 - t)*self.solutions[a] + t*self.solutions[b]))
+        return result
+
+    def print_frontier(self):
+
+        print('%d frontier cycles, %d solves' % (len(self), self.solves))
+        print('  '.join('%14s' % name for name in self.objectives))
+        for i in range(len(self)):
+            used = [step for step, ratio in zip(self.steps, self.solutions[i]) if ratio > 1e-12]
+            print('  '.join('%14.6f' % value for value in self.points[i]) + '  ' + ', '.join(
+                step for step in used if not step.endswith(' Overflow')))
+
+
+def objective_rows(grind, objectives):
+    """
+    Turns objective names into the rows of their per-action values.
+
+    :return: list of names, list of senses and (objectives x steps) array, so that the values of a cycle y scaled to
+        one action are rows * y
+    """
+    head = grind.matrix[:3].toarray() if grind.sparse else np.asarray(grind.matrix[:3])
+    menace = None
+    names, senses, rows = [], [], []
+
+    for objective in objectives:
+
+        name, sense = (objective, None) if isinstance(objective, str) else objective
+        sense = sense or SENSES.get(name, 'min')
+        if sense not in ('max', 'min'):
+            raise ValueError("the sense of %s must be 'max' or 'min', not %r" % (name, sense))
+
+        if name in ('menace', 'heal'):
+            if menace is None:
+                # (overflow steps don't cause any menace)
+                menace = np.array([make_step(step, grind.stats, grind.add_parameters).menace
+                                   if step in ALL_STEPS else 0. for step in grind.steps])
+            row = menace if name == 'menace' else menace/3/(1 + mammothRecipe.social_heals)
+        elif name == 'epaTotal':
+            row = grind.gain
+        elif name == 'epa':
+            row = head[1]
+        elif name == 'spa':
+            row = head[2]
+        elif name in grind.step_ref:
+            row = np.zeros(grind.dim1)
+            row[grind.step_ref[name]] = 1
+        else:
+            raise ValueError('unknown objective %r (not one of %s nor a step of the grind)' % (name, ', '.join(SENSES)))
+
+        names.append(name)
+        senses.append(sense)
+        rows.append(np.asarray(row, dtype=float))
+
+    return names, senses, np.array(rows)
+
+
+def pareto_frontier(grind, objectives=('epaTotal', 'menace'), divisions=8, tol=1e-7):
+    """
+    Finds the Pareto frontier of the cycles of a grind's steps over two or more objectives (see the top of the
+    module). The grind itself isn't changed.
+
+    :param grind: Grind instance (of any backend: the frontier always comes from the linear program)
+    :param objectives: list of objective names, or of (name, 'max'/'min') pairs
+    :param divisions: with more than two objectives, number of steps of the grid of weights along every objective
+    :param tol: relative tolerance under which two objective values are considered the same (HiGHS only solves to
+        about 1e-7)
+    :return: ParetoFrontier instance
+    """
+    names, senses, rows = objective_rows(grind, objectives)
+    if len(names) < 2:
+        raise ValueError('a frontier needs at least two objectives')
+    sign = np.array([1. if sense == 'max' else -1. for sense in senses])
+    oriented = sign[:, np.newaxis]*rows      # everything maximized from here on
+    solves = 0
+
+    def solve(weights, a_ub=None, b_ub=None):
+        nonlocal solves
+        solves += 1
+        result = lp_cycle(grind.matrix, weights @ oriented, a_ub, b_ub)
+        if result.status != 0:
+            raise ValueError('grind not practicable (%s)' % result.message)
+        return result.x
+
+    # the objectives come in very different sizes (epaTotal is about 5, a step frequency about 0.01), so they're
+    # scaled by their largest value among the best cycles of every one of them; from here on tol is absolute
+    unit = np.eye(len(names))
+    first = [solve(unit[k]) for k in range(len(names))]
+    scale = np.abs(oriented @ np.array(first).transpose()).max(1)
+    scale[scale == 0] = 1.
+    oriented = oriented/scale[:, np.newaxis]
+
+    def best(k):
+        # the best cycle for objective k, and among the ties the best one for the others (with even weights)
+        value = oriented[k] @ first[k]
+        return solve(1 - unit[k], -oriented[[k]], [-(value - tol)]), unit[k]
+
+    corners = [best(k) for k in range(len(names))]
+
+    if len(names) == 2:
+
+        # search between the two ends of the frontier, left half first so that the cycles come out in order
+        found = [corners[0]]
+        stack = [(corners[0][0], corners[1][0], corners[1][1])]
+        while stack:
+
+            p, q, wq = stack.pop()
+            gp, gq = oriented @ p, oriented @ q
+            if np.abs(gp - gq).max() <= tol:
+                continue    # the same cycle
+            weights = np.maximum([gq[1] - gp[1], gp[0] - gq[0]], 0.)
+            weights /= weights.sum()
+            r = solve(weights)
+            if weights @ (oriented @ r) > weights @ gp + tol:
+                stack.append((r, q, wq))
+                stack.append((p, r, weights))
+            else:
+                found.append((q, wq))
+
+    else:
+
+        # even grid of weights over the objectives, rescaled by how much each one varies between the corners so that
+        # the grid is spread over the whole frontier
+        values = np.array([oriented @ y for y, weights in corners])
+        spread = values.max(0) - values.min(0)
+        spread[spread <= tol] = 1.
+        found = list(corners)
+        for counts in itertools.product(range(divisions + 1), repeat=len(names)):
+            if sum(counts) != divisions or max(counts) == divisions:
+                continue
+            weights = np.array(counts)/divisions
+            found.append((solve(weights/spread), weights))
+
+        # only the distinct cycles that no other one dominates
+        values = np.array([oriented @ y for y, weights in found])
+        keep = []
+        for i in range(len(found)):
+            dominated = np.any(np.all(values >= values[i] - tol, 1) & np.any(values > values[i] + tol, 1))
+            duplicate = any(np.abs(values[j] - values[i]).max() <= tol for j in keep)
+            if not dominated and not duplicate:
+                keep.append(i)
+        found = [found[i] for i in keep]
+
+    solutions = np.array([y for y, weights in found])
+
+    return ParetoFrontier(names, senses, list(grind.steps), solutions @ rows.transpose(), solutions,
+                          np.array([weights for y, weights in found]), solves, len(names) == 2)
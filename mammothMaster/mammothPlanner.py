@@ -0,0 +1,170 @@
+from collections import OrderedDict
+import numpy as np
+from .mammothCache import toggles
+from .mammothSweep import Sweep
+
+# Upgrade planning:
+# stats don't stay put, they get bought up over time, and which upgrade to buy first is a question of how soon each
+# one pays for itself. An upgrade plan starts from the current profile and a list of the successive upgrades of every
+# stat, each one an (amount, cost in echoes) pair, e.g.
+#   upgrades = {'MAnatomy': [(1, 4000)]*4, 'Shadowy': [(25, 2500), (25, 5000)]}
+# and grinds the given steps meanwhile. Echoes are spent on an upgrade as soon as there are enough of them, so the
+# fastest way of getting to any combination of upgrades follows from the fastest ways of getting to the combinations
+# one upgrade short of it (dynamic programming over the lattice of upgrade levels, lowest levels first). With a horizon
+# of so many actions, the best plan is then the combination that leaves the most echoes in hand at the end, after
+# paying for all of its upgrades (waiting is only worth it if upgrades may lower the epa, which this doesn't consider).
+# The epaTotal of every combination comes from a single Sweep over the whole lattice (the EPA surface), kept in
+# surface_cache, so trying other costs or horizons doesn't solve a single grind again:
+#   plan = plan_upgrades(stats, upgrades, steps, horizon=50000)
+#   plan.print_plan()
+#   plan.at(200000).order
+
+SURFACE_CACHE_SIZE = 32
+surface_cache = OrderedDict()
+
+
+def stat_levels(stats, upgrades):
+    """
+    :return: dictionary of the array of scores every upgraded stat goes through, from the current one up
+    """
+    levels = {}
+    for name, steps in upgrades.items():
+        if name not in stats:
+            raise ValueError('%s is upgraded but not part of the stats' % name)
+        levels[name] = stats[name] + np.cumsum([0] + [amount for amount, cost in steps])
+
+    return levels
+
+
+def epa_surface(stats, levels, steps, overflow_list=[], blacklist=None, add_parameters={'NO':0}, solver='lp',
+                compiled=False):
+    """
+    Evaluates the epaTotal of a grind at every combination of stat levels, or reads it from surface_cache.
+
+    :param stats: dictionary of the player stats the levels start from
+    :param levels: dictionary of the array of scores of every upgraded stat, as given by stat_levels
+    :return: read-only array with one axis per upgraded stat (in the order of levels), nan wherever the grind isn't
+        practicable
+    """
+    key = repr((sorted((name, value) for name, value in stats.items() if name not in levels),
+                [(name, values.tolist()) for name, values in levels.items()], list(steps), list(overflow_list),
+                blacklist, add_parameters, solver, compiled, toggles()))
+    if key in surface_cache:
+        surface_cache.move_to_end(key)
+        return surface_cache[key]
+
+    grid = dict(stats)
+    for axis, (name, values) in enumerate(levels.items()):
+        grid[name] = values.reshape([-1 if i == axis else 1 for i in range(len(levels))])
+    sweep = Sweep(grid, steps, overflow_list, blacklist, add_parameters, solver=solver, compiled=compiled)
+
+    surface = np.where(sweep.practicable, sweep.epaTotal, np.nan)
+    surface.flags.writeable = False
+    surface_cache[key] = surface
+    if len(surface_cache) > SURFACE_CACHE_SIZE:
+        surface_cache.popitem(last=False)
+
+    return surface
+
+
+class UpgradePlan:
+
+    def __init__(self, stats, levels, costs, surface, times, previous, horizon):
+        """
+
+        :param stats: dictionary of the current player stats
+        :param levels: dictionary of the array of scores of every upgraded stat
+        :param costs: list of the arrays of the costs of the upgrades of every stat, in the order of levels
+        :param surface: array of the epaTotal at every combination of levels (nan if not practicable)
+        :param times: array of the fewest actions needed to reach every combination of levels (inf if it can't be)
+        :param previous: array of the stat (index into levels) upgraded last on the fastest way to every combination
+        :param horizon: number of actions the plan is for
+        """
+        self.stats = stats
+        self.levels = levels
+        self.names = list(levels)
+        self.costs = costs
+        self.surface = surface
+        self.times = times
+        self.previous = previous
+        self.horizon = horizon
+
+        # echoes in hand at the horizon, for every combination of upgrades
+        rates = np.nan_to_num(surface, nan=0.)
+        with np.errstate(invalid='ignore'):
+            self.echoes_grid = np.where(times <= horizon, (horizon - times)*rates, -np.inf)
+        self.state = np.unravel_index(np.argmax(self.echoes_grid), surface.shape)
+        self.echoes = float(self.echoes_grid[self.state])
+        self.baseline = float(self.echoes_grid[(0,)*surface.ndim])    # without upgrading anything
+        self.final = dict(stats, **{name: self.levels[name][k] for name, k in zip(self.names, self.state)})
+        self.order = self.path(self.state)
+
+    def path(self, state):
+        """
+        :return: list of the upgrades bought on the fastest way to a combination of levels, in order, as
+            (stat, new score, cost, actions before buying it, epaTotal after it) tuples
+        """
+        order = []
+        state = tuple(state)
+        while any(state):
+            axis = self.previous[state]
+            before = state[:axis] + (state[axis] - 1,) + state[axis + 1:]
+            order.append((self.names[axis], self.levels[self.names[axis]][state[axis]],
+                          self.costs[axis][state[axis] - 1], float(self.times[state]), float(self.surface[state])))
+            state = before
+
+        return order[::-1]
+
+    def at(self, horizon):
+        """
+        :return: the best plan for another horizon, without evaluating or planning anything again
+        """
+        return UpgradePlan(self.stats, self.levels, self.costs, self.surface, self.times, self.previous, horizon)
+
+    def print_plan(self):
+
+        print('%g actions: %.1f echoes in hand (%.1f without upgrading), epaTotal %.6f -> %.6f'
+              % (self.horizon, self.echoes, self.baseline, self.surface[(0,)*self.surface.ndim],
+                 self.surface[self.state]))
+        for name, score, cost, action, epa in self.order:
+            print('  at action %10.1f: %s to %s for %g echoes, epaTotal %.6f' % (action, name, score, cost, epa))
+
+
+def plan_upgrades(stats, upgrades, steps, horizon, overflow_list=[], blacklist=None, add_parameters={'NO':0},
+                  solver='lp', compiled=False):
+    """
+    Finds the order in which to buy stat upgrades that leaves the most echoes at the end of a horizon (see the top of
+    the module).
+
+    :param stats: dictionary containing all the current player stats, of the form {'statname': score}
+    :param upgrades: dictionary of the list of successive upgrades of every stat, each one an (amount, cost) pair,
+        where the cost is in echoes (as epaTotal, scrip counting through hambitrage)
+    :param steps: list of the steps of the grind played all along, as in Grind
+    :param horizon: number of actions to plan for
+    :param compiled: whether the EPA surface is evaluated with the compiled kernels, as in Sweep
+    :return: UpgradePlan instance
+    """
+    levels = stat_levels(stats, upgrades)
+    surface = epa_surface(stats, levels, steps, overflow_list, blacklist, add_parameters, solver, compiled)
+    costs = [np.array([cost for amount, cost in upgrades[name]], dtype=float) for name in levels]
+
+    # (impracticable grinds, or ones losing echoes, can't pay for anything)
+    rates = np.nan_to_num(surface, nan=0.)
+    times = np.full(surface.shape, np.inf)
+    previous = np.full(surface.shape, -1)
+    times[(0,)*surface.ndim] = 0.
+
+    # every state comes after the ones one upgrade short of it in this order
+    for state in np.ndindex(surface.shape):
+        for axis in range(surface.ndim):
+            if state[axis] == 0:
+                continue
+            before = state[:axis] + (state[axis] - 1,) + state[axis + 1:]
+            if rates[before] <= 0:
+                continue
+            time = times[before] + costs[axis][state[axis] - 1]/rates[before]
+            if time < times[state]:
+                times[state] = time
+                previous[state] = axis
+
+    return UpgradePlan(stats, levels, costs, surface, times, previous, horizon)
\ No newline at end of file
@@ -0,0 +1,197 @@
+import time
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+# Profiling:
+# optional instrumentation of Grind, so that slow solves can be looked into without wrapping them in cProfile by hand.
+# Every instrumented Grind gets a SolveProfile holding the wall time of its phases (building each step's recipe,
+# assembling and masking the resource matrix, decomposing it, optimizing the cycle) and the optimizer's iteration and
+# function-evaluation counts and success flag. Grinds are instrumented either one at a time, with
+# Grind(..., profile=True), or all together inside a profiling() block, whose Profiler collects every SolveProfile and
+# sums them up:
+#   with profiling() as profiler:
+#       for stats in profiles:
+#           Grind(stats, steps)
+#   profiler.print_summary()
+# Outside of both, the hooks in Grind only cost an attribute lookup per phase.
+
+# PHASES: the phases of a solve, in the order they happen
+PHASES = ('recipes', 'assembly', 'svd', 'optimizer')
+
+profiler = None     # the Profiler collecting the SolveProfiles, while inside a profiling() block
+
+_off = nullcontext()
+
+
+class SolveProfile:
+
+    def __init__(self, stats, steps, solver):
+        """
+
+        :param stats: dictionary of the player stats of the grind (copied, so that it can be told apart later)
+        :param steps: list of the steps asked for
+        :param solver: name of the backend used, as stored in the SOLVERS dictionary
+        """
+        self.stats = dict(stats)
+        self.steps = list(steps)
+        self.solver = solver
+        self.step_times = {}    # recipe build time of every step, indexed by step name
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.nit = 0            # optimizer iterations
+        self.nfev = 0           # objective function evaluations (the lp backend doesn't report them)
+        self.success = None     # whether the optimizer converged, None if it wasn't needed
+        self.cached = False     # whether the solution came from the on-disk store
+        self.clock = time.perf_counter()
+
+    def lap(self, phase):
+        # adds the wall time since the previous lap (or since the profile was created) to the phase
+
+        now = time.perf_counter()
+        self.phases[phase] += now - self.clock
+        self.clock = now
+
+    @contextmanager
+    def timer(self, name, group='phases'):
+        # adds the wall time of the block to the named entry of the phases (or of another group, e.g. step_times)
+
+        times = getattr(self, group)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            times[name] = times.get(name, 0.0) + time.perf_counter() - start
+
+    def optimizer(self, result):
+        # records the counts of a scipy OptimizeResult; a grind may go through more than one optimization
+        # (e.g. when the svd warm start fails) so they add up, and the last one decides the success flag
+
+        self.nit += int(getattr(result, 'nit', 0) or 0)
+        self.nfev += int(getattr(result, 'nfev', 0) or 0)
+        self.success = bool(result.success)
+
+    @property
+    def total(self):
+
+        return sum(self.phases.values())
+
+    def __repr__(self):
+
+        return 'SolveProfile(%.3f ms, %s)' % (1e3*self.total, ', '.join('%s=%.3f ms' % (phase, 1e3*value)
+                                                                        for phase, value in self.phases.items()))
+
+
+def timer(record, name, group='phases'):
+    """
+    Times a block into a SolveProfile, or does nothing if record is None.
+    """
+    return _off if record is None else record.timer(name, group)
+
+
+class Profiler:
+
+    def __init__(self):
+
+        self.records = []
+
+    def add(self, record):
+
+        self.records.append(record)
+
+    def clear(self):
+
+        self.records.clear()
+
+    def __len__(self):
+
+        return len(self.records)
+
+    def step_times(self):
+        """
+        :return: dictionary of the recipe build times of every step across all the solves, indexed by step name
+        """
+        times = {}
+        for record in self.records:
+            for name, value in record.step_times.items():
+                times.setdefault(name, []).append(value)
+
+        return {name: np.array(values) for name, values in times.items()}
+
+    def summary(self):
+        """
+        Sums up all the recorded solves.
+
+        :return: dictionary holding the number of solves, optimizer failures and cache hits, the totals (total, mean,
+            max) of every phase and of the optimizer counts, and the same totals (plus count) for every step
+        """
+        def describe(values):
+            values = np.asarray(values, dtype=float)
+            if not len(values):
+                return {'total': 0.0, 'mean': np.nan, 'max': np.nan}
+            return {'total': float(values.sum()), 'mean': float(values.mean()), 'max': float(values.max())}
+
+        steps = {}
+        for name, values in self.step_times().items():
+            steps[name] = dict(describe(values), count=len(values))
+
+        return {'solves': len(self.records),
+                'failures': sum(record.success is False for record in self.records),
+                'cached': sum(record.cached for record in self.records),
+                'phases': dict({phase: describe([record.phases[phase] for record in self.records])
+                                for phase in PHASES}, total=describe([record.total for record in self.records])),
+                'nit': describe([record.nit for record in self.records]),
+                'nfev': describe([record.nfev for record in self.records]),
+                'steps': steps}
+
+    def hot_steps(self, n=10):
+        """
+        :return: list of the n (step name, total build time) pairs with the largest total build time
+        """
+        totals = [(name, float(values.sum())) for name, values in self.step_times().items()]
+
+        return sorted(totals, key=lambda item: -item[1])[:n]
+
+    def slowest(self, n=10, phase='total'):
+        """
+        :param phase: one of PHASES, 'total', 'nit' or 'nfev'
+        :return: list of the n SolveProfiles with the largest value of phase, e.g. to find the stats of the
+            pathological profiles
+        """
+        if phase == 'total':
+            key = lambda record: record.total
+        elif phase in ('nit', 'nfev'):
+            key = lambda record: getattr(record, phase)
+        else:
+            key = lambda record: record.phases[phase]
+
+        return sorted(self.records, key=key, reverse=True)[:n]
+
+    def print_summary(self, n=10):
+
+        summary = self.summary()
+        print('%d solves, %d optimizer failures, %d from the disk cache' % (summary['solves'], summary['failures'],
+                                                                            summary['cached']))
+        for phase, entry in summary['phases'].items():
+            print('%-12s total %10.3f ms  mean %8.3f ms  max %8.3f ms' % (phase, 1e3*entry['total'],
+                                                                          1e3*entry['mean'], 1e3*entry['max']))
+        print('%-12s mean %8.1f  max %8.0f' % ('iterations', summary['nit']['mean'], summary['nit']['max']))
+        print('hottest steps:')
+        for name, total in self.hot_steps(n):
+            print('  %-40s %10.3f ms' % (name, 1e3*total))
+
+
+@contextmanager
+def profiling(target=None):
+    """
+    Instruments every Grind built inside the block, collecting their SolveProfiles.
+
+    :param target: Profiler to add the records to (e.g. to keep collecting across several blocks); defaults to a
+        new one
+    :return: the Profiler
+    """
+    global profiler
+    previous = profiler
+    profiler = Profiler() if target is None else target
+    try:
+        yield profiler
+    finally:
+        profiler = previous
@@ -1,5 +1,6 @@
 import numpy as np
-from scipy.stats import binom
+from collections import defaultdict
+from .mammothBuild import SkeletonBuild, binomial
 
 ## social heals:
 #  determines whether the menace healing rate is set to the 6 cp/action from social heals or to the 3 cp/action from many late-game single-player options
@@ -31,6 +32,14 @@ EPS = 63.5/125 #scrip-to-epa conversione rate from hambitrage (Ham arbitrage)
 for i in range(LENGTH):
     REFR[RES[i]] = i
 
+## sparse recipes:
+#  every recipe only touches a handful of resources, so once the resource catalog grows past SPARSE_THRESHOLD
+#  entries the recipes store their resource changes as a {index: change} dictionary rather than a dense array
+#  and Grind assembles a sparse resource matrix; sparse_recipes may also be set by hand to force either mode
+
+SPARSE_THRESHOLD = 256
+sparse_recipes = LENGTH > SPARSE_THRESHOLD
+
 ## Balmoral stuff
 #  these are all average numbers of actions taken while in the Balmoral woods assuming particular strategies
 #  and aPoC scores (aPoC = array index); all numbers were calcuated simulating and averaging 1e7 rounds through
@@ -44,22 +53,110 @@ mam_avg = np.array([6, 5.538, 5.149, 4.831, 4.594, 4.461, 4.471, 4.694, 5.236, 6
 neck7_wander = np.array([5, 5.523, 6, 6.339, 6.499, 6.484, 6.327, 6.074, 5.769, 5.425, 5])
 neck7_dark = np.array([1, 0.974, 0.852, 0.647, 0.42, 0.227, 0.096, 0.029, 0.005, 0.0002, 0])
 
+#  WOODS_TABLES collects the tables above as (wander, dark) pairs indexed by the name of the bones being sourced
+#  (the Mammoth darkening chance isn't tabulated, being 1 - p**8); balmoral_tables may hold replacements for them,
+#  indexed by (name, strategy), as worked out by the simulator in mammothBalmoral (see use_simulated_tables), along
+#  with the aPoC scores they're tabulated for, which may be any range: tables are read through woods_index
+
+WOODS_TABLES = {'Mammoth': (mam_avg, None), '7Necks': (neck7_wander, neck7_dark)}
+WOODS_APOC = np.arange(11)   # aPoC scores of the hard-coded tables
+APOC_CAP = 10                # every wander succeeds from this aPoC on, so the tables stop changing
+balmoral_tables = None
+
+def woods_table(name, strategy='patient'):
+    #returns the (wander, dark, apoc) tables of a search, or None if only the hard-coded formulas are available
+
+    if balmoral_tables is not None and (name, strategy) in balmoral_tables:
+        return balmoral_tables[name, strategy]
+    if strategy == 'patient':
+        return WOODS_TABLES[name] + (WOODS_APOC,)
+    return None
+
+def woods_index(scores, apoc):
+    #position of aPoC scores (number or array) in the scores a table is tabulated for; scores past APOC_CAP read the
+    #last entry of tables that get that far
+
+    scores = np.asarray(scores)
+    apoc = np.asarray(apoc)
+    if scores[-1] >= APOC_CAP:
+        apoc = np.minimum(apoc, scores[-1])
+    index = np.minimum(np.searchsorted(scores, apoc), len(scores) - 1)
+    if (scores[index] != apoc).any():
+        raise ValueError('the Balmoral tables only cover aPoC %s, not %s' % (scores.tolist(), apoc.tolist()))
+    return index[()]
+
 
 
 ## check difficulties:
-#  ufuncs calculating the success chance of a check, with the same convention of difficulty = score at which you have a 60% chance of succeeding
+#  vectorized functions calculating the success chance of a check, with the same convention of difficulty = score at
+#  which you have a 60% chance of succeeding; difficulty and score may be numbers or arrays (broadcast together)
+#  and the result is always float64, a plain float for scalar inputs or an array otherwise
+#  (scalars skip numpy altogether, as most checks are single ones and numpy's overhead would dwarf the arithmetic)
+
+SCALARS = (int, float, np.integer, np.floating)
+
+def broad_check(difficulty, score):
+    if isinstance(difficulty, SCALARS) and isinstance(score, SCALARS):
+        return 1. if difficulty == 0 else min(1., 0.6*float(score)/float(difficulty))
+    difficulty = np.asarray(difficulty, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.minimum(1, 0.6*np.asarray(score, dtype=float)/difficulty)
+    return np.where(difficulty == 0, 1., p)[()]
+
+def narrow_check(difficulty, score):
+    if isinstance(difficulty, SCALARS) and isinstance(score, SCALARS):
+        return max(min(1., 1e-1*(float(score) - float(difficulty)) + 0.6), 1e-1)
+    p = np.minimum(1, 1e-1*(np.asarray(score, dtype=float) - np.asarray(difficulty, dtype=float)) + 0.6)
+    return np.maximum(p, 1e-1)[()]
+
+## check tables:
+#  the very same checks come up over and over with integer stats, so every check also keeps a table of its success
+#  chances for all the integer scores from 0 to MAX_SCORE at the difficulties used by the recipes; whenever the
+#  difficulty is one of those and the scores are integers in range the chances are read off the table (the values are
+#  calculated by the functions above, so results are identical either way), otherwise the function is called directly.
+#  check_tables = 0 turns the lookups off; new check modes may be added to the checks dictionary as CheckTable instances
+#  or as any function taking (difficulty, score)
+
+check_tables = 1
+MAX_SCORE = 500
+
+class CheckTable:
+
+    def __init__(self, check, difficulties=(), max_score=MAX_SCORE):
+        """
 
-def broad(difficulty, score):
-    if difficulty == 0:
-        return 1
-    return min(1, 0.6*score/difficulty)
+        :param check: (function) vectorized function taking (difficulty, score) and returning the success chance
+        :param difficulties: (iterable) difficulties at which the chances are tabulated
+        :param max_score: (int) highest score tabulated
+        """
+        self.check = check
+        self.max_score = max_score
+        self.tables = {}
+        self.lists = {}     # same tables as lists of floats, for quick single lookups
+        for difficulty in difficulties:
+            self.tabulate(difficulty)
 
-def narrow(difficulty, score):
-    p = min(1, 1e-1*(score - difficulty) + 0.6)
-    return max(p, 1e-1)
+    def tabulate(self, difficulty):
 
-broad = np.frompyfunc(broad, 2, 1)
-narrow = np.frompyfunc(narrow, 2, 1)
+        self.tables[difficulty] = self.check(difficulty, np.arange(self.max_score + 1))
+        self.lists[difficulty] = self.tables[difficulty].tolist()
+
+    def __call__(self, difficulty, score):
+
+        if check_tables and isinstance(difficulty, SCALARS) and difficulty in self.tables:
+
+            if isinstance(score, (int, np.integer)):
+                if 0 <= score <= self.max_score:
+                    return self.lists[difficulty][score]
+            elif not isinstance(score, SCALARS):
+                score = np.asarray(score)
+                if score.dtype.kind in 'iu' and score.size and 0 <= score.min() and score.max() <= self.max_score:
+                    return self.tables[difficulty][score]
+
+        return self.check(difficulty, score)
+
+broad = CheckTable(broad_check, [120, 200])
+narrow = CheckTable(narrow_check, [1, 4, 5, 6, 11, 200])
 
 checks = {'broad': broad, 'narrow': narrow}
 
@@ -68,6 +165,8 @@ checks = {'broad': broad, 'narrow': narrow}
 #  the main feature is the self.resources array, containing the item changes involved in it.
 #  in_resources is a dictionary where each entry is of the form {'resource name': change} and only the desired
 #  non-zero entries need to be specified (on account of self.resources being initialized with np.zeros)
+#  when sparse_recipes is set self.resources is a defaultdict instead, which supports the very same indexing;
+#  self.entries() and self.dense() give access to the resource changes regardless of the storage mode
 
 # index 0 ('Actions') is the only one where an expense is recorded as a positive number
 # rather than a negative number, since there's no way to gain actions during regular play
@@ -78,51 +177,107 @@ checks = {'broad': broad, 'narrow': narrow}
 # the self.(*)_resource allows quick access to the self.resources array through the resource name
 #   rather than its index in RES
 
+# all of the methods accept either single values or arrays (as the checks do): the penalties are worked out for every
+#   element and all of them are added to the action cost, while the resource methods take a list of names with a matching
+#   list (or array) of amounts; recipes are built by the hundreds of thousands when sweeping over stats, so they only
+#   carry the four attributes below (__slots__) and nothing gets allocated per instance besides the resources
+
+# self.menace keeps track of the menace CP that the penalties have to heal (per run of the step), whose healing
+#   actions are already part of the action cost; it's only needed to weigh grinds against the menace they cause
+
 class recipe:
 
+    __slots__ = ('name', 'resources', 'OFresources', 'menace')
+
     def __init__(self, name, in_resources, overflow_resources=[]):
 
         self.name = name
-        self.resources = np.zeros(LENGTH)
+        self.menace = 0.
+        self.resources = defaultdict(float) if sparse_recipes else np.zeros(LENGTH)
         for KEY, VALUE in in_resources.items():
             self.add_resource(KEY, VALUE)
 
         self.OFresources = overflow_resources
 
-        self.action_penalty = np.frompyfunc(self.action_penalty, 3, 1)
-        self.menace_penalty = np.frompyfunc(self.menace_penalty, 4, 1)
-        self.sell_penalty = np.frompyfunc(self.sell_penalty, 5, 1)
-        self.get_resource = np.frompyfunc(self.get_resource, 1, 1)
-        self.add_resource = np.frompyfunc(self.add_resource, 2, 0)
-        self.remove_resource = np.frompyfunc(self.remove_resource, 2, 0)
+    def copy(self):
+        #returns an independent copy of the recipe (the recipe cache hands out copies)
 
+        instance = type(self).__new__(type(self))
+        instance.name = self.name
+        instance.resources = self.resources.copy()
+        instance.OFresources = list(self.OFresources)
+        instance.menace = self.menace
+        return instance
+
+    def entries(self):
+        #returns the indices in RES of the non-zero resource changes, together with their values
+
+        if isinstance(self.resources, np.ndarray):
+            index = np.flatnonzero(self.resources)
+            return index, self.resources[index]
+
+        items = [(key, value) for key, value in self.resources.items() if value != 0]
+        index = np.array([key for key, value in items], dtype=int)
+        return index, np.array([value for key, value in items], dtype=float)
+
+    def dense(self):
+        #returns the resource changes as a dense array of length LENGTH
+
+        if isinstance(self.resources, np.ndarray):
+            return self.resources
+
+        array = np.zeros(LENGTH)
+        index, values = self.entries()
+        array[index] = values
+        return array
 
     def get_resource(self, key):
 
-        return self.resources[REFR[key]]
+        if isinstance(key, str):
+            return self.resources[REFR[key]]
+        return np.array([self.resources[REFR[item]] for item in key])
 
     def add_resource(self, key, amnt):
 
-        self.resources[REFR[key]] += amnt
+        if isinstance(key, str):
+            self.resources[REFR[key]] += amnt
+        else:
+            for item, value in zip(key, np.broadcast_to(amnt, len(key))):
+                self.resources[REFR[item]] += value
 
     def remove_resource(self, key, amnt):
 
-        self.resources[REFR[key]] -= amnt
+        self.add_resource(key, -np.asarray(amnt) if not isinstance(key, str) else -amnt)
+
+    def charge(self, actions):
+        #adds one or more action costs to the recipe, one at a time so that the rounding is always the same;
+        #returns their total
+
+        if isinstance(actions, np.ndarray):
+            total = 0.
+            for value in actions.flat:
+                self.resources[0] += value
+                total += value
+            return total
+
+        self.resources[0] += actions
+        return actions
 
     def action_penalty(self, difficulty, stat, mode='broad'):
         #raises action_cost due to failing checks
 
         p = checks[mode](difficulty, stat)
 
-        self.resources[0] += 1/p - 1
-        return 1/p - 1
+        penalty = 1/p - 1
+        self.charge(penalty)
+        return penalty
 
 
     def menace_penalty(self, difficulty, stat, menace, mode='broad'):
         #raises action_cost due to failing checks and needing to heal menaces from said check
         fail = self.action_penalty(difficulty, stat, mode)
         heal = fail*menace/3/(1 + social_heals)
-        self.resources[0] += heal
+        self.menace += self.charge(heal)*3*(1 + social_heals)
         return heal
 
 
@@ -131,12 +286,64 @@ class recipe:
         #raises action cost due to failed sales and healing menaces from implausibility
         #takes two arrays, one with the possible implausibility values and the other with the chance of those values occuring
 
-        p = broad(multiplier*implausibility, stat)
+        p = broad(multiplier*np.asarray(implausibility), stat)
         penalty = probability*(1/p - 1)*(1 + menace/3/(1 + social_heals))
-        self.resources[0] += penalty
+        # (the menace CP is the part of the penalty spent healing, 3 or 6 CP per action)
+        self.menace += self.charge(penalty)*menace/(1 + menace/3/(1 + social_heals))
 
         return penalty
 
+# The recipe_batch class:
+# many recipes sharing a single (recipes x LENGTH) buffer, such as the same step built for every stat point of a sweep;
+# assigning a recipe to batch[j] copies its resource changes into the j-th row, while batch[j] gives back a recipe
+# whose resources are a view into that row (so changes to it end up in the buffer)
+
+class recipe_batch:
+
+    __slots__ = ('names', 'resources', 'overflows', 'menace')
+
+    def __init__(self, size):
+
+        self.names = [None]*size
+        self.resources = np.zeros((size, LENGTH))
+        self.overflows = [[] for _ in range(size)]
+        self.menace = np.zeros(size)
+
+    def __len__(self):
+
+        return len(self.names)
+
+    def __setitem__(self, j, instance):
+
+        self.names[j] = instance.name
+        self.overflows[j] = instance.OFresources
+        self.menace[j] = instance.menace
+        if isinstance(instance.resources, np.ndarray):
+            self.resources[j] = instance.resources
+        else:
+            self.resources[j] = 0
+            index, values = instance.entries()
+            self.resources[j, index] = values
+
+    def __getitem__(self, j):
+
+        instance = recipe.__new__(recipe)
+        instance.name = self.names[j]
+        instance.resources = self.resources[j]
+        instance.OFresources = self.overflows[j]
+        instance.menace = self.menace[j]
+        return instance
+
+    def OFresources(self):
+        #every overflow resource of the recipes in the batch, in order of appearance
+
+        union = []
+        for overflow in self.overflows:
+            for item in overflow:
+                if item not in union:
+                    union.append(item)
+        return union
+
 # The buyer class:
 # Each instance of the buyer class represents a different Bone Market buyer, with their different rewards, the scaling
 # of said rewards, and information on the difficulty scaling on their sell check; their main use is being called by the
@@ -144,20 +351,20 @@ class recipe:
 
 class buyer:
 
-    def __init__(self, name, primary_payout, secondary_payout, primary_factor, primary_bonus=0,
-                                                       secondary_scaling, menaceCP, difficulty_scaling):
+    def __init__(self, name, primary_payout, secondary_payout, primary_factor,
+                 secondary_scaling, menaceCP, difficulty_scaling, primary_bonus=0):
         """
 
         :param name: (string) The name of the buyer
         :param primary_payout: (string) the resource they give as their primary payout
         :param secondary_payout: (string) the resource they give as their secondary payout
         :param primary_factor: (float) the factor by which a skeleton's value is multiplied to determine primary payout
-        :param primary_bonus: (int) the fixed bonus on their primary payout
-                                    (in addition to the one determined by skeleton value)
         :param secondary_scaling: (dict) information on the scaling function that determines the secondary payout
         :param menaceCP: (int) the amount of Suspicion CP received on a failure
         :param difficulty_scaling: (int) the scaling factor that determines the sale check's difficulty, based on
                                          the skeleton's implausibility
+        :param primary_bonus: (int) the fixed bonus on their primary payout
+                                    (in addition to the one determined by skeleton value)
         """
         self.name = name
         self.payout = dict(primary=primary_payout, secondary=secondary_payout)
@@ -174,6 +381,8 @@ class buyer:
 
 class skeleton(recipe):
 
+    __slots__ = ('qualities', 'buyers')
+
     def __init__(self, name, in_resources, skelestats, buyers=[]):
         """
 
@@ -188,10 +397,17 @@ class skeleton(recipe):
         self.qualities = skelestats
         self.buyers = buyers
 
+    def copy(self):
+
+        instance = super().copy()
+        instance.qualities = dict(self.qualities)
+        instance.buyers = list(self.buyers)
+        return instance
+
     def sell(self, buyer, stats):
 
         title = 'Sell ' + self.name + ' to ' + buyer.name
-        instance = recipe(title, [], buyer.payout.values())
+        instance = recipe(title, {}, list(buyer.payout.values()))
         temp_qualities = buyer.process(stats, self.qualities)
         instance.add_resource(buyer.payout['primary'], self.qualities['Value']*buyer.factor + buyer.bonus)
         instance.add_resource(buyer.payout['secondary'], buyer.scaling(self.qualities))
@@ -223,7 +439,7 @@ class skeleton(recipe):
 def GetMammoth(stats, strat='best'):
 
     instance = recipe('Get Ribcage', {'Actions': 6, 'MRibcage': 1, 'HRelics': 2, 'VCResearch' : -8})
-    apoc = min(10, stats['aPoC'])
+    apoc = stats['aPoC']
     wander_succ = narrow(6, apoc)
 
     if strat == 'best':
@@ -231,7 +447,17 @@ def GetMammoth(stats, strat='best'):
         strat = 'hasty' if apoc < 9 else 'patient'
 
 
-    if strat == 'hasty':
+    tables = woods_table('Mammoth', strat)
+
+    if tables is not None and tables[1] is not None:
+
+        wander, dark, scores = tables
+        i = woods_index(scores, apoc)
+        instance.remove_resource('TBScraps', 5*dark[i])
+        instance.add_resource('Moonlit', wander[i] + dark[i])
+        instance.resources[0] += wander[i] + dark[i]
+
+    elif strat == 'hasty':
 
 
         instance.remove_resource('TBScraps', 5)
@@ -240,34 +466,39 @@ def GetMammoth(stats, strat='best'):
 
     else:
 
+        wander = tables[0][woods_index(tables[2], apoc)]
         instance.remove_resource('TBScraps', 5*(1 - wander_succ**8))
-        instance.add_resource('Moonlit', mam_avg[apoc] + 1-wander_succ**8)
-        instance.resources[0] += mam_avg[apoc] + 1-wander_succ**8
+        instance.add_resource('Moonlit', wander + 1-wander_succ**8)
+        instance.resources[0] += wander + 1-wander_succ**8
 
     return instance
 
 def Get7Necks(stats, strat='best'):
 
     instance = recipe('Get Ribcage', {'Actions': 7, 'Sw7Necks': 1, 'VCResearch': -8})
-    apoc = min(10, stats['aPoC'])
+    apoc = stats['aPoC']
     #wander_succ = narrow(6, apoc)
 
     if strat == 'best':
 
         strat = 'hasty' if apoc < 3 else 'patient'
 
-    if (strat == 'hasty'):
+    tables = woods_table('7Necks', strat)
 
+    if tables is not None:
 
-        instance.resources[REFR['TBScraps']] -= 5
-        instance.resources[REFR['Moonlit']] += 1
-        instance.resources[0] += 1
+        wander, dark, scores = tables
+        i = woods_index(scores, apoc)
+        instance.resources[REFR['TBScraps']] -= 5*dark[i]
+        instance.resources[REFR['Moonlit']] += wander[i] + dark[i]
+        instance.resources[0] += wander[i] + dark[i]
 
     else:
 
-        instance.resources[REFR['TBScraps']] -= 5*neck7_dark[apoc]
-        instance.resources[REFR['Moonlit']] += neck7_wander[apoc] + neck7_dark[apoc]
-        instance.resources[0] += neck7_wander[apoc] + neck7_dark[apoc]
+
+        instance.resources[REFR['TBScraps']] -= 5
+        instance.resources[REFR['Moonlit']] += 1
+        instance.resources[0] += 1
 
     return instance
 
@@ -315,191 +546,167 @@ def DuplicatePSkull(stats):
     instance = recipe('Duplicate Seal Skull', {'Actions':1, 'BFragments': -1750, 'WAmber': -25, 'IBiscuits': -1, 'PSkull': 1})
     return instance
 
-def ZeeMammoth(stats):
+# the skeletons are worth 5 scrip per point of antiquity times menace, on top of what their parts are worth; their
+# builds (see mammothBuild) work out the chance of every outcome, and are kept apart from the recipes (as the functions
+# below ending in _build, which take the build class to use) so that the simulation draws its skeletons from the very
+# same checks
+def antiquity_menace(qualities):
 
-    instance = recipe('Mammoth of the Zee', {'Actions': 9, 'MRibcage': -1, 'PSkull': -1, 'Scrip': 125 + 50 + 5*4})
+    return qualities['Antiquity']*qualities['Menace']
 
-    skull_succ = narrow(4, stats['MAnatomy'])
-    skull_fail = 1 - skull_succ
+def zee_build(stats, kind=SkeletonBuild):
 
+    skull_succ = narrow(4, stats['MAnatomy'])
     tail_succ = narrow(5, stats['MAnatomy'])
-    tail_fail = 1 - tail_succ
-
     chimera_succ = narrow(11, stats['Mith'])
-    chimera_prob = np.array([chimera_succ, 1 - chimera_succ])
-
     limb_succ = narrow(11, stats['MAnatomy'])
 
-    #if skull attachment succeeds, attach all legs and if all succeed also add tentacle
+    #attach the skull (2 Menace, 1 if it fails) and all legs (6-10 Antiquity)
 
-    needtail_chance = skull_succ*limb_succ**4
-    antiq = np.array([6, 7, 8, 9])
-    chance = skull_succ*binom.pmf(antiq-6, 4, limb_succ)
-    chance[-1] += needtail_chance
-    instance.add_resource('Scrip', 10*np.dot(antiq, chance) + 5*needtail_chance)
+    build = kind(Antiquity=6)
+    build.check(skull_succ, {'Menace': 2}, {'Menace': 1})
+    for _ in range(4):
+        build.check(limb_succ, {'Antiquity': 1})
 
-    #if skull attachment fails attach all legs (1 Menace 6-10 Antiquity)
+    #if the skull and all legs succeed also add a tentacle, which makes it a chimera
 
-    antiq = np.array([6, 7, 8, 9, 10])
-    chance = skull_fail*binom.pmf(antiq-6, 4, limb_succ)
-    instance.add_resource('Scrip', 5*np.dot(antiq, chance))
+    needtail = lambda q: q['Menace'] == 2 and q['Antiquity'] == 10
+    build.check(chimera_succ, {'Implausibility': 3}, {'Implausibility': 6}, needtail)
+    build.check(tail_succ, {'Antiquity': -1, 'Scrip': 5}, {'Antiquity': -1, 'Scrip': 5, 'Implausibility': 2}, needtail)
 
-    #account for failed sales
+    return build
 
-    impla = np.array([3, 6, 5, 8])
-    proba = np.empty(4)
-    proba[:2] = chimera_prob*needtail_chance*tail_succ
-    proba[2:] = chimera_prob*needtail_chance*tail_fail
-    instance.sell_penalty(75, stats['Shadowy'], 5, impla, proba)
+def ZeeMammoth(stats):
 
-    return instance
+    instance = recipe('Mammoth of the Zee', {'Actions': 9, 'MRibcage': -1, 'PSkull': -1, 'Scrip': 125 + 50 + 5*4})
 
-def EasyMammoth(stats):
+    build = zee_build(stats)
+    instance.add_resource('Scrip', 5*build.expectation(antiquity_menace))
+    build.add_resources(instance)
 
-    instance = recipe('Easy Mammoth', {'Actions': 9, 'MRibcage': -1, 'HSkull': -1, 'Scrip': 125 + 25 +5*4})
+    #account for failed sales (only the chimeras are implausible at all)
 
-    skull_succ = narrow(6, stats['MAnatomy'])
-    skull_fail = 1 - skull_succ
+    instance.sell_penalty(75, stats['Shadowy'], 5, *build.outcomes('Implausibility'))
 
-    tail_succ = narrow(5, stats['MAnatomy'])
-    tail_fail = 1 - tail_succ
+    return instance
 
-    carve_succ = narrow(6, stats['Mith'])
-    carve_fail = 1 - carve_succ
+def easy_build(stats, kind=SkeletonBuild):
 
+    skull_succ = narrow(6, stats['MAnatomy'])
+    tail_succ = narrow(5, stats['MAnatomy'])
+    carve_succ = narrow(6, stats['Mith'])
     chimera_succ = narrow(11, stats['Mith'])
-    chimera_impl = np.array([3, 6])
-    chimera_prob = np.array([chimera_succ, 1 - chimera_succ])
-
     limb_succ = narrow(11, stats['MAnatomy'])
-    limb_fail = 1 - limb_succ
+
+    build = kind(Antiquity=7, Limbs=0, Finished=0)
+    build.check(skull_succ, {'Menace': 2}, {'Menace': 3, 'Antiquity': -1})
 
     #if skull fails:
     #put JBStinger, 1 success on forelimb: Jthigh, 2 extra limbs
     #put JBStinger, 1 failure on forelimb, then 1 success on forelimb: 2 extra limbs
     #put JBStinger, 2 failures on forelimb: Jthigh, 1 extra limb
     #3 menace, 6 antiquity
-    chance = skull_fail*limb_succ
 
-    instance.resources[REFR['Scrip']] += chance*(1 + 6 + 4 -15)
+    build.check(limb_succ, {'Limbs': 1, 'Scrip': 1 + 6 + 4 - 15}, when=lambda q: q['Menace'] == 3)
+    build.check(limb_succ, {'Limbs': 1, 'Scrip': 1 + 4 - 10}, {'Scrip': 1 - 10 + 6 + 2, 'JThigh': -1},
+                when=lambda q: q['Menace'] == 3 and q['Limbs'] == 0)
 
+    #if skull succeeds: 1 antiquity per forelimb
+    #(if no scrimshander carving knife, stop at the third success and add a femur or relic: 9 Antiquity)
 
-    chance = chance*limb_fail
-    instance.resources[REFR['Scrip']] += chance*(1 + 4 - 10)
+    skull = lambda q: q['Menace'] == 2 and not q['Finished']
+    for _ in range(3):
+        build.check(limb_succ, {'Antiquity': 1}, when=skull)
 
-    chance = skull_fail*limb_fail**2
-    instance.resources[REFR['Scrip']] += chance*(1 - 10 + 6 + 2)
-    instance.resources[REFR['JThigh']] -= chance
+    if scrimshander_knife == 0:
+        build.apply({'Antiquity': -1, 'Finished': 1, 'Scrip': 25*use_HRelic_on_HellM - 5,
+                     'HRelics': -use_HRelic_on_HellM}, when=lambda q: q['Menace'] == 2 and q['Antiquity'] == 10)
+        if use_HRelic_on_HellM != 0:
+            build.check(narrow(5, stats['Mith']), failure={'Implausibility': 2}, when=lambda q: q['Finished'])
 
-    instance.resources[REFR['Scrip']] += skull_fail*90
-    instance.sell_penalty(75, stats['Shadowy'], 5, chimera_impl, skull_fail*chimera_prob)
+    build.check(limb_succ, {'Antiquity': 1}, when=skull)
 
-    #if skull succeeds:
+    #4 successes: carve away with the scrimshander knife, 9 Antiquity 2 Menace
 
-    if scrimshander_knife == 0:
+    if scrimshander_knife != 0:
+        build.check(carve_succ, {'Antiquity': -2}, {'Antiquity': -2, 'Implausibility': 2},
+                    when=lambda q: q['Menace'] == 2 and q['Antiquity'] == 11)
 
-        chance = skull_succ*limb_succ**3
+    #3 successes 1 failure (if no scrimshander carving knife, at least 1 fail among first 3):
+    #  add 1 tentacle, 9 Antiquity 2 Menace
+    #2 or more failures: do nothing, 9-7 Antiquity 2 Menace
 
-        instance.resources[REFR['Scrip']] += chance*(25*use_HRelic_on_HellM -5 + 90)
-        instance.resources[REFR['HRelics']] -= chance*use_HRelic_on_HellM
+    build.check(tail_succ, {'Antiquity': -1, 'Scrip': 5, 'WTentacles': -1},
+                {'Antiquity': -1, 'Scrip': 5, 'WTentacles': -1, 'Implausibility': 2},
+                when=lambda q: skull(q) and q['Antiquity'] == 10)
 
-        if use_HRelic_on_HellM == 0:
-            instance.sell_penalty(75, stats['Shadowy'], 5, chimera_impl, chance*chimera_prob)
+    build.check(chimera_succ, {'Implausibility': 3}, {'Implausibility': 6})
 
-        else:
-            relic_succ = narrow(5, stats['Mith'])
-            relic_fail = 1 - relic_succ
-            impla = np.array([3, 6, 5, 8])
-            proba = np.empty(4)
-            proba[:2] = chimera_prob*chance*relic_succ
-            proba[2:] = chimera_prob*chance*relic_fail
-            instance.sell_penalty(75, stats['Shadowy'], 5, impla, proba)
+    return build
 
-    else:   #4 successess: scrimshander knife
+def EasyMammoth(stats):
 
-        chance = skull_succ*limb_succ**4
-        instance.resources[REFR['Scrip']] += chance*90
+    instance = recipe('Easy Mammoth', {'Actions': 9, 'MRibcage': -1, 'HSkull': -1, 'Scrip': 125 + 25 +5*4})
 
-        carve_succ = narrow(6, stats['Mith'])
-        carve_fail = 1 - carve_succ
+    #the scrimshander knife is tried until it's in hand, whatever the skeleton ends up needing
+    if scrimshander_knife != 0:
         instance.action_penalty(6, stats['Mith'], 'narrow')
 
-        impla = np.array([3, 6, 5, 8])
-        proba = np.empty(4)
-        proba[:2] = chimera_prob*chance*carve_succ
-        proba[2:] = chimera_prob*chance*carve_fail
-        instance.sell_penalty(75, stats['Shadowy'], 5, impla, proba)
+    build = easy_build(stats)
+    instance.add_resource('Scrip', 5*build.expectation(antiquity_menace))
+    build.add_resources(instance)
+    instance.sell_penalty(75, stats['Shadowy'], 5, *build.outcomes('Implausibility'))
 
+    return instance
 
+def winged_build(stats, kind=SkeletonBuild):
 
-    #1 success attaching Horned Skull +
-    #3 successes 1 failure on Fossilised Forelimb
-    #(if no scrimshander carving knife, at least 1 fail among first 3)=
-    #  add 1 tentacle, 9 Antiquity 2 Menace
-    if scrimshander_knife == 0:
-        chance = 3*skull_succ*limb_fail*limb_succ**3
-
-    else:
-        chance = 4*skull_succ*limb_fail*limb_succ**3
+    limb_succ = narrow(11, stats['MAnatomy'])
+    skull_succ = narrow(6, stats['MAnatomy'])
+    tail_succ = narrow(5, stats['MAnatomy'])
+    chimera_succ = narrow(11, stats['Mith'])
 
-    instance.resources[REFR['Scrip']] += chance*(90 + 5)
-    instance.resources[REFR['WTentacles']] -= chance
-    impla = np.array([3, 6, 5, 8])
-    proba = np.empty(4)
-    proba[:2] = chimera_prob*chance*tail_succ
-    proba[2:] = chimera_prob*chance*tail_fail
-    instance.sell_penalty(75, stats['Shadowy'], 5, impla, proba)
+    buy_succ = broad(200, stats['Persuasive'])
 
-    #1 success attaching Horned Skull +
-    #2 or more failures on Forelimbs =
-    #  do nothing, 9-7 Antiquity 2 Menace
-    antiq = np.array([7, 8, 9])
-    chance = skull_succ*binom.pmf(antiq-7, 4, limb_succ)
+    # if skull attachment succeeds: add one wing, three forelimbs, one tentacle tail if needed; 2M 7-9A
+    # if skull attachment fails: add two wings, two forelimbs; 2M 7-9A
+    build = kind(Antiquity=7, Menace=2, Wings=1)
+    build.check(buy_succ, {'Scrip': 5})
+    build.check(skull_succ, failure={'Wings': 1, 'Actions': 0.5, 'WAmber': -12.5, 'BFragments': -50})
+    for _ in range(3):
+        build.check(limb_succ, {'Antiquity': 1}, when=lambda q: q['Wings'] == 1)
+    build.check(limb_succ, {'Antiquity': 2}, when=lambda q: q['Wings'] == 2)
 
-    instance.resources[REFR['Scrip']] += 10*np.dot(chance, antiq)
-    instance.sell_penalty(75, stats['Shadowy'], 5, chimera_impl, chance.sum()*chimera_prob)
+    needtail = lambda q: q['Wings'] == 1 and q['Antiquity'] == 10
+    build.check(chimera_succ, {'Implausibility': 3}, {'Implausibility': 6}, needtail)
+    build.check(tail_succ, {'Antiquity': -1, 'Scrip': 5}, {'Antiquity': -1, 'Scrip': 5, 'Implausibility': 2}, needtail)
 
-    return instance
+    return build
 
 def WingedMammoth(stats):
 
     instance = recipe('One-winged Mammoth', {'Actions': 10.5, 'MRibcage': -1, 'Scrip': 125 + 5*4,
                                              'BFragments': -50, 'WAmber': -12.5})
-    limb_succ = narrow(11, stats['MAnatomy'])
 
-    skull_succ = narrow(6, stats['MAnatomy'])
-    skull_fail = 1 - skull_succ
-
-    tail_succ = narrow(5, stats['MAnatomy'])
-    tail_fail = 1 - tail_succ
-
-    chimera_succ = narrow(11, stats['Mith'])
-    chimera_prob = np.array([chimera_succ, 1 - chimera_succ])
-
-    buy_succ = broad(200, stats['Persuasive'])
-    instance.add_resource('Scrip', 5*buy_succ)
+    build = winged_build(stats)
+    instance.add_resource('Scrip', 5*build.expectation(antiquity_menace))
+    build.add_resources(instance)
+    instance.sell_penalty(75, stats['Shadowy'], 5, *build.outcomes('Implausibility'))
 
-    # if skull attachment succeeds: add one wing, three forelimbs, one tentacle tail if needed; 2M 7-9A
-    antiquity = np.array([7, 8, 9])
-    needtail_chance = skull_succ*limb_succ**3
-    chance = skull_succ * binom.pmf(antiquity - 7, 3, limb_succ)
-    chance[-1] += needtail_chance
+    return instance
 
-    instance.add_resource('Scrip', 10 * np.dot(antiquity, chance) + 5 * needtail_chance)
+def holy_build(stats, kind=SkeletonBuild):
 
-    # if skull attachment fails: add two wings, two forelimbs; 2M 7-9A
-    instance.add_resource('Actions', skull_fail*0.5)
-    instance.remove_resource('WAmber', skull_fail*12.5)
-    instance.remove_resource('BFragments', skull_fail*50)
-    instance.add_resource('Scrip', skull_fail*(70 + 20*limb_succ))
+    legs_succ = narrow(5, stats['Mith'])
+    carve_succ = narrow(6, stats['Mith'])
 
-    impla = np.array([3, 6, 5, 8])
-    proba = np.empty(4)
-    proba[:2] = chimera_prob * needtail_chance * tail_succ
-    proba[2:] = chimera_prob * needtail_chance * tail_fail
-    instance.sell_penalty(75, stats['Shadowy'], 5, impla, proba)
+    # every failed leg costs a rumour and makes it 2 more implausible, and so does a failed carving
+    build = kind()
+    for _ in range(4):
+        build.check(legs_succ, failure={'Implausibility': 2, 'URRumours': -1})
+    build.check(carve_succ, failure={'Implausibility': 2})
 
-    return instance
+    return build
 
 def HolyMammoth(stats, scrimshander_knife=1):
 
@@ -511,103 +718,88 @@ def HolyMammoth(stats, scrimshander_knife=1):
 
         instance = recipe('Holy Mammoth', {'Actions': 10, 'HRelics': -4, 'MRibcage': -1, 'BFragments': -500,
                                            'Peppercaps': -10, 'Echoes' : 137.5, 'URRumours': 22}, ['URRumours'])
-        legs_succ = narrow(5, stats['Mith'])
-        legs_fail = 1 - legs_succ
-        carve_succ = narrow(6, stats['Mith'])
-        carve_fail = 1 - carve_succ
         instance.action_penalty(6, stats['Mith'], 'narrow')
-        instance.remove_resource('URRumours', 4*legs_fail)
         instance.menace_penalty(6, stats['AotRS'], 2, 'narrow')
-        impl = np.array([0, 2, 4, 6, 8, 10])
-        supp = np.arange(5)
-        temp = binom.pmf(supp, 4, legs_fail)
-        instance.sell_penalty(50, stats['Shadowy'], 2, impl[0:-1], temp*carve_succ)
-        instance.sell_penalty(50, stats['Shadowy'], 2, impl[1:], temp*carve_fail)
 
+        build = holy_build(stats)
+        build.add_resources(instance)
+        instance.sell_penalty(50, stats['Shadowy'], 2, *build.outcomes('Implausibility'))
 
         return instance
 
+def ungodly_build(stats, kind=SkeletonBuild):
+
+    legs_succ = narrow(5, stats['Mith'])
+    tent_succ = narrow(1, stats['MAnatomy'])
+    tail_succ = narrow(5, stats['MAnatomy'])
+
+    # failed legs and tails make it 2 more implausible, failed tentacles 1 (and cost some echoes)
+    build = kind()
+    for _ in range(4):
+        build.check(legs_succ, failure={'Implausibility': 2})
+    build.check(tent_succ, failure={'Implausibility': 1, 'Echoes': -2})
+    build.check(tail_succ, failure={'Implausibility': 2})
+
+    return build
+
 def UngodlyMammoth(stats):
 
     instance = recipe('Ungodly Mammoth', {'Actions': 9, 'HRelics': -3, 'MRibcage': -1, 'BFragments': -500,
                                           'Peppercaps': -10, 'WTentacles': -2, 'Echoes': 130, 'URRumours': 17},
                       ['URRumours'])
 
-    legs_succ = narrow(5, stats['Mith'])
-    legs_fail = 1 - legs_succ
-    tent_succ = narrow(1, stats['MAnatomy'])
-    tent_fail = 1 - tent_succ
-    tail_succ = narrow(5, stats['MAnatomy'])
-    tail_fail = 1 - tail_succ
+    legs_fail = 1 - narrow(5, stats['Mith'])
 
     instance.remove_resource('URRumours', 3*legs_fail)
-    instance.remove_resource('Echoes', 2*tent_fail)
     instance.menace_penalty(6, stats['AotRS'], 2, 'narrow')
 
-    impl1 = np.array([0, 2, 4, 6, 8])
-    impl2 = impl1 +1
-
-    supp = np.arange(4)
-    temp = binom.pmf(supp, 4, legs_fail)
-    instance.sell_penalty(50, stats['Shadowy'], 2, impl1[0:-1], temp*tail_succ*tent_succ)
-    instance.sell_penalty(50, stats['Shadowy'], 2, impl1[1:], temp*tail_fail*tent_succ)
-    instance.sell_penalty(50, stats['Shadowy'], 2, impl2[0:-1], temp*tail_succ*tent_fail)
-    instance.sell_penalty(50, stats['Shadowy'], 2, impl2[1:], temp*tail_fail*tent_fail)
+    build = ungodly_build(stats)
+    build.add_resources(instance)
+    instance.sell_penalty(50, stats['Shadowy'], 2, *build.outcomes('Implausibility'))
 
     return instance
 
-def HellMammoth(stats, scrimshander_knife=1):
-
-    instance = recipe('Mammoth from Hell', {'Actions': 9, 'MRibcage': -1, 'HSkull': -1, 'Scrip': 125 + 25 + 5*4})
+def hell_build(stats, scrimshander_knife=1, kind=SkeletonBuild):
 
     limb_succ = narrow(11, stats['MAnatomy'])
-    limb_fail = 1 - limb_succ
-
     skull_succ = narrow(6, stats['MAnatomy'])
-    skull_fail = 1 - skull_succ
-
     tail_succ = narrow(5, stats['MAnatomy'])
-    tail_fail = 1 - tail_succ
-
     carve_succ = narrow(6, stats['Mith'])
-    carve_fail = 1 - carve_succ
-
     chimera_succ = narrow(11, stats['Mith'])
-    chimera_impl = np.array([3, 6])
-    chimera_prob = np.array([chimera_succ, 1 - chimera_succ])
 
-    # If skull attachment succeeds, add limbs
+    # If skull attachment succeeds (2 Menace), add limbs (7-11 Antiquity)
     # if no scrimshander_knife stop at the third success and add UTFemur or HRelic;
     # if antiquity 11, carve away;
     # if antiquity 10, add tentacle;
+    # if skull attachment fails (1 Menace), add four forelimbs
 
-    needtail_chance  = skull_succ*(3 + scrimshander_knife)*limb_fail*limb_succ**3
-    needcarve_chance = skull_succ*scrimshander_knife*limb_succ**4
-    needlimb_chance  = skull_succ*(1 - scrimshander_knife)*limb_succ**3
+    build = kind(Antiquity=7, Finished=0)
+    build.check(skull_succ, {'Menace': 2}, {'Menace': 1})
+    for _ in range(3):
+        build.check(limb_succ, {'Antiquity': 1})
+
+    if scrimshander_knife == 0:
+        build.apply({'Antiquity': -1, 'Finished': 1, 'Scrip': 25*use_HRelic_on_HellM - 5,
+                     'HRelics': -use_HRelic_on_HellM}, when=lambda q: q['Menace'] == 2 and q['Antiquity'] == 10)
+    build.check(limb_succ, {'Antiquity': 1}, when=lambda q: not q['Finished'])
 
-    antiq = np.array([7, 8, 9])
-    chance = skull_succ*binom.pmf(antiq-7, 4, limb_succ)
-    chance[-1] += needtail_chance + needcarve_chance
+    build.check(carve_succ, {'Antiquity': -2}, {'Antiquity': -2, 'Implausibility': 2},
+                when=lambda q: q['Menace'] == 2 and q['Antiquity'] == 11)
+    build.check(tail_succ, {'Antiquity': -1, 'Scrip': 5, 'WTentacles': -1},
+                {'Antiquity': -1, 'Scrip': 5, 'WTentacles': -1, 'Implausibility': 2},
+                when=lambda q: q['Menace'] == 2 and q['Antiquity'] == 10 and not q['Finished'])
+    build.check(chimera_succ, {'Implausibility': 3}, {'Implausibility': 6})
 
-    instance.add_resource('Scrip', 10*np.dot(chance, antiq))
-    instance.add_resource('Scrip', needlimb_chance*(25*use_HRelic_on_HellM - 5) )
-    instance.add_resource('Scrip', 5 * needtail_chance)
-    instance.remove_resource('WTentacles', needtail_chance)
-    instance.remove_resource('HRelics', needlimb_chance*use_HRelic_on_HellM)
+    return build
 
-    # if skull attachment fails, add four forelimbs:
-    # 1 Menace, 7-11 Antiquity
+def HellMammoth(stats, scrimshander_knife=1):
 
-    antiq = np.arange(7, 12)
-    chance = skull_fail*binom.pmf(antiq-7, 4, limb_succ)
-    instance.add_resource('Scrip', 5 * np.dot(chance, antiq))
+    instance = recipe('Mammoth from Hell', {'Actions': 9, 'MRibcage': -1, 'HSkull': -1, 'Scrip': 125 + 25 + 5*4})
 
-    impla = np.array([3, 6, 5, 8])
-    proba = np.empty(4)
-    add_chance = 1 - needtail_chance*tail_fail - needcarve_chance*carve_fail
-    proba[:2] = chimera_prob * add_chance
-    proba[2:] = chimera_prob * (1 - add_chance)
-    instance.sell_penalty(75, stats['Shadowy'], 5, impla, proba)
+    build = hell_build(stats, scrimshander_knife)
+    instance.add_resource('Scrip', 5*build.expectation(antiquity_menace))
+    build.add_resources(instance)
+    instance.sell_penalty(75, stats['Shadowy'], 5, *build.outcomes('Implausibility'))
 
     return instance
 
@@ -664,26 +856,22 @@ def SellNaive(stats):
 
     return instance
 
-def SellTheologian(stats):
-    instance = recipe('Sell to Theologian', {'GenSkeleton': -1, 'IBiscuits': 226})
+def theologian_build(stats, kind=SkeletonBuild):
 
-    disguise_succ = narrow(6, stats['Katatox'])
-    disguise_fail = 1 - disguise_succ
-    instance.add_resource('Actions', 1/disguise_succ)
-    instance.remove_resource('Echoes', 0.5/disguise_succ)
+    # every failed disguise takes another action and half an echo, and makes it 2 more implausible
+    build = kind()
+    build.check(narrow(11, stats['Mith']), {'Implausibility': 3}, {'Implausibility': 6})
+    build.retry(narrow(6, stats['Katatox']), {'Implausibility': 2, 'Actions': 1, 'Echoes': -0.5})
 
-    # for the sake of my sanity i'm assuming you won't fail this more than twice
-    impl = np.array([3, 5, 7, 6, 8, 10])
-    chimera_succ = narrow(11, stats['Mith'])
-    chimera_fail = 1 - chimera_succ
-    prob = np.empty(6)
-    prob[:3] = chimera_succ
-    prob[3:] = chimera_fail
-    prob[::3] *= disguise_succ
-    prob[1::3] *= disguise_succ*disguise_fail
-    prob[2::3] *= disguise_succ*disguise_fail**2
+    return build
 
-    instance.sell_penalty(25, stats['Shadowy'], 3.5, impl, prob)
+def SellTheologian(stats):
+    instance = recipe('Sell to Theologian', {'GenSkeleton': -1, 'IBiscuits': 226, 'Actions': 1, 'Echoes': -0.5})
+
+    build = theologian_build(stats)
+    build.add_resources(instance)
+
+    instance.sell_penalty(25, stats['Shadowy'], 3.5, *build.outcomes('Implausibility'))
 
     return instance
 
@@ -754,9 +942,7 @@ def Painting(stats):
 
     succ_number = np.array([3, 4, 5, 6])
 
-    binomial = binom.pmf(succ_number, 6, paint_succ)
-
-    instance.resources[REFR['Echoes']] += 20*binomial.sum()
+    instance.resources[REFR['Echoes']] += 20*binomial(succ_number, 6, paint_succ).sum()
 
     return instance
 
@@ -0,0 +1,106 @@
+import numpy as np
+import scipy
+from .mammothRecipe import RES
+
+# Action-budgeted schedules:
+# Grind finds the best cycle to repeat forever, which is what matters in the long run, but actual play has a finite
+# number of actions, whatever was stockpiled beforehand (BFragments, WAmber, HRelics...) to spend, and steps that can
+# only be taken a whole number of times. A schedule takes the resource matrix of a Grind as it is and solves the
+# mixed-integer program (HiGHS, through scipy.optimize.milp) for how many times to take every step over the horizon:
+#   maximize    gain * x                        (echoes, scrip counting through hambitrage)
+#   subject to  matrix[0] * x <= actions        (the action budget: days times the actions of a day)
+#               inventory + matrix[i] * x >= 0  (every other resource)
+#               x >= 0 and integer
+# Echoes and Scrip are only held to the inventory if it gives them, they're otherwise free to be spent and made back.
+# Only the totals are counted, so the steps are assumed to be taken in whatever order makes their inputs available.
+# Whatever is left at the end is worth nothing, unless the grind has overflow steps to sell it through. Counts run into
+# the thousands over a few weeks, where the linear relaxation is nearly integer already, so HiGHS stops within gap of
+# the best bound in well under a second:
+#   plan = schedule(grind, 28*200, {'BFragments': 3000, 'WAmber': 500, 'HRelics': 20})
+#   plan.print_schedule()
+
+
+class Schedule:
+
+    def __init__(self, grind, actions, counts, inventory, result):
+        """
+
+        :param grind: the Grind instance the schedule was found for
+        :param actions: action budget of the whole horizon
+        :param counts: array of the number of times every step is taken
+        :param inventory: array of the starting inventory, indexed like grind.reses
+        :param result: the scipy.optimize.OptimizeResult of milp
+        """
+        self.steps = list(grind.steps)
+        self.reses = grind.reses
+        self.actions = actions
+        self.counts = counts
+        self.status = result.status
+        self.message = result.message
+        self.gap = getattr(result, 'mip_gap', 0.)
+
+        self.runs = {step: count for step, count in zip(self.steps, counts.tolist()) if count}
+        changes = grind.matrix @ counts.astype(float)
+        self.actions_used = float(changes[0])
+        self.echoes = float(changes[1])
+        self.scrip = float(changes[2])
+        self.value = float(grind.gain @ counts)
+        self.epaTotal = self.value/self.actions_used if self.actions_used else 0.
+        # what the steady-state cycle would make with the same actions, for comparison
+        self.steady = grind.epaTotal*actions if grind.epaTotal is not None else np.nan
+
+        left = inventory + changes
+        left[:3] = 0
+        self.leftover = {name: float(amount) for name, amount in zip(self.reses, left) if abs(amount) > 1e-9}
+
+    def print_schedule(self):
+
+        print('%g actions: %.1f echoes (%.1f actions used, epaTotal %.6f; the cycle makes %.1f)'
+              % (self.actions, self.value, self.actions_used, self.epaTotal, self.steady))
+        for step, count in self.runs.items():
+            print('  %8g  %s' % (count, step))
+        if self.leftover:
+            print('  left: ' + ', '.join('%s %g' % item for item in self.leftover.items()))
+
+
+def schedule(grind, actions, inventory=None, integer=True, gap=1e-4, time_limit=None):
+    """
+    Finds how many times to take every step of a grind with a finite action budget and a starting inventory (see the
+    top of the module). The grind itself isn't changed.
+
+    :param grind: Grind instance, whose resource matrix (and overflow steps) are used as they are
+    :param actions: number of actions of the whole horizon (e.g. days times the actions of a day)
+    :param inventory: dictionary of the starting amounts of the resources, of the form {'resource name': amount}
+    :param integer: whether the steps may only be taken a whole number of times (False solves the linear relaxation)
+    :param gap: relative gap to the best bound at which HiGHS stops
+    :param time_limit: seconds after which HiGHS gives back the best schedule found so far
+    :return: Schedule instance
+    """
+    start = np.zeros(grind.dim0)
+    for name, amount in (inventory or {}).items():
+        if name not in RES or name == 'Actions':
+            raise ValueError('%r is not a resource that can be stockpiled' % (name,))
+        if name not in grind.ref:
+            print('warning: %s is not used by the grind, its inventory makes no difference' % name)
+            continue
+        start[grind.ref[name]] = amount
+
+    matrix = scipy.sparse.csr_array(grind.matrix)
+    held = [i for i in range(1, grind.dim0) if i >= 3 or grind.reses[i] in (inventory or {})]
+    constraints = [scipy.optimize.LinearConstraint(matrix[[0]], -np.inf, actions)]
+    if held:
+        constraints.append(scipy.optimize.LinearConstraint(matrix[held], -start[held], np.inf))
+
+    options = {'mip_rel_gap': gap}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+    result = scipy.optimize.milp(-grind.gain, constraints=constraints, integrality=np.full(grind.dim1, int(integer)),
+                                 bounds=scipy.optimize.Bounds(0, np.inf), options=options)
+    if result.x is None:
+        raise ValueError('no schedule found (%s)' % result.message)
+    if result.status != 0:
+        print('warning: %s' % result.message)
+
+    counts = np.round(result.x).astype(int) if integer else result.x
+
+    return Schedule(grind, actions, counts, start, result)
\ No newline at end of file
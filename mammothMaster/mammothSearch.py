@@ -0,0 +1,283 @@
+import heapq
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from .mammothRecipe import REFR, LENGTH, EPS, Overflow
+from .mammothGrind import make_step, lp_cycle
+
+# Best-grind search:
+# looks for the subsets of a pool of candidate steps that give the highest epaTotal when added to a fixed base grind.
+# Because every subset of the steps can only do as well as the whole set (a cycle that doesn't use a step is still a
+# cycle of the larger set), the linear program over "everything already chosen + everything still undecided" is an
+# upper bound on every grind in that branch of the search; this lets us run a branch-and-bound over the subset tree:
+#  - branches whose bound can't beat the N-th best grind found so far are skipped;
+#  - branches containing a step that can't possibly run (one of its resources is only ever produced, or only ever
+#    consumed, by the steps still available) are skipped, together with all their supersets;
+#  - the remaining branches are spread over a process pool, sharing the current N-th best epa between workers so
+#    that every one of them prunes as aggressively as possible.
+
+TOLERANCE = 1e-9
+
+
+class Candidate:
+
+    def __init__(self, steps, solution, epaTotal, epa, spa):
+        """
+
+        :param steps: names of the pool steps added to the base grind
+        :param solution: dictionary of the form {'step name': frequency}, scaled to one action per cycle
+        :param epaTotal: total echoes per action, scrip included
+        :param epa: echoes per action
+        :param spa: scrip per action
+        """
+        self.steps = steps
+        self.solution = solution
+        self.epaTotal = epaTotal
+        self.epa = epa
+        self.spa = spa
+
+    def __repr__(self):
+
+        return 'Candidate(%.6f, %s)' % (self.epaTotal, list(self.steps))
+
+
+# the search state is stored as module globals so that it only has to be sent once to every worker process
+_state = {}
+
+
+def _init_search(matrix, gain, base, pool, overflow, names, top, threshold, lock, max_size):
+
+    _state.update(matrix=matrix, gain=gain, base=base, pool=pool, overflow=overflow, names=names, top=top,
+                  threshold=threshold, lock=lock, max_size=max_size)
+
+
+def _dead(chosen, rest):
+    # iteratively removes the undecided steps that can't run because one of their resources has no counterpart;
+    # returns None if one of the chosen steps can't run either, otherwise the pool steps still worth trying
+
+    matrix = _state['matrix']
+    rest = list(rest)
+    while True:
+
+        cols = [*_state['base'], *_state['overflow'], *[_state['pool'][j] for j in chosen + rest]]
+        sub = matrix[3:, cols]
+        pos = (sub > 0).any(1)
+        neg = (sub < 0).any(1)
+        one_sided = pos != neg
+        stuck = set(np.flatnonzero((sub[one_sided] != 0).any(0)))
+        idx = {c: i for i, c in enumerate(cols)}
+        if any(idx[_state['pool'][j]] in stuck for j in chosen):
+            return None
+        kept = [j for j in rest if idx[_state['pool'][j]] not in stuck]
+        if len(kept) == len(rest):
+            return rest
+        rest = kept
+
+
+def _solve(pool_steps):
+
+    cols = [*_state['base'], *_state['overflow'], *[_state['pool'][j] for j in pool_steps]]
+    result = lp_cycle(_state['matrix'][:, cols], _state['gain'][cols])
+    return cols, result
+
+
+def _threshold():
+
+    return _state['threshold'].value
+
+
+def _raise_threshold(value):
+
+    with _state['lock']:
+        if value > _state['threshold'].value:
+            _state['threshold'].value = value
+
+
+def _evaluate(chosen, found, bound=None):
+    # solves the grind made of the base plus the chosen pool steps and stores it among the best found,
+    # provided every chosen step is actually used (otherwise a smaller set gives the same grind);
+    # if the optimum of the branch's bound doesn't use any of the undecided steps it is also this grind's optimum
+
+    if bound is not None and np.all(bound[1].x[len(bound[0]) - bound[2]:] <= TOLERANCE):
+        cols, result = bound[0][:len(bound[0]) - bound[2]], bound[1]
+        y = result.x[:len(cols)]
+    else:
+        cols, result = _solve(chosen)
+        if result.status != 0:
+            return
+        y = result.x
+    used = y[-len(chosen):] > TOLERANCE if chosen else []
+    if not np.all(used):
+        return
+
+    epaTotal = -result.fun
+    top = _state['top']
+    if len(found) == top and epaTotal <= found[0][0] + TOLERANCE:
+        return
+
+    matrix = _state['matrix']
+    names = _state['names']
+    candidate = Candidate([names[_state['pool'][j]] for j in chosen],
+                          {names[c]: y[i] for i, c in enumerate(cols) if y[i] > TOLERANCE},
+                          epaTotal, np.dot(y, matrix[1, cols]), np.dot(y, matrix[2, cols]))
+    heapq.heappush(found, (epaTotal, tuple(chosen), candidate))
+    if len(found) > top:
+        heapq.heappop(found)
+    if len(found) == top:
+        _raise_threshold(found[0][0])
+
+
+def _search_subtree(node):
+    # depth-first branch-and-bound over every set made of the node's chosen steps plus any of its undecided ones
+
+    found = []
+    stack = [node]
+    explored = 0
+
+    while stack:
+
+        chosen, rest = stack.pop()
+        explored += 1
+        rest = _dead(chosen, rest)
+        if rest is None:
+            continue
+
+        if not rest:
+            _evaluate(chosen, found)
+            continue
+
+        # upper bound on every grind in this branch
+        cols, bound = _solve(chosen + rest)
+        if bound.status != 0 or -bound.fun <= _threshold() + TOLERANCE:
+            continue
+        if len(found) == _state['top'] and -bound.fun <= found[0][0] + TOLERANCE:
+            continue
+
+        _evaluate(chosen, found, (cols, bound, len(rest)))
+
+        if _state['max_size'] is not None and len(chosen) >= _state['max_size']:
+            continue
+        for i in reversed(range(len(rest))):
+            stack.append((chosen + [rest[i]], rest[i + 1:]))
+
+    return [item[2] for item in found], explored
+
+
+def _split(n, tasks):
+    # partitions the subset tree into (at least) the requested number of subtrees;
+    # the subtree (chosen, rest) holds every set made of the chosen steps plus any subset of rest,
+    # and the sets themselves are partitioned according to their first step
+
+    nodes = [([j], list(range(j + 1, n))) for j in range(n)]
+    while len(nodes) < tasks:
+
+        nodes.sort(key=lambda node: len(node[1]))
+        chosen, rest = nodes.pop()
+        if not rest:
+            nodes.append((chosen, rest))
+            break
+        nodes.append((chosen, []))
+        nodes.extend((chosen + [rest[i]], rest[i + 1:]) for i in range(len(rest)))
+
+    return nodes
+
+
+def search_grinds(stats, pool, base=[], top=10, overflow_list=[], blacklist=None, add_parameters={'NO':0},
+                  processes=None, max_size=None):
+    """
+    Searches the subsets of a pool of candidate steps for the top grinds, yielding the best ones found so far
+    every time a branch of the search finishes.
+
+    :param stats: dictionary containing all the player stats as entries of the form {'statname': score}.
+    :param pool: list of candidate steps (keys of the ALL_STEPS dictionary)
+    :param base: list of steps that are always part of the grind
+    :param top: number of grinds to keep
+    :param overflow_list: list of resources that aren't required to be completely consumed, as in Grind
+    :param blacklist: list of resources that should always be ignored when evaluating the cycle.
+    :param add_parameters: additional arguments to be passed along to certain steps, as in Grind
+    :param processes: number of worker processes, defaults to the number of cores; 1 searches in this process
+    :param max_size: maximum number of pool steps in a grind (None for no limit)
+    :return: generator of lists of Candidate instances, sorted by decreasing epaTotal
+    """
+    columns = []
+    names = []
+    overflow = list(overflow_list)
+    base_cols = []
+    pool_cols = []
+
+    for stp_name in [*base, *pool]:
+
+        if stp_name in names:
+            continue
+        temp = make_step(stp_name, stats, add_parameters)
+        if not temp:
+            continue
+        (base_cols if stp_name in base else pool_cols).append(len(columns))
+        columns.append(temp.dense())
+        names.append(stp_name)
+        for item in temp.OFresources:
+            if item not in overflow:
+                overflow.append(item)
+
+    of_cols = []
+    for item in overflow:
+
+        of_cols.append(len(columns))
+        columns.append(Overflow(item).dense())
+        names.append(item + ' Overflow')
+
+    matrix = np.array(columns).transpose()
+    if blacklist is not None:
+        keep = np.ones(LENGTH, dtype=bool)
+        keep[[REFR[item] for item in blacklist]] = False
+        matrix = matrix[keep]
+    gain = matrix[1] + EPS*matrix[2]
+
+    threshold = mp.Value('d', -np.inf)
+    lock = mp.Lock()
+    args = (matrix, gain, base_cols, pool_cols, of_cols, names, top, threshold, lock, max_size)
+    _init_search(*args)
+
+    found = {}
+
+    def merge(candidates):
+        for item in candidates:
+            found[tuple(item.steps)] = item
+        best = sorted(found.values(), key=lambda item: -item.epaTotal)[:top]
+        for key in list(found):
+            if found[key] not in best:
+                del found[key]
+        if len(best) == top:
+            _raise_threshold(best[-1].epaTotal)
+        return best
+
+    # the base grind on its own is the root of the subset tree
+    root = []
+    _evaluate([], root)
+    yield merge([item[2] for item in root])
+
+    processes = processes or os.cpu_count()
+    nodes = _split(len(pool_cols), 4*processes)
+
+    if processes == 1:
+        for node in nodes:
+            yield merge(_search_subtree(node)[0])
+        return
+
+    with ProcessPoolExecutor(processes, initializer=_init_search, initargs=args) as executor:
+        futures = [executor.submit(_search_subtree, node) for node in nodes]
+        for future in as_completed(futures):
+            yield merge(future.result()[0])
+
+
+def best_grinds(stats, pool, base=[], top=10, overflow_list=[], blacklist=None, add_parameters={'NO':0},
+                processes=None, max_size=None):
+    """
+    Returns the top grinds made of the base steps plus any subset of the pool steps; see search_grinds.
+    """
+    best = []
+    for best in search_grinds(stats, pool, base, top, overflow_list, blacklist, add_parameters, processes, max_size):
+        pass
+
+    return best
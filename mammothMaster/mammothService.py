@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+import http.client
+import io
+import json
+import socket
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from .mammothGrind import Grind, RANCHING_STEPS
+
+# Grind evaluation service:
+# a long-running local server answering "evaluate this stats/steps combination" requests, so that the tools sending
+# them don't have to start python and import numpy/scipy every time. The front end is a small asyncio HTTP server,
+# listening on a localhost port or on a Unix socket; the grinds are solved by a pool of worker processes, which stay
+# alive (and keep their recipe caches warm) between requests. Requests are JSON objects of the form
+#   {"stats": {"statname": score}, "steps": [...], "overflow_list": [...], "blacklist": [...],
+#    "add_parameters": {...}, "solver": "lp"}
+# where everything but the stats is optional, and "ranching": [...] may be given instead of "steps" to get the
+# ranching() grind with those steps added. On their way to the pool:
+#  - identical requests are only evaluated once, whether they come in while the first one is still being solved
+#    (they wait for the same result) or after it (the last results are kept in an LRU cache);
+#  - requests for the same grind (same steps and settings, different stats) that arrive within batch_window seconds
+#    of each other are sent to a worker together, up to max_batch at a time.
+# Endpoints: POST /grind (one request, or a list of them), GET /status (counters) and GET /health.
+# Start it with serve(port=...) or serve(path=...), or python -m mammothMaster.mammothService --port 8765;
+# post() sends requests from python.
+
+DEFAULTS = {'overflow_list': [], 'blacklist': None, 'add_parameters': {'NO': 0}, 'solver': 'lp'}
+
+
+def normalize(request):
+    """
+    Fills in the defaults of a request and turns a "ranching" request into the full list of steps.
+    """
+    if not isinstance(request, dict) or 'stats' not in request:
+        raise ValueError('a request must be a JSON object with a "stats" entry')
+    unknown = set(request) - {'stats', 'steps', 'ranching', *DEFAULTS}
+    if unknown:
+        raise ValueError('unknown request entries: %s' % ', '.join(sorted(unknown)))
+
+    normal = {name: request.get(name, default) for name, default in DEFAULTS.items()}
+    normal['stats'] = request['stats']
+    if 'steps' in request:
+        normal['steps'] = list(request['steps'])
+    else:
+        normal['steps'] = [*RANCHING_STEPS, *request.get('ranching', [])]
+
+    return normal
+
+
+def request_key(request):
+    # identical requests (once normalized) have identical keys
+
+    return json.dumps(request, sort_keys=True)
+
+
+def batch_key(request):
+    # requests for the same grind, whatever the stats
+
+    return json.dumps({name: value for name, value in request.items() if name != 'stats'}, sort_keys=True)
+
+
+def evaluate(request):
+    """
+    Solves the grind of a normalized request.
+
+    :return: the grind's summary (see Grind.summary) plus the list of warnings it printed, or an error message
+    """
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            grind = Grind(request['stats'], request['steps'], request['overflow_list'], request['blacklist'],
+                          request['add_parameters'], request['solver'])
+    except Exception as error:
+        return {'error': '%s: %s' % (type(error).__name__, error)}
+
+    result = grind.summary()
+    result['warnings'] = [line for line in output.getvalue().splitlines() if line.startswith(('warning', 'erorr'))]
+    return result
+
+
+def evaluate_batch(requests):
+    # runs in the worker processes: a whole batch per call, so that they share the trip and the recipe cache
+
+    return [evaluate(request) for request in requests]
+
+
+class GrindService:
+
+    def __init__(self, processes=None, batch_window=0.005, max_batch=64, cache_size=4096, executor=None):
+        """
+
+        :param processes: number of worker processes, defaults to the number of cores
+        :param batch_window: how long (in seconds) a request waits for others of the same grind to batch up with
+        :param max_batch: maximum number of requests sent to a worker at once
+        :param cache_size: number of results kept for repeated requests
+        :param executor: concurrent.futures executor to evaluate the batches with, instead of a new process pool
+        """
+        self.processes = processes
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.executor = executor
+        self.own_executor = executor is None
+        self.server = None
+
+        self.pending = {}           # requests waiting to be sent, indexed by batch key
+        self.inflight = {}          # futures of the requests being evaluated, indexed by request key
+        self.results = OrderedDict()
+        self.counters = dict(requests=0, cached=0, deduplicated=0, evaluated=0, batches=0, errors=0)
+        self.started = time.time()
+
+    async def evaluate(self, request):
+        """
+        Evaluates a single request (as described at the top of the module), batching and deduplicating it.
+
+        :return: the result dictionary, as sent back by the server
+        """
+        request = normalize(request)
+        key = request_key(request)
+        self.counters['requests'] += 1
+
+        if key in self.results:
+            self.counters['cached'] += 1
+            self.results.move_to_end(key)
+            return self.results[key]
+
+        if key in self.inflight:
+            self.counters['deduplicated'] += 1
+            return await asyncio.shield(self.inflight[key])
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.inflight[key] = future
+
+        group = batch_key(request)
+        batch = self.pending.setdefault(group, [])
+        batch.append((key, request))
+        if len(batch) >= self.max_batch:
+            self.flush(group, batch)
+        elif len(batch) == 1:
+            loop.call_later(self.batch_window, self.flush, group, batch)
+
+        return await asyncio.shield(future)
+
+    def flush(self, group, batch):
+        # sends a batch to the pool, unless it has already been sent
+
+        if self.pending.get(group) is not batch:
+            return
+        del self.pending[group]
+        asyncio.ensure_future(self.run(batch))
+
+    async def run(self, batch):
+
+        self.counters['batches'] += 1
+        self.counters['evaluated'] += len(batch)
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, evaluate_batch, [request for key, request in batch])
+        except Exception as error:
+            results = [{'error': '%s: %s' % (type(error).__name__, error)}]*len(batch)
+
+        for (key, request), result in zip(batch, results):
+
+            if 'error' in result:
+                self.counters['errors'] += 1
+            else:
+                self.results[key] = result
+                if len(self.results) > self.cache_size:
+                    self.results.popitem(last=False)
+            self.inflight.pop(key).set_result(result)
+
+    async def handle(self, reader, writer):
+        # a single HTTP/1.1 exchange per connection
+
+        try:
+            method, path, version = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, payload = await self.route(method, path, body)
+        except Exception as error:
+            status, payload = 400, {'error': '%s: %s' % (type(error).__name__, error)}
+
+        data = json.dumps(payload).encode()
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}[status]
+        writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                     b'Connection: close\r\n\r\n' % (status, reason.encode(), len(data)) + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+
+        if method == 'GET' and path == '/health':
+            return 200, {'ok': True}
+
+        if method == 'GET' and path == '/status':
+            return 200, dict(self.counters, uptime=time.time() - self.started, cache=len(self.results),
+                             inflight=len(self.inflight))
+
+        if method == 'POST' and path == '/grind':
+            payload = json.loads(body or b'null')
+            if isinstance(payload, list):
+                # every request of the list is evaluated concurrently (and may end up in the same batch)
+                results = await asyncio.gather(*[self.evaluate(item) for item in payload], return_exceptions=True)
+                return 200, [{'error': '%s: %s' % (type(result).__name__, result)}
+                             if isinstance(result, Exception) else result for result in results]
+            result = await self.evaluate(payload)
+            return (400 if 'error' in result else 200), result
+
+        return 404, {'error': 'no such endpoint: %s %s' % (method, path)}
+
+    async def start(self, host='127.0.0.1', port=8765, path=None):
+        """
+        Starts the worker pool and the server, listening on host:port or, if path is given, on a Unix socket.
+
+        :return: the asyncio server
+        """
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.processes)
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.own_executor and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def serve(host='127.0.0.1', port=8765, path=None, processes=None, batch_window=0.005, max_batch=64,
+          cache_size=4096):
+    """
+    Runs a GrindService until interrupted; see GrindService for the arguments.
+    """
+    async def main():
+        service = GrindService(processes, batch_window, max_batch, cache_size)
+        server = await service.start(host, port, path)
+        print('serving on %s' % (path or '%s:%d' % server.sockets[0].getsockname()[:2]))
+        try:
+            await server.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    # http.client over a Unix socket
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def post(payload, host='127.0.0.1', port=8765, path=None, endpoint='/grind', timeout=None):
+    """
+    Sends a request (or a list of them) to a running service and returns its answer.
+
+    :param path: Unix socket of the service, instead of host and port
+    :param endpoint: '/grind' to evaluate the payload, '/status' or '/health' to query the service (payload None)
+    """
+    connection = UnixHTTPConnection(path, timeout) if path is not None else \
+        http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        if payload is None:
+            connection.request('GET', endpoint)
+        else:
+            connection.request('POST', endpoint, json.dumps(payload), {'Content-Type': 'application/json'})
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='mammothMaster grind evaluation service')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on (default: 8765)')
+    parser.add_argument('--socket', metavar='PATH', help='listen on a Unix socket instead')
+    parser.add_argument('--processes', type=int, help='number of worker processes (default: one per core)')
+    parser.add_argument('--batch-window', type=float, default=0.005,
+                        help='seconds a request waits for others of the same grind (default: 0.005)')
+    parser.add_argument('--max-batch', type=int, default=64, help='largest batch sent to a worker (default: 64)')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.socket, args.processes, args.batch_window, args.max_batch)
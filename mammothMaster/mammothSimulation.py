@@ -0,0 +1,443 @@
+from statistics import NormalDist
+import numpy as np
+from . import mammothRecipe
+from .mammothRecipe import ALL_STEPS, REFR, LENGTH, broad, narrow
+from .mammothKernels import RecipeKernel, RECIPE_SPECS, kernel, _column
+from .mammothBuild import TrackedBuild
+
+# Cycle simulation:
+# epaTotal is an expected value: the recipes count every check by its chance of success and every failed sale by the
+# average number of retries. Actually playing the optimal cycle, the echoes per action wander around it, and by how
+# much says how long it takes before the grind pays what it promises. simulate() plays the cycle of a solved grind
+# over and over, a million times by default, with every check, retry and menace heal drawn at random:
+#  - the checks changing what a step gives are drawn by the samplers of SAMPLERS (Painting, the skeletons whose
+#    limbs, skull, tail and carving decide what they're worth, and the buyers whose disguises or limb checks do): the
+#    skeletons are drawn from the builds of their recipes (see mammothBuild.TrackedBuild), the others follow the
+#    recipe functions step by step;
+#  - the other steps of RECIPE_SPECS run through their spec, with every failed check and sale redrawn as a number of
+#    retries (each one costing an action and the heals of its menace), and everything else at its expected value;
+#  - the remaining steps (overflows, the steps without a spec and the ones whose spec has no retries) have nothing
+#    left to chance and count for their expected resources every time.
+# Which steps are random only depends on their recipes (is_random), never on the draws. A few checks are still taken
+# at their expected value: the wanders of the Balmoral woods, the draws of the tentacle Helicon rounds and the theft
+# of Steal Antique Mystery.
+# A cycle is the grind's solution scaled to cycle_actions actions, every step taken a whole number of times (the
+# fractions of a run are rounded up or down at random, so that on average the counts are right). What a run makes is
+# valued at the grind's shadow prices, so that the intermediate resources a run makes or uses count for what they are
+# worth to the rest of the cycle; over many cycles the echoes per action come back to epaTotal. Runs are drawn in
+# batches of a few ten thousands with numpy's Generator, which keeps a million cycles to a few seconds.
+#   result = simulate(grind, cycles=10**6, seed=1)
+#   result.print_summary()
+#   result.actions_needed(0.01)     # actions before the average is within 1% of epaTotal (95% of the time)
+
+
+def _charge(out, menace, fails, cp):
+    # every failed attempt costs an action, plus the actions healing the menace it gives
+
+    out[:, 0] += fails*(1 + cp/3/(1 + mammothRecipe.social_heals))
+    menace += fails*cp
+
+def _sale(out, menace, rng, multiplier, score, cp, implausibility, sold=None):
+    # a sale is retried until it goes through; implausibility (and which runs sell at all) may differ between runs
+
+    fails = rng.geometric(broad(multiplier*implausibility, score)) - 1
+    _charge(out, menace, fails if sold is None else fails*sold, cp)
+
+
+class SimulationKernel(RecipeKernel):
+    # a RecipeKernel drawing its failed checks and sales at random, one run per row
+
+    def __init__(self, stp_name, spec):
+
+        self.draws = False      # whether the spec has any penalty to draw at all
+        super().__init__(stp_name, spec)
+
+    def compile(self, effects):
+
+        compiled = []
+        for effect in effects:
+
+            kind = effect[0]
+            if kind in ('action', 'menace', 'sell'):
+                self.draws = True
+
+            if kind in ('action', 'menace'):
+                difficulty, score = self.expression(effect[1]), self.expression(effect[2])
+                cp, mode = (self.expression(0), effect[3]) if kind == 'action' else \
+                    (self.expression(effect[3]), effect[4])
+                compiled.append(lambda ns, out, difficulty=difficulty, score=score, cp=cp, mode=mode:
+                                _sample_penalty(ns, out, difficulty(ns), score(ns), cp(ns), mode))
+
+            elif kind == 'sell':
+                values = [self.expression(value) for value in effect[1:]]
+                compiled.append(lambda ns, out, values=values: _sample_sale(ns, out, *[value(ns) for value in values]))
+
+            else:
+                # (the branches of an 'if' come back through here)
+                compiled.extend(super().compile([effect]))
+
+        return compiled
+
+    def sample(self, stats, n, rng, *params):
+        """
+        Draws n runs of the step for a single stat profile.
+
+        :param stats: dictionary of the player stats, as numbers
+        :param n: number of runs
+        :param rng: numpy Generator
+        :param params: additional parameters of the step, as passed to the recipe function
+        :return: (n x LENGTH) array of the resource changes of every run and array of the menace CP each one caused,
+            or None if the step isn't available
+        """
+        namespace = self.namespace(params)
+        if not self.available(namespace):
+            return None
+
+        for name in self.reads:
+            namespace[name] = np.asarray(stats[name]).reshape(1, 1)
+        # the sales of a spec are the different ways the same item may be sold, so a run makes at most one of them:
+        # a single draw per run picks it, every sale taking the next slice of the unit interval
+        namespace.update(_rng=rng, _menace=np.zeros(n), _draw=rng.random(n), _sold=np.zeros(n))
+
+        out = np.repeat(self.fixed[np.newaxis], n, 0)
+        for effect in self.effects:
+            effect(namespace, out)
+
+        return out, namespace['_menace']
+
+
+def _sample_penalty(ns, out, difficulty, score, cp, mode):
+
+    p = _column(mammothRecipe.checks[mode](difficulty, score), out)
+    _charge(out, ns['_menace'], ns['_rng'].geometric(p) - 1, cp)
+
+def _sample_sale(ns, out, multiplier, score, cp, implausibility, chance):
+
+    n = len(out)
+    chance = np.atleast_2d(np.asarray(chance, dtype=float))
+    p = np.broadcast_to(np.atleast_2d(broad(multiplier*np.asarray(implausibility), score)), (n, chance.shape[-1]))
+
+    start, draw = ns['_sold'], ns['_draw']
+    outcome = (draw[:, np.newaxis] >= start[:, np.newaxis] + np.cumsum(chance, -1)).sum(-1)
+    sold = (draw >= start) & (outcome < chance.shape[-1])
+    ns['_sold'] = start + chance.sum(-1)
+
+    fails = np.zeros(n)
+    fails[sold] = ns['_rng'].geometric(p[sold, outcome[sold]]) - 1
+    _charge(out, ns['_menace'], fails, cp)
+
+
+## samplers of the steps whose checks change what they give
+
+def _fixed(stp_name, n):
+
+    return np.repeat(kernel(stp_name).fixed[np.newaxis], n, 0), np.zeros(n)
+
+def sample_painting(stats, n, rng):
+
+    out, menace = _fixed('Painting', n)
+    paint = narrow(200, stats['Persuasive'])
+    out[:, REFR['Echoes']] += 20*(rng.binomial(6, paint, n) >= 3)
+
+    return out, menace
+
+def _sample_skeleton(stp_name, build, stats, n, rng, multiplier, cp):
+    # draws n skeletons of the build of a recipe (a TrackedBuild) and sells them; the skeletons are worth 5 scrip per
+    # point of antiquity times menace, as in the recipes (nothing for the builds that don't follow either)
+
+    out, menace = _fixed(stp_name, n)
+    runs = build.draw(n, rng)
+    for name in build.tracked:
+        out[:, REFR[name]] += runs[name]
+    out[:, REFR['Scrip']] += 5*mammothRecipe.antiquity_menace(runs)
+    _sale(out, menace, rng, multiplier, stats['Shadowy'], cp, runs['Implausibility'])
+
+    return out, menace
+
+def sample_hell_mammoth(stats, n, rng, scrimshander_knife=1):
+
+    build = mammothRecipe.hell_build(stats, scrimshander_knife, TrackedBuild)
+    return _sample_skeleton('Mammoth from Hell', build, stats, n, rng, 75, 5)
+
+def sample_zee_mammoth(stats, n, rng):
+
+    return _sample_skeleton('Mammoth of the Zee', mammothRecipe.zee_build(stats, TrackedBuild), stats, n, rng, 75, 5)
+
+def sample_winged_mammoth(stats, n, rng):
+
+    return _sample_skeleton('One-winged Mammoth', mammothRecipe.winged_build(stats, TrackedBuild), stats, n, rng, 75, 5)
+
+def sample_easy_mammoth(stats, n, rng):
+
+    out, menace = _sample_skeleton('Easy Mammoth', mammothRecipe.easy_build(stats, TrackedBuild), stats, n, rng, 75, 5)
+    if mammothRecipe.scrimshander_knife != 0:
+        _charge(out, menace, rng.geometric(narrow(6, stats['Mith']), n) - 1, 0)
+
+    return out, menace
+
+def sample_holy_mammoth(stats, n, rng, scrimshander_knife=1):
+
+    if scrimshander_knife == 0:
+        return None
+
+    out, menace = _sample_skeleton('Holy Mammoth', mammothRecipe.holy_build(stats, TrackedBuild), stats, n, rng, 50, 2)
+    _charge(out, menace, rng.geometric(narrow(6, stats['Mith']), n) - 1, 0)
+    _charge(out, menace, rng.geometric(narrow(6, stats['AotRS']), n) - 1, 2)
+
+    return out, menace
+
+def sample_ungodly_mammoth(stats, n, rng):
+
+    # (the rumours lost to failed legs stay at their expected value, as the recipe doesn't say how they're lost)
+    build = mammothRecipe.ungodly_build(stats, TrackedBuild)
+    out, menace = _sample_skeleton('Ungodly Mammoth', build, stats, n, rng, 50, 2)
+    out[:, REFR['URRumours']] -= 3*(1 - narrow(5, stats['Mith']))
+    _charge(out, menace, rng.geometric(narrow(6, stats['AotRS']), n) - 1, 2)
+
+    return out, menace
+
+def sample_generator_skeleton(stats, n, rng):
+
+    out, menace = _fixed('Generator Skeleton', n)
+    out[:, REFR['Scrip']] += 5*(rng.random(n) < broad(200, stats['Persuasive']))
+
+    return out, menace
+
+def sample_zailor(stats, n, rng):
+
+    out, menace = _fixed('Sell to Zailor', n)
+    limbs = rng.binomial(2, narrow(11, stats['MAnatomy']), n)
+    out[:, REFR['Scintillack']] += (limbs == 1) + 4*(limbs == 2)
+
+    chimera = rng.random(n) < narrow(11, stats['Mith'])
+    _sale(out, menace, rng, 75, stats['Shadowy'], 2, np.where(chimera, 3, 6))
+
+    return out, menace
+
+def sample_theologian(stats, n, rng):
+
+    build = mammothRecipe.theologian_build(stats, TrackedBuild)
+    return _sample_skeleton('Sell to Theologian', build, stats, n, rng, 25, 3.5)
+
+# samplers taking (stats, n, rng, *params) and returning the resources and menace of n runs (None if the step isn't
+# available), indexed by step name; they take precedence over the spec of the step
+SAMPLERS = {'Painting': sample_painting, 'Mammoth from Hell': sample_hell_mammoth,
+            'Mammoth of the Zee': sample_zee_mammoth, 'One-winged Mammoth': sample_winged_mammoth,
+            'Easy Mammoth': sample_easy_mammoth, 'Holy Mammoth': sample_holy_mammoth,
+            'Ungodly Mammoth': sample_ungodly_mammoth, 'Generator Skeleton': sample_generator_skeleton,
+            'Sell to Zailor': sample_zailor, 'Sell to Theologian': sample_theologian}
+
+
+SIMULATION_KERNELS = {}     # compiled kernels, indexed by step name
+
+def simulation_kernel(stp_name):
+
+    if stp_name not in SIMULATION_KERNELS:
+        SIMULATION_KERNELS[stp_name] = SimulationKernel(stp_name, RECIPE_SPECS[stp_name])
+    return SIMULATION_KERNELS[stp_name]
+
+def is_random(stp_name):
+    """
+    :return: whether runs of the step are drawn at random: it has a sampler, or its spec has checks or sales whose
+        failures are retried (whatever the chances of the stats at hand, so that the same steps always are)
+    """
+    return stp_name in SAMPLERS or stp_name in RECIPE_SPECS and simulation_kernel(stp_name).draws
+
+def sample_step(stp_name, stats, n, rng, add_parameters={'NO': 0}):
+    """
+    Draws n runs of a step for a single stat profile (see the top of the module).
+
+    :param add_parameters: additional arguments to be passed along to certain steps, as taken by make_step
+    :return: (n x LENGTH) array of the resource changes of every run and array of the menace CP each one caused, or
+        None if the step has neither a sampler nor a spec (nothing in it is left to chance) or isn't available
+    """
+    params = (add_parameters[stp_name],) if stp_name in add_parameters else ()
+    if stp_name in SAMPLERS:
+        return SAMPLERS[stp_name](stats, n, rng, *params)
+
+    if stp_name not in RECIPE_SPECS:
+        return None
+
+    return simulation_kernel(stp_name).sample(stats, n, rng, *params)
+
+
+def verify_samplers(stats, steps=None, runs=10**5, seed=None, add_parameters={'NO': 0}):
+    """
+    Checks the average runs of the steps against their recipe functions, under the current toggles.
+
+    :param stats: dictionary of the player stats
+    :param steps: names of the steps to check, defaults to all the ones with a sampler or a spec
+    :param runs: number of runs drawn per step
+    :return: dictionary of the largest difference between the average run and the recipe (resources and menace),
+        in standard errors of the average, indexed by step name; below 4 or so all is well
+    """
+    from .mammothGrind import make_step
+
+    rng = np.random.default_rng(seed)
+    errors = {}
+    for stp_name in (list(SAMPLERS) + [name for name in RECIPE_SPECS if name not in SAMPLERS]
+                     if steps is None else steps):
+
+        instance = make_step(stp_name, stats, add_parameters)
+        sample = sample_step(stp_name, stats, runs, rng, add_parameters)
+        if not instance or sample is None:
+            continue
+
+        drawn = np.column_stack(sample)
+        expected = np.append(instance.dense(), instance.menace)
+        error = np.sqrt(drawn.var(0)/runs)
+        difference = np.abs(drawn.mean(0) - expected)
+        # (resources that come out the same every time have to match, up to rounding)
+        random = error > 1e-9*np.maximum(1, np.abs(expected))
+        errors[stp_name] = float(np.where(random, difference/np.where(random, error, 1),
+                                          np.where(difference > 1e-9*np.maximum(1, np.abs(expected)), np.inf, 0)).max())
+
+    return errors
+
+
+class Simulation:
+
+    def __init__(self, steps, epaTotal, cycle_actions, totals, contributions, quantiles, horizons):
+        """
+
+        :param steps: list of the steps of the cycle
+        :param epaTotal: epaTotal of the grind
+        :param cycle_actions: expected number of actions per simulated cycle
+        :param totals: dictionary of the arrays of echoes (valued at the shadow prices), actions and menace CP of
+            every simulated cycle
+        :param contributions: dictionary of the part of the variance of echoes per action due to every random step
+        :param quantiles: quantiles at which the echoes per action are read
+        :param horizons: dictionary of the quantiles of the echoes per action over a given number of actions, indexed
+            by that number
+        """
+        self.steps = steps
+        self.epaTotal = epaTotal
+        self.cycle_actions = cycle_actions
+        self.cycles = len(totals['actions'])
+        self.quantiles = quantiles
+        self.horizons = horizons
+        self.contributions = contributions
+
+        echoes, actions, menace = totals['echoes'], totals['actions'], totals['menace']
+        self.actions = actions.sum()
+        self.epa = echoes.sum()/self.actions
+        self.menace = menace.sum()/self.actions
+        # cycles are independent, so the variance of a long run of them grows with the number of actions
+        self.variance = np.var(echoes - self.epa*actions)/actions.mean()
+        self.menace_variance = np.var(menace - self.menace*actions)/actions.mean()
+        self.std = np.sqrt(self.variance)
+        self.error = self.std/np.sqrt(self.actions)
+
+    def actions_needed(self, precision=0.01, confidence=0.95):
+        """
+        :return: number of actions after which the echoes per action are within precision (relative) of their mean,
+            with the given confidence
+        """
+        z = NormalDist().inv_cdf(0.5 + confidence/2)
+        return (z*self.std/(precision*self.epa))**2
+
+    def print_summary(self):
+
+        print('%d cycles of %g actions: epa %.6f +- %.6f (epaTotal %.6f)'
+              % (self.cycles, self.cycle_actions, self.epa, self.error, self.epaTotal))
+        print('standard deviation %.4f echoes per sqrt(action), menace %.4f +- %.4f CP per action'
+              % (self.std, self.menace, np.sqrt(self.menace_variance)))
+        print('actions to converge (95%%): %.0f within 10%%, %.0f within 1%%'
+              % (self.actions_needed(0.1), self.actions_needed(0.01)))
+        print('%10s' % 'actions' + ''.join('%9.0f%%' % (100*q) for q in self.quantiles))
+        for horizon, values in self.horizons.items():
+            print('%10d' % horizon + ''.join('%10.4f' % value for value in values))
+        for step, part in sorted(self.contributions.items(), key=lambda item: -item[1]):
+            print('  %5.1f%% of the variance: %s' % (100*part/self.variance, step))
+
+
+def simulate(grind, cycles=10**6, cycle_actions=100, seed=None, horizons=(100, 1000, 10000),
+             quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99), batch=2**16):
+    """
+    Plays the optimal cycle of a solved grind many times over, drawing every check at random (see the top of the
+    module). The grind itself isn't changed.
+
+    :param grind: solved Grind instance (of any backend)
+    :param cycles: number of cycles simulated
+    :param cycle_actions: expected number of actions per cycle
+    :param seed: seed of the random number generator, for repeatable results
+    :param horizons: numbers of actions over which the quantiles of the echoes per action are read (rounded to whole
+        cycles; the ones not fitting at least 20 times in the simulation are skipped)
+    :param quantiles: quantiles read at every horizon
+    :param batch: largest number of runs of a step drawn at once, which bounds the memory used
+    :return: Simulation instance
+    """
+    if np.isnan(grind.epaTotal) or np.isnan(grind.shadow_prices).any():
+        raise ValueError('the grind has no solution or no shadow prices to simulate')
+
+    rng = np.random.default_rng(seed)
+    matrix = grind.matrix.toarray() if grind.sparse else np.asarray(grind.matrix)
+    # what the runs make is valued at the shadow prices, leaving out the actions they take (and the resources the
+    # grind ignores)
+    price = np.zeros(LENGTH)
+    for i, res in enumerate(grind.reses[1:], 1):
+        price[REFR[res]] = grind.shadow_prices[i]
+
+    # the steps with nothing left to chance count for their column of the resource matrix (and the menace of their
+    # recipe) every time
+    from .mammothGrind import make_step
+
+    fixed, random = [], []
+    for j in np.flatnonzero(grind.solution > 1e-12):
+
+        step = grind.steps[j]
+        runs = grind.solution[j]*cycle_actions
+        if is_random(step):
+            random.append((step, runs))
+        else:
+            instance = make_step(step, grind.stats, grind.add_parameters) if step in ALL_STEPS else 0
+            fixed.append((runs, grind.shadow_prices[1:] @ matrix[1:, j], matrix[0, j],
+                          instance.menace if instance else 0.))
+
+    totals = {name: np.zeros(cycles) for name in ('echoes', 'actions', 'menace')}
+    moments = {step: np.zeros(3) for step, runs in random}
+    # as many cycles at a time as keep every step under batch runs
+    block = int(np.clip(batch/max([runs for step, runs in random] + [1.]), 1, cycles))
+    for start in range(0, cycles, block):
+
+        size = min(block, cycles - start)
+        echoes, actions, menace = [total[start:start + size] for total in totals.values()]
+        for runs, value, cost, cp in fixed:
+            count = np.floor(runs) + (rng.random(size) < runs % 1)
+            echoes += count*value
+            actions += count*cost
+            menace += count*cp
+
+        for step, runs in random:
+
+            count = (np.floor(runs) + (rng.random(size) < runs % 1)).astype(int)
+            cycle = np.repeat(np.arange(size), count)
+            for first in range(0, len(cycle), batch):
+
+                out, cp = sample_step(step, grind.stats, len(cycle[first:first + batch]), rng, grind.add_parameters)
+                value, cost = out @ price, out[:, 0]
+                which = cycle[first:first + batch]
+                echoes += np.bincount(which, value, size)
+                actions += np.bincount(which, cost, size)
+                menace += np.bincount(which, cp, size)
+                moments[step] += [value @ value, value @ cost, cost @ cost]
+
+    simulation = Simulation(list(grind.steps), grind.epaTotal, cycle_actions, totals, {}, np.array(quantiles), {})
+
+    # runs are independent, so the variance per action splits into the part of every step: the spread of its runs
+    # around the average epa
+    epa = simulation.epa
+    simulation.contributions = {step: (vv - 2*epa*va + epa**2*aa)/simulation.actions
+                                for step, (vv, va, aa) in moments.items()}
+
+    for horizon in horizons:
+        size = max(1, int(round(horizon/cycle_actions)))
+        windows = cycles//size
+        if windows < 20:
+            continue
+        echoes = totals['echoes'][:windows*size].reshape(windows, size).sum(1)
+        actions = totals['actions'][:windows*size].reshape(windows, size).sum(1)
+        # (short cycles may have rounded every step down)
+        simulation.horizons[size*cycle_actions] = np.quantile(echoes[actions > 0]/actions[actions > 0], quantiles)
+
+    return simulation
@@ -0,0 +1,258 @@
+import numpy as np
+from .mammothRecipe import RES, REFR, LENGTH, EPS, Overflow, recipe_batch
+from .mammothGrind import RANCHING_STEPS, make_step, optimize_kernel, lp_cycle
+from . import mammothCache
+from .mammothCache import StatsRecorder
+from .mammothKernels import kernel
+
+# The sweep class:
+# evaluates the same grind over a whole grid of player stats at once.
+# Most recipes only read two or three of the stats, so rather than rebuilding every step for every point of the grid
+# each step is only built once for every distinct combination of the stats it actually reads; the resulting columns
+# are then scattered back into a (stat-point x resource x step) tensor with plain numpy indexing, and all the
+# resource matrices are decomposed with a single batched SVD.
+# With compiled=True the steps described in mammothKernels.RECIPE_SPECS skip the recipe functions altogether and get
+# all their distinct resource arrays out of a single call to their compiled kernel.
+
+
+class Sweep:
+
+    def __init__(self, stats, steps, overflow_list=[], blacklist=None, add_parameters={'NO':0}, batch_size=4096,
+                 solver='lp', compiled=False):
+        """
+
+        :param stats: dictionary containing all the player stats as entries of the form {'statname': score}, where
+            every score may be either a number or an array of numbers; all the arrays are broadcast together and
+            every element of the broadcast shape is evaluated as a separate stat point.
+        :param steps: list of the steps involved in the cycle,
+            each stored as the string corresponding to the function in the ALL_STEPS dictionary.
+        :param overflow_list: list of resources that are involved in the grind but aren't required to be completely consumed;
+            will create additional "overflow" steps for each one to be put into.
+        :param blacklist: list of resources that should always be ignored when evaluating the cycle.
+        :param add_parameters: additional arguments to be passed along to certain steps that accept additional inputs
+            (example: strategies for balmoral runs), of the form dict('step name': [list of parameters])
+        :param batch_size: number of distinct grinds assembled and decomposed at once; bounds the memory used by
+            the (stat-point x resource x step) tensor.
+        :param solver: backend used for the grinds with more than one possible cycle, as in Grind:
+            'lp' (exact linear program, also used for the single cycles that aren't practicable) or 'svd' (local
+            optimization over the nullspace).
+        :param compiled: whether to build the steps with their compiled kernels (see mammothKernels) where available;
+            the results agree with the recipe functions up to rounding errors.
+        """
+        self.stat_names = list(stats)
+        values = np.broadcast_arrays(*[np.asarray(stats[name]) for name in self.stat_names])
+        self.shape = values[0].shape
+        self.size = int(np.prod(self.shape, dtype=int))
+        self.stats = dict(zip(self.stat_names, [v.reshape(-1) for v in values]))
+        self.overflow_list = list(overflow_list)
+        self.batch_size = batch_size
+        self.solver = solver
+        self.compiled = compiled
+
+        self.steps = []
+        self.step_ref = {}
+        self.ref = {}
+
+        # every step is stored as a table of its distinct resource arrays plus, for every stat point,
+        # the index of the row of that table it uses
+        tables = []
+        indices = []
+
+        with mammothCache.building():
+            for stp_name in steps:
+
+                built = self.build_step(stp_name, add_parameters)
+                if built is None:
+                    continue
+                table, index, overflow = built
+                tables.append(table)
+                indices.append(index)
+                self.step_ref[stp_name] = len(self.steps)
+                self.steps.append(stp_name)
+                for item in overflow:
+                    if item not in self.overflow_list:
+                        self.overflow_list.append(item)
+
+        for item in self.overflow_list:
+
+            tables.append(Overflow(item).dense()[np.newaxis])
+            indices.append(np.zeros(self.size, dtype=int))
+            self.step_ref[item + ' Overflow'] = len(self.steps)
+            self.steps.append(item + ' Overflow')
+
+        self.dim1 = len(self.steps)
+
+        # resources that are never touched at any of the stat points get removed, just like in Grind
+        inv_mask = np.zeros(LENGTH, dtype=bool)
+        if blacklist is not None:
+            for item in blacklist:
+                inv_mask[REFR[item]] = True
+        used = np.zeros(LENGTH, dtype=bool)
+        for table in tables:
+            used |= (table != 0).any(0)
+        self.mask = ~inv_mask & used
+        self.reses = RES[self.mask]
+        self.dim0 = len(self.reses)
+        for i in range(self.dim0):
+            self.ref[self.reses[i]] = i
+        self.tables = [table[:, self.mask] for table in tables]
+
+        # stat points sharing the same row in every table share the same resource matrix and are only solved once
+        self.index = np.stack(indices, 1)
+        self.unique, self.inverse = np.unique(self.index, axis=0, return_inverse=True)
+        self.inverse = self.inverse.reshape(-1)
+
+        self.solve()
+
+    def build_step(self, stp_name, add_parameters):
+        """
+        Builds the resource arrays of one step for all the stat points.
+
+        :return: a (distinct arrays x LENGTH) table, the table row used by each stat point and the step's
+            overflow resources; or None if the step isn't available with the current settings
+        """
+        if self.compiled and kernel(stp_name) is not None:
+            return self.build_compiled(stp_name, add_parameters)
+
+        base = {name: self.stats[name][0] for name in self.stat_names}
+        probe = StatsRecorder(base)
+        if not make_step(stp_name, probe, add_parameters):
+            return None
+
+        read = sorted(probe.read)
+        while True:
+
+            # find every distinct combination of the stats read by this step
+            if read:
+                columns = np.stack([self.stats[name] for name in read], 1)
+                combos, first, index = np.unique(columns, axis=0, return_index=True, return_inverse=True)
+                index = index.reshape(-1)
+            else:
+                combos, first, index = np.empty((1, 0)), np.zeros(1, dtype=int), np.zeros(self.size, dtype=int)
+
+            batch = recipe_batch(len(combos))
+            extra = set()
+            for j in range(len(combos)):
+
+                point = StatsRecorder(base)
+                point.update({name: self.stats[name][first[j]] for name in read})
+                temp = make_step(stp_name, point, add_parameters)
+                # recipes may branch on the stats, so check that we haven't missed any stat the step reads
+                extra |= point.read - set(read)
+                if temp:
+                    batch[j] = temp
+
+            if not extra:
+                return batch.resources, index, batch.OFresources()
+            read = sorted(set(read) | extra)
+
+    def build_compiled(self, stp_name, add_parameters):
+        # same as build_step, with the compiled kernel working out every distinct resource array at once
+
+        step = kernel(stp_name)
+        params = (add_parameters[stp_name],) if stp_name in add_parameters else ()
+        if not step.exists(*params):
+            return None
+
+        if step.reads:
+            columns = np.stack([self.stats[name] for name in step.reads], 1)
+            combos, index = np.unique(columns, axis=0, return_inverse=True)
+            index = index.reshape(-1)
+        else:
+            combos, index = np.empty((1, 0)), np.zeros(self.size, dtype=int)
+
+        # (np.unique stacks the stats into a common dtype, so the integer ones are turned back into integers)
+        values = {name: combos[:, i].astype(self.stats[name].dtype) for i, name in enumerate(step.reads)}
+        table = step(values, *params).reshape(len(combos), -1)
+
+        return table, index, list(step.overflow)
+
+    def solve(self):
+
+        n = len(self.unique)
+        grind_dim = np.zeros(n, dtype=int)
+        solutions = np.full((n, self.dim1), np.nan)
+        totals = np.empty((3, n)) # actions, echoes and scrip per cycle of each distinct grind
+
+        for start in range(0, n, self.batch_size):
+
+            batch = self.tensor(slice(start, start + self.batch_size))
+            # np.linalg.svd works on stacks of matrices, decomposing every one of them in a single call
+            l, v, r = np.linalg.svd(batch[:, 3:])
+            dims = self.dim1 - v.shape[1] + np.isclose(v, 0, atol=5e-16).sum(1)
+            grind_dim[start:start + len(batch)] = dims
+
+            # grind_dim == 1: the only possible cycle is the last row of r
+            single = dims == 1
+            solutions[start:start + len(batch)][single] = r[single, -1]
+            others = dims > 1
+            if self.solver == 'lp':
+                # as in Grind.solve_lp, a single cycle with entries of both signs is left to the linear program
+                signs = np.sign(r[:, -1])
+                others |= single & (np.abs(signs.sum(1)) != np.abs(signs).sum(1))
+
+            # otherwise optimize one matrix at a time, as done in Grind.solve
+            for k in np.flatnonzero(others):
+
+                gain = batch[k, 1] + EPS*batch[k, 2]
+                if self.solver == 'lp':
+                    result = lp_cycle(batch[k], gain)
+                    solutions[start + k] = result.x if result.status == 0 else np.nan
+                else:
+                    basis = r[k, -dims[k]:].transpose()
+                    result = optimize_kernel(basis, gain, batch[k, 0])
+                    if result.success:
+                        solutions[start + k] = np.matmul(basis, result.x)
+
+            totals[:, start:start + len(batch)] = np.einsum('ks,kis->ik', solutions[start:start + len(batch)],
+                                                            batch[:, :3])
+
+        actions, echoes, scrip = totals
+        with np.errstate(invalid='ignore', divide='ignore'):
+            epaTotal = (echoes + EPS*scrip)/actions
+            epa = echoes/actions
+            spa = scrip/actions
+            # every cycle is scaled so that it takes exactly one action, which also fixes the arbitrary sign of
+            # the SVD solutions
+            solutions = solutions/actions[:, np.newaxis]
+
+        self.unique_solution = solutions
+        self.solution = solutions[self.inverse].reshape(*self.shape, self.dim1)
+
+        # same reality check as in Grind.solve: a cycle is only practicable if none of its entries have opposite signs
+        signs = np.sign(solutions)
+        practicable = np.abs(signs.sum(1)) == np.abs(signs).sum(1)
+        practicable &= grind_dim > 0
+
+        self.epaTotal = epaTotal[self.inverse].reshape(self.shape)
+        self.epa = epa[self.inverse].reshape(self.shape)
+        self.spa = spa[self.inverse].reshape(self.shape)
+        self.practicable = practicable[self.inverse].reshape(self.shape)
+        self.grind_dim = grind_dim[self.inverse].reshape(self.shape)
+
+    def tensor(self, which=slice(None)):
+        """
+        Assembles the (grind x resource x step) tensor for the selected distinct grinds.
+
+        :param which: index or slice into the distinct grinds (self.unique)
+        """
+        rows = self.unique[which]
+        return np.stack([self.tables[j][rows[..., j]] for j in range(self.dim1)], -1)
+
+    def point(self, idx):
+        """
+        Returns the stats dictionary of a single stat point, indexed by its position in the sweep's shape.
+        """
+        flat = np.ravel_multi_index(idx, self.shape) if self.shape else 0
+        return {name: self.stats[name][flat] for name in self.stat_names}
+
+
+def ranching_sweep(*args, stats, overflow_list=[], blacklist=None, add_parameters={'NO':0}, batch_size=4096,
+                   solver='lp', compiled=False):
+
+    default = list(RANCHING_STEPS)
+
+    for lists in args:
+        default = [*default, *lists]
+
+    return Sweep(stats, default, overflow_list, blacklist, add_parameters, batch_size, solver, compiled)